@@ -0,0 +1,129 @@
+"""
+Collector Runtime Benchmark
+Runs simulated devices under the thread-per-device model and the asyncio
+runtime and reports completed polls, CPU time, peak memory and OS threads.
+Each device waits a fixed network latency per poll (time.sleep in threads,
+asyncio.sleep on the loop) and returns a small batch; batches are only
+counted. Every run is a fresh subprocess so memory numbers do not mix.
+
+Usage: python benchmarks/bench_collector_runtime.py [seconds] [devices ...]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import json
+import subprocess
+import threading
+import time
+from collectors.scheduler import PollScheduler
+
+POLL_INTERVAL = 1.0  # seconds; shortened from the real 10s so a run sees several polls
+LATENCY = 0.02  # seconds of simulated network wait per poll
+
+class SimulatedCollector:
+    """Stands in for SNMPCollector: same run()/collect_async() surface, no network"""
+    protocol = 'SNMP'
+    
+    def __init__(self, index):
+        self.device_id = f'sim_{index:05d}'
+        self.poll_interval = POLL_INTERVAL
+    
+    def _metrics(self):
+        return [
+            {'device_id': self.device_id, 'protocol': 'SNMP', 'parameter': parameter, 'value': '42'}
+            for parameter in ('cpu_usage', 'memory_usage', 'uptime')
+        ]
+    
+    def collect(self):
+        time.sleep(LATENCY)
+        return self._metrics()
+    
+    async def collect_async(self):
+        await asyncio.sleep(LATENCY)
+        return self._metrics()
+    
+    def run(self, callback=None):
+        # Same deadline loop as the real collectors' run()
+        scheduler = PollScheduler()
+        scheduler.add(self.device_id, self.poll_interval, time.monotonic())
+        while True:
+            time.sleep(max(0.0, scheduler.next_due() - time.monotonic()))
+            if not scheduler.pop_due(time.monotonic()):
+                continue
+            started = time.monotonic()
+            metrics = self.collect()
+            if callback and metrics:
+                callback(metrics)
+            scheduler.finished(self.device_id, time.monotonic() - started, self.poll_interval)
+
+def peak_rss_mb():
+    """Peak resident set size of this process (VmHWM), in MB"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_model(model, devices, seconds):
+    """Run one model in this process and return its measurements"""
+    from collectors.async_runtime import CollectorRuntime
+    
+    batches = [0]
+    lock = threading.Lock()
+    
+    def callback(metrics):
+        with lock:
+            batches[0] += 1
+    
+    collectors = [SimulatedCollector(i) for i in range(devices)]
+    baseline_mb = peak_rss_mb()
+    cpu_started = time.process_time()
+    
+    if model == 'threads':
+        for collector in collectors:
+            thread = threading.Thread(target=collector.run, args=(callback,), daemon=True)
+            thread.start()
+    else:
+        runtime = CollectorRuntime(max_concurrency={'SNMP': devices})
+        runtime.start(collectors, callback)
+    
+    time.sleep(seconds)
+    result = {
+        'model': model,
+        'devices': devices,
+        'polls': batches[0],
+        'cpu_seconds': time.process_time() - cpu_started,
+        'peak_mb': peak_rss_mb() - baseline_mb,
+        'threads': threading.active_count(),
+    }
+    if model != 'threads':
+        runtime.stop()
+    return result
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        model, devices, seconds = sys.argv[2], int(sys.argv[3]), float(sys.argv[4])
+        print(json.dumps(run_model(model, devices, seconds)))
+        os._exit(0)  # the thread model's workers never return
+    
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    sizes = [int(arg) for arg in sys.argv[2:]] or [1000, 10000]
+    
+    print(f"[Benchmark] {seconds:.0f}s per run, poll every {POLL_INTERVAL}s, {LATENCY * 1000:.0f} ms latency per poll")
+    print(f"  {'devices':>7} {'model':>8} {'polls/s':>8} {'target':>8} {'cpu s':>7} {'cpu %':>6} {'MB':>7} {'threads':>8}")
+    for devices in sizes:
+        for model in ('threads', 'async'):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', model, str(devices), str(seconds)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"  {devices:>7} {model:>8} {result['polls'] / seconds:>8.0f} {devices / POLL_INTERVAL:>8.0f} "
+                  f"{result['cpu_seconds']:>7.2f} {100 * result['cpu_seconds'] / seconds:>5.0f}% "
+                  f"{result['peak_mb']:>7.1f} {result['threads']:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Sharding Benchmark
+Times the CPU-bound stages (normalize, thresholds, streaming conditions,
+anomaly scoring) in-process and across 1..N shard processes, and reports
+metrics per second and the speedup over in-process. Results are only
+counted, not stored, so the numbers show the shards and their pipes alone.
+
+Batches look like RESTCONF polls: one device per batch, a few thresholded
+gauges plus interface counters and status.
+
+Usage: python benchmarks/bench_sharding.py [max_processes] [batches]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import threading
+import time
+from config.config import Config
+
+# Keep the benchmark off the real database (anomaly checkpoints go through storage)
+Config.STORAGE_BACKEND = 'memory'
+
+from normalizer.normalizer import normalize_and_enrich
+from normalizer.anomaly import anomaly_detector
+from pipeline.shards import ShardPool
+
+DEVICES = 500
+METRICS_PER_BATCH = 40
+
+def make_batches(count, seed=7):
+    """Raw RESTCONF batches, one device each, with timestamps a poll apart"""
+    rng = random.Random(seed)
+    batches = []
+    for i in range(count):
+        device = i % DEVICES
+        poll = i // DEVICES
+        timestamp = f'2025-11-06T{10 + poll // 3600 % 12:02d}:{poll // 60 % 60:02d}:{poll % 60:02d}Z'
+        batch = [
+            ('system_cpu_usage', round(rng.gauss(35, 8), 1)),
+            ('system_memory_used', rng.randint(1000, 4000)),
+            ('system_temperature', round(rng.gauss(28, 2), 1)),
+        ]
+        for port in range((METRICS_PER_BATCH - len(batch)) // 2):
+            batch.append((f'interface_eth{port}_tx_packets', rng.randint(0, 10 ** 9)))
+            batch.append((f'interface_eth{port}_status', rng.choice(('up', 'up', 'up', 'down'))))
+        batches.append([{
+            'device_id': f'router_{device:04d}',
+            'device_type': 'router',
+            'protocol': 'RESTCONF',
+            'location': 'DataCenter-B',
+            'parameter': parameter,
+            'value': value,
+            'unit': '',
+            'timestamp': timestamp,
+        } for parameter, value in batch])
+    return batches
+
+def run_in_process(batches):
+    started = time.perf_counter()
+    for raw_metrics in batches:
+        normalized_metrics, events = normalize_and_enrich(raw_metrics)
+        if anomaly_detector.enabled:
+            events.extend(anomaly_detector.process(normalized_metrics))
+    return time.perf_counter() - started
+
+def run_sharded(batches, processes):
+    total = len(batches)
+    done = threading.Event()
+    finished = [0]
+    lock = threading.Lock()
+    
+    def apply(normalized_metrics, events):
+        with lock:
+            finished[0] += 1
+            if finished[0] == total:
+                done.set()
+    
+    pool = ShardPool(processes=processes)
+    pool.start(apply)
+    
+    started = time.perf_counter()
+    for raw_metrics in batches:
+        pool.submit(raw_metrics)
+    done.wait()
+    elapsed = time.perf_counter() - started
+    
+    pool.stop()
+    return elapsed
+
+def main():
+    max_processes = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    batches = make_batches(count)
+    metrics = count * METRICS_PER_BATCH
+    
+    print(f"[Benchmark] {count} batches x {METRICS_PER_BATCH} metrics, {os.cpu_count()} CPUs")
+    baseline = run_in_process(batches)
+    print(f"  {'mode':>12} {'seconds':>8} {'metrics/s':>10} {'speedup':>8}")
+    print(f"  {'in-process':>12} {baseline:8.2f} {metrics / baseline:10.0f} {1.0:8.2f}")
+    
+    processes = 1
+    while processes <= max_processes:
+        elapsed = run_sharded(batches, processes)
+        print(f"  {f'{processes} shards':>12} {elapsed:8.2f} {metrics / elapsed:10.0f} {baseline / elapsed:8.2f}")
+        processes *= 2
+    
+    if max_processes < 2:
+        print("[Benchmark] One CPU: shards can only add overhead here; run on a multi-core host to see scaling")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Threshold Batch Benchmark
+Times the scalar per-metric threshold check against the NumPy batch check
+over growing batch sizes, and reports the crossover: the smallest batch
+where the vectorized path wins. Config.THRESHOLD_BATCH_MIN should sit near it.
+
+Batches look like a RESTCONF interface dump mixed with MQTT/SNMP gauges:
+most rows have no threshold, and a few percent of the gauges breach.
+
+Usage: python benchmarks/bench_threshold_batch.py [rounds]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import time
+from normalizer.normalizer import Normalizer, np
+
+SIZES = (1, 2, 4, 8, 16, 24, 32, 48, 64, 128, 256, 1024, 4096, 16384)
+
+def make_batch(size, seed=11):
+    """Normalized metrics: interface counters and status plus thresholded gauges"""
+    rng = random.Random(seed)
+    gauges = (('cpu_usage', 'percent', 30, 10), ('memory_usage', 'MB', 40, 10),
+              ('temp_celsius', 'celsius', 25, 5), ('humidity_percent', 'percent', 45, 10))
+    batch = []
+    for i in range(size):
+        roll = rng.random()
+        if roll < 0.4:
+            param, unit, mean, spread = rng.choice(gauges)
+            value = round(rng.gauss(mean, spread), 1)
+        elif roll < 0.8:
+            param, unit, value = f'interface_eth{i % 48}_tx_packets', 'count', rng.randint(0, 10 ** 9)
+        else:
+            param, unit, value = f'interface_eth{i % 48}_status', '', rng.choice(('up', 'down'))
+        batch.append({
+            'device_id': f'device_{i % 50:03d}',
+            'device_type': 'switch',
+            'protocol': 'RESTCONF',
+            'location': 'DataCenter-B',
+            'parameter': param,
+            'value': value,
+            'unit': unit,
+            'timestamp': '2025-11-06T10:30:00Z',
+        })
+    return batch
+
+def run_scalar(normalizer, batch):
+    events = []
+    for metric in batch:
+        events.extend(normalizer.check_thresholds(metric))
+    return events
+
+def run_batch(normalizer, batch):
+    return normalizer.check_thresholds_batch(batch)
+
+def best_of(rounds, fn, *args):
+    # Repeat small batches so each timing covers at least ~20k metrics
+    repeat = max(1, 20000 // len(args[-1]))
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn(*args)
+        best = min(best, (time.perf_counter() - started) / repeat)
+    return best
+
+def main():
+    if np is None:
+        print("[Benchmark] NumPy is not installed; only the scalar path is available")
+        return
+    
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    normalizer = Normalizer()
+    
+    print(f"[Benchmark] Threshold check, best of {rounds}")
+    print(f"  {'batch':>6} {'scalar us':>10} {'numpy us':>10} {'speedup':>8}")
+    crossover = None
+    for size in SIZES:
+        batch = make_batch(size)
+        assert run_scalar(normalizer, batch) == run_batch(normalizer, batch)
+        
+        scalar = best_of(rounds, run_scalar, normalizer, batch)
+        vector = best_of(rounds, run_batch, normalizer, batch)
+        if crossover is None and vector < scalar:
+            crossover = size
+        print(f"  {size:>6} {scalar * 1e6:>10.1f} {vector * 1e6:>10.1f} {scalar / vector:>7.2f}x")
+    
+    print(f"  crossover: {crossover or 'not reached'} metrics per batch")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Async Collector Runtime
+Runs every collector on one asyncio event loop instead of one OS thread per
+device. Polled collectors (SNMP, RESTCONF) are started on their deadlines
+by one PollScheduler task, each poll a task awaiting collect_async(); push
+collectors (MQTT) get a task running run_async(), which services the
+client's socket on the loop.
+
+Polls are limited per protocol by Config.COLLECTOR_MAX_CONCURRENCY.
+Collected batches are handed to the callback (the ingest pipeline) on a few
+delivery threads, so a blocking overflow policy stalls only the polls (once
+COLLECTOR_DELIVERY_QUEUE batches are waiting), never the loop. Each device
+is served by one delivery thread, so its batches arrive in order.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import threading
+import queue
+from config.config import Config
+from collectors.scheduler import PollScheduler
+from pipeline.telemetry import telemetry
+from pipeline.ingest import shard_for
+
+class CollectorRuntime:
+    def __init__(self, max_concurrency=None, delivery_threads=None, max_queued=None):
+        self.max_concurrency = dict(max_concurrency or Config.COLLECTOR_MAX_CONCURRENCY)
+        self.delivery_threads = delivery_threads or Config.COLLECTOR_DELIVERY_THREADS
+        self.max_queued = max_queued or Config.COLLECTOR_DELIVERY_QUEUE
+        
+        self.callback = None
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        # One outbox per delivery thread, picked by device, so a device's batches reach
+        # the callback in order (the ingest pipeline routes by device and relies on it)
+        self._outboxes = [queue.SimpleQueue() for _ in range(self.delivery_threads)]
+        self._outbox_limit = max(1, self.max_queued // self.delivery_threads)
+        self._delivery = []
+        self.scheduler = PollScheduler()
+        self._tasks = {}  # 'scheduler' and each push collector's device_id -> task
+        self._polls = set()  # polls in progress
+        self._busy = set()  # device_ids being polled
+        self._collectors = {}  # device_id -> collector
+        self._limits = {}  # protocol -> semaphore
+        
+        # Only touched on the loop thread
+        self.stats = {
+            'polls': 0,
+            'poll_errors': 0,
+            'metrics': 0,
+            'pushed_batches': 0,
+            'delivery_waits': 0,
+            'limit_wait_seconds': 0.0,
+            'delivery_wait_seconds': 0.0,
+            'in_flight': 0,
+            'max_in_flight': 0,
+        }
+    
+    def start(self, collectors, callback):
+        """Run the collectors on a new event loop thread; callback(raw_metrics) gets their batches"""
+        if self._thread is not None:
+            return
+        
+        self.callback = callback
+        for index in range(self.delivery_threads):
+            thread = threading.Thread(target=self._delivery_loop, args=(index,), name=f'collector-delivery-{index}', daemon=True)
+            thread.start()
+            self._delivery.append(thread)
+        self._thread = threading.Thread(target=self._run, args=(list(collectors),), name='collector-loop', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        self._warn_fallbacks(self._collectors.values())
+        telemetry.gauge('nms_collector_delivery_queue', self._queued, 'Collected batches waiting for a delivery thread')
+        telemetry.gauge('nms_collector_polls_in_flight', lambda: self.stats['in_flight'], 'Device polls in progress on the event loop')
+        print(f"[Collector Runtime] Running {len(self._collectors)} collectors on one event loop")
+    
+    def _warn_fallbacks(self, collectors):
+        """Say loudly when a protocol's polls run on the default thread pool instead of the loop"""
+        reasons = {}
+        for collector in collectors:
+            reason = getattr(collector, 'async_fallback', None)
+            if reason:
+                reasons[collector.protocol] = reason
+        for protocol, reason in sorted(reasons.items()):
+            print(f"[Collector Runtime] WARNING: {protocol} polls fall back to a thread pool ({reason}); "
+                  f"install requirements.txt for the async client")
+    
+    def _run(self, collectors):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            for collector in collectors:
+                self._spawn(collector)
+            self._tasks['scheduler'] = self.loop.create_task(self._schedule(), name='poll-scheduler')
+        finally:
+            self._ready.set()
+        
+        try:
+            self.loop.run_forever()
+        finally:
+            # Cancel the scheduler, polls and push clients, then let collectors close shared clients
+            tasks = list(self._tasks.values()) + list(self._polls)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self._close_collectors())
+            self.loop.close()
+    
+    def _spawn(self, collector):
+        self._collectors[collector.device_id] = collector
+        if hasattr(collector, 'collect_async'):
+            self.scheduler.add(collector.device_id, collector.poll_interval, self.loop.time())
+        else:
+            collector.callback = self._deliver_pushed
+            self._tasks[collector.device_id] = self.loop.create_task(
+                collector.run_async(), name=f'collect-{collector.device_id}'
+            )
+    
+    def _limit(self, protocol):
+        limit = self._limits.get(protocol)
+        if limit is None:
+            limit = self._limits[protocol] = asyncio.Semaphore(self.max_concurrency.get(protocol, 100))
+        return limit
+    
+    async def _schedule(self):
+        """Start each device's poll at its deadline; one timer for all devices"""
+        loop = asyncio.get_running_loop()
+        scheduler = self.scheduler
+        while True:
+            now = loop.time()
+            for device_id, deadline in scheduler.pop_due(now):
+                collector = self._collectors.get(device_id)
+                if collector is None:
+                    continue
+                if device_id in self._busy:
+                    # Still polling since the last deadline: skip, never stack polls
+                    scheduler.skip(device_id)
+                    continue
+                
+                self._busy.add(device_id)
+                task = loop.create_task(self._poll(collector))
+                self._polls.add(task)
+                task.add_done_callback(self._polls.discard)
+            
+            next_due = scheduler.next_due()
+            await asyncio.sleep(1.0 if next_due is None else max(0.0, next_due - loop.time()))
+    
+    async def _poll(self, collector):
+        """Poll one device once; a slow device only holds up its own task"""
+        loop = asyncio.get_running_loop()
+        stats = self.stats
+        duration = 0.0
+        try:
+            queued = loop.time()
+            async with self._limit(collector.protocol):
+                polled = loop.time()
+                self._waited('limit', polled - queued)
+                stats['in_flight'] += 1
+                stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+                failed = True
+                try:
+                    metrics = await collector.collect_async()
+                    failed = False
+                finally:
+                    duration = loop.time() - polled
+                    stats['in_flight'] -= 1
+                    telemetry.record_poll(collector.device_id, collector.protocol, duration, failed)
+            
+            stats['polls'] += 1
+            if metrics:
+                queued = loop.time()
+                await self._deliver(metrics)
+                self._waited('delivery', loop.time() - queued)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats['poll_errors'] += 1
+            print(f"[Collector Runtime] Error in {collector.device_id}: {e}")
+        finally:
+            self._busy.discard(collector.device_id)
+            # Only the device's own response time can overrun its interval; waits for a
+            # protocol slot or a delivery thread are tracked separately by _waited.
+            # The interval is read back every poll, so devices.json edits apply
+            self.scheduler.finished(collector.device_id, duration, collector.poll_interval)
+    
+    def _waited(self, wait, seconds):
+        """Account time a poll spent queued for a protocol slot or a delivery thread"""
+        self.stats[f'{wait}_wait_seconds'] += seconds
+        telemetry.observe('nms_collector_wait_seconds', seconds, wait=wait)
+    
+    async def _deliver(self, metrics):
+        """Queue a polled batch for the delivery threads, waiting while too many are queued"""
+        outbox = self._outbox(metrics)
+        while outbox.qsize() >= self._outbox_limit:
+            self.stats['delivery_waits'] += 1
+            await asyncio.sleep(0.01)
+        self.stats['metrics'] += len(metrics)
+        outbox.put(metrics)
+    
+    def _outbox(self, metrics):
+        return self._outboxes[shard_for(metrics[0].get('device_id'), self.delivery_threads)]
+    
+    def _queued(self):
+        return sum(outbox.qsize() for outbox in self._outboxes)
+    
+    def _deliver_pushed(self, metrics):
+        """Callback for push collectors: runs on the loop thread, so it must not block"""
+        self.stats['pushed_batches'] += 1
+        self.stats['metrics'] += len(metrics)
+        self._outbox(metrics).put(metrics)
+    
+    def _delivery_loop(self, index):
+        """Hand queued batches to the callback, off the loop thread (the callback may block)"""
+        while True:
+            metrics = self._outboxes[index].get()
+            if metrics is None:
+                return
+            try:
+                self.callback(metrics)
+            except Exception as e:
+                print(f"[Collector Runtime] Delivery error: {e}")
+    
+    async def _close_collectors(self):
+        for collector in self._collectors.values():
+            close = getattr(collector, 'close_async', None)
+            if close is not None:
+                try:
+                    await close()
+                except Exception as e:
+                    print(f"[Collector Runtime] Error closing {collector.device_id}: {e}")
+    
+    def stop(self, timeout=10):
+        """Cancel every collector task and stop the loop"""
+        if self._thread is None:
+            return
+        
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        
+        # Deliver what was already collected, then stop the delivery threads
+        for outbox in self._outboxes:
+            outbox.put(None)
+        for thread in self._delivery:
+            thread.join(timeout)
+        print(f"[Collector Runtime] Stopped ({self.stats['polls']} polls)")
+    
+    def get_stats(self):
+        """Get poll counters and the number of collector tasks"""
+        stats = dict(self.stats)
+        stats['collectors'] = len(self._collectors)
+        stats['queued_batches'] = self._queued()
+        stats['max_concurrency'] = self.max_concurrency
+        stats['scheduler'] = self.scheduler.get_stats()
+        return stats
+
+# Global collector runtime instance
+collector_runtime = CollectorRuntime()
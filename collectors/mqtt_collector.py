@@ -7,9 +7,10 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import paho.mqtt.client as mqtt
+import asyncio
 import json
 from datetime import datetime
-from config.config import Config
+from config.config import Config, config_cache
 
 class MQTTCollector:
     def __init__(self, device_config, callback=None):
@@ -25,6 +26,22 @@ class MQTTCollector:
         self.client = mqtt.Client(client_id=f"collector_{self.device_id}")
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        config_cache.subscribe(self.on_config_reload, 'devices.json')
+    
+    def on_config_reload(self, name, config):
+        """Follow this device's topic changes from a reloaded devices.json"""
+        for device in config.get('devices', []):
+            if device.get('device_id') != self.device_id:
+                continue
+            
+            # Unconnected clients subscribe to self.topics in on_connect instead
+            topics = device['topics']
+            for topic in set(self.topics) - set(topics):
+                self.client.unsubscribe(topic)
+            for topic in set(topics) - set(self.topics):
+                self.client.subscribe(topic, qos=Config.MQTT_QOS)
+            self.topics = topics
+            return
         
     def on_connect(self, client, userdata, flags, rc):
         """Callback when connected to broker"""
@@ -74,6 +91,51 @@ class MQTTCollector:
         except Exception as e:
             print(f"[MQTT Collector] Error processing message: {e}")
     
+    async def run_async(self):
+        """Service the MQTT client on the running event loop (asyncio collector runtime)"""
+        loop = asyncio.get_running_loop()
+        client = self.client
+        
+        # paho drives its socket through these hooks instead of a network thread;
+        # connect() runs on a worker thread, so every hook hops onto the loop
+        def on_socket_open(client, userdata, sock):
+            loop.call_soon_threadsafe(loop.add_reader, sock, client.loop_read)
+        
+        def on_socket_close(client, userdata, sock):
+            loop.call_soon_threadsafe(loop.remove_reader, sock)
+            loop.call_soon_threadsafe(loop.remove_writer, sock)
+        
+        def on_socket_register_write(client, userdata, sock):
+            loop.call_soon_threadsafe(loop.add_writer, sock, client.loop_write)
+        
+        def on_socket_unregister_write(client, userdata, sock):
+            loop.call_soon_threadsafe(loop.remove_writer, sock)
+        
+        client.on_socket_open = on_socket_open
+        client.on_socket_close = on_socket_close
+        client.on_socket_register_write = on_socket_register_write
+        client.on_socket_unregister_write = on_socket_unregister_write
+        
+        print(f"[MQTT Collector] Starting for {self.device_id}")
+        connected = False
+        try:
+            while True:
+                if not connected:
+                    try:
+                        await loop.run_in_executor(None, client.connect, self.broker, self.port, 60)
+                        connected = True
+                    except Exception as e:
+                        print(f"[MQTT Collector] Error: {e}")
+                        await asyncio.sleep(5)
+                        continue
+                
+                # Keepalive pings and timeouts; NO_CONN means the socket was lost
+                await asyncio.sleep(1)
+                connected = client.loop_misc() == mqtt.MQTT_ERR_SUCCESS
+        finally:
+            client.disconnect()
+            print(f"[MQTT Collector] Stopped {self.device_id}")
+    
     def run(self):
         """Start MQTT collector"""
         print(f"[MQTT Collector] Starting for {self.device_id}")
@@ -7,12 +7,35 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import requests
+import asyncio
 import time
 import json
 from datetime import datetime
-from config.config import Config
+from config.config import Config, config_cache
+from collectors.scheduler import PollScheduler, poll_interval
+from pipeline.telemetry import telemetry
+
+try:
+    import aiohttp
+except ImportError:  # optional: without it the async runtime runs get_data on a thread pool
+    aiohttp = None
+
+# One HTTP session (and connection pool) shared by every device polled on the collector event loop
+_session = None
+
+def _shared_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=5),
+            connector=aiohttp.TCPConnector(limit=Config.COLLECTOR_HTTP_CONNECTIONS)
+        )
+    return _session
 
 class RESTCONFCollector:
+    # Why collect_async falls back to a thread pool, if it does
+    async_fallback = None if aiohttp is not None else 'aiohttp is not installed'
+    
     def __init__(self, device_config):
         self.device_id = device_config['device_id']
         self.device_type = device_config['device_type']
@@ -22,7 +45,16 @@ class RESTCONFCollector:
         self.username = device_config.get('username')
         self.password = device_config.get('password')
         self.endpoints = device_config['endpoints']
-        self.poll_interval = Config.RESTCONF_POLL_INTERVAL
+        self.poll_interval = poll_interval(device_config, Config.RESTCONF_POLL_INTERVAL)
+        config_cache.subscribe(self.on_config_reload, 'devices.json')
+    
+    def on_config_reload(self, name, config):
+        """Pick up this device's endpoints and interval from a reloaded devices.json"""
+        for device in config.get('devices', []):
+            if device.get('device_id') == self.device_id:
+                self.endpoints = device['endpoints']
+                self.poll_interval = poll_interval(device, Config.RESTCONF_POLL_INTERVAL)
+                return
         
     def get_data(self, endpoint):
         """Get data from RESTCONF endpoint"""
@@ -49,72 +81,128 @@ class RESTCONFCollector:
             print(f"[RESTCONF Collector] Error: {e}")
             return None
     
+    async def get_data_async(self, endpoint):
+        """Get data from RESTCONF endpoint without blocking the event loop"""
+        if aiohttp is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.get_data, endpoint)
+        
+        url = f"{self.base_url}{endpoint}"
+        try:
+            auth = None
+            if self.username and self.password:
+                auth = aiohttp.BasicAuth(self.username, self.password)
+            
+            async with _shared_session().get(url, auth=auth, headers={'Accept': 'application/json'}) as response:
+                if response.status == 200:
+                    return await response.json(content_type=None)
+                else:
+                    print(f"[RESTCONF Collector] HTTP {response.status} from {url}")
+                    return None
+                
+        except Exception as e:
+            print(f"[RESTCONF Collector] Error: {e}")
+            return None
+    
     def collect(self):
         """Collect all endpoint data and return raw metrics"""
-        metrics = []
         timestamp = datetime.utcnow().isoformat() + 'Z'
+        system_data = self.get_data(self.endpoints['system']) if 'system' in self.endpoints else None
+        iface_data = self.get_data(self.endpoints['interfaces']) if 'interfaces' in self.endpoints else None
+        return self._to_metrics(system_data, iface_data, timestamp)
+    
+    async def collect_async(self):
+        """Collect all endpoint data concurrently (asyncio collector runtime)"""
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        endpoints = [self.endpoints.get(name) for name in ('system', 'interfaces')]
+        system_data, iface_data = await asyncio.gather(*(
+            self.get_data_async(endpoint) if endpoint else asyncio.sleep(0)
+            for endpoint in endpoints
+        ))
+        return self._to_metrics(system_data, iface_data, timestamp)
+    
+    async def close_async(self):
+        """Close the shared HTTP session when the collector runtime stops"""
+        global _session
+        if _session is not None and not _session.closed:
+            await _session.close()
+        _session = None
+    
+    def _to_metrics(self, system_data, iface_data, timestamp):
+        """Build raw metrics from the system and interfaces responses"""
+        metrics = []
         
         # Collect system data
-        if 'system' in self.endpoints:
-            system_data = self.get_data(self.endpoints['system'])
-            if system_data:
-                for param, value in system_data.items():
-                    if isinstance(value, (int, float, str)):
+        if system_data:
+            for param, value in system_data.items():
+                if isinstance(value, (int, float, str)):
+                    metric = {
+                        'device_id': self.device_id,
+                        'device_type': self.device_type,
+                        'protocol': self.protocol,
+                        'location': self.location,
+                        'parameter': f'system_{param}',
+                        'value': value,
+                        'endpoint': self.endpoints['system'],
+                        'timestamp': timestamp
+                    }
+                    metrics.append(metric)
+                    print(f"[RESTCONF Collector] {self.device_id} - system_{param}: {value}")
+        
+        # Collect interface data
+        if iface_data and 'interface' in iface_data:
+            for iface in iface_data['interface']:
+                iface_name = iface.get('name', 'unknown')
+                
+                # Create metrics for important interface parameters
+                for param in ['status', 'admin_status', 'tx_packets', 'rx_packets']:
+                    if param in iface:
                         metric = {
                             'device_id': self.device_id,
                             'device_type': self.device_type,
                             'protocol': self.protocol,
                             'location': self.location,
-                            'parameter': f'system_{param}',
-                            'value': value,
-                            'endpoint': self.endpoints['system'],
+                            'parameter': f'interface_{iface_name}_{param}',
+                            'value': iface[param],
+                            'endpoint': self.endpoints['interfaces'],
                             'timestamp': timestamp
                         }
                         metrics.append(metric)
-                        print(f"[RESTCONF Collector] {self.device_id} - system_{param}: {value}")
-        
-        # Collect interface data
-        if 'interfaces' in self.endpoints:
-            iface_data = self.get_data(self.endpoints['interfaces'])
-            if iface_data and 'interface' in iface_data:
-                for iface in iface_data['interface']:
-                    iface_name = iface.get('name', 'unknown')
-                    
-                    # Create metrics for important interface parameters
-                    for param in ['status', 'admin_status', 'tx_packets', 'rx_packets']:
-                        if param in iface:
-                            metric = {
-                                'device_id': self.device_id,
-                                'device_type': self.device_type,
-                                'protocol': self.protocol,
-                                'location': self.location,
-                                'parameter': f'interface_{iface_name}_{param}',
-                                'value': iface[param],
-                                'endpoint': self.endpoints['interfaces'],
-                                'timestamp': timestamp
-                            }
-                            metrics.append(metric)
-                    
-                    print(f"[RESTCONF Collector] {self.device_id} - {iface_name}: {iface.get('status')}")
+                
+                print(f"[RESTCONF Collector] {self.device_id} - {iface_name}: {iface.get('status')}")
         
         return metrics
     
     def run(self, callback=None):
-        """Continuously poll device"""
+        """Continuously poll device on fixed deadlines (slow polls skip deadlines, never drift)
+        
+        Threaded mode keeps this device's deadlines in its own PollScheduler;
+        only the async runtime has the shared one reported in /api/collectors/stats.
+        """
         print(f"[RESTCONF Collector] Starting for {self.device_id} (interval: {self.poll_interval}s)")
         
+        scheduler = PollScheduler()
+        scheduler.add(self.device_id, self.poll_interval, time.monotonic())
         while True:
             try:
-                metrics = self.collect()
+                time.sleep(max(0.0, scheduler.next_due() - time.monotonic()))
+                if not scheduler.pop_due(time.monotonic()):
+                    continue
+                
+                started = time.monotonic()
+                try:
+                    metrics = self.collect()
+                finally:
+                    # Only the device's response can overrun, not a callback blocked on ingest
+                    seconds = time.monotonic() - started
+                    scheduler.finished(self.device_id, seconds, self.poll_interval)
+                telemetry.record_poll(self.device_id, self.protocol, seconds)
                 if callback and metrics:
                     callback(metrics)
-                time.sleep(self.poll_interval)
             except KeyboardInterrupt:
                 print(f"\n[RESTCONF Collector] Stopped {self.device_id}")
                 break
             except Exception as e:
                 print(f"[RESTCONF Collector] Error in {self.device_id}: {e}")
-                time.sleep(self.poll_interval)
 
 def main():
     """Test RESTCONF collector"""
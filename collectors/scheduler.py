@@ -0,0 +1,123 @@
+"""
+Poll Scheduler
+Central heap of poll deadlines for the polled collectors (SNMP, RESTCONF).
+Deadlines are fixed: a device polled every 10s is due at t0, t0+10, t0+20...
+however long each poll takes, so the period does not drift. The first
+deadline of each device is spread over POLL_JITTER of its interval so
+devices do not poll in lockstep after a start.
+
+Each device has its own interval ("poll_interval" in its devices.json
+entry, else the protocol default). A poll that takes longer than its
+interval is an overrun; deadlines that pass while a device is still being
+polled are skipped, never queued up, so a slow device falls behind alone.
+The scheduler only keeps time; callers pass `now` from their own clock.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heapq
+import itertools
+import random
+from config.config import Config
+
+def poll_interval(device_config, default):
+    """A device's poll interval in seconds ("poll_interval" in devices.json, else default)"""
+    return float(device_config.get('poll_interval', default))
+
+class PollScheduler:
+    def __init__(self, jitter=None):
+        self.jitter = Config.POLL_JITTER if jitter is None else jitter
+        
+        self._heap = []  # (due, seq, device_id)
+        self._seq = itertools.count()
+        self._intervals = {}  # device_id -> interval; removed devices drop out when popped
+        
+        self.overruns = {}  # device_id -> {'overruns', 'skipped', 'last_seconds', 'interval'}
+        self.stats = {
+            'due': 0,
+            'overruns': 0,
+            'skipped_polls': 0,
+            'lag_seconds_total': 0.0,
+            'lag_seconds_max': 0.0,
+        }
+    
+    def add(self, device_id, interval, now):
+        """Schedule a device, its first deadline jittered within the first interval"""
+        self._intervals[device_id] = interval
+        heapq.heappush(self._heap, (now + random.uniform(0, interval * self.jitter), next(self._seq), device_id))
+    
+    def remove(self, device_id):
+        self._intervals.pop(device_id, None)
+    
+    def next_due(self):
+        """Earliest deadline, or None when nothing is scheduled"""
+        return self._heap[0][0] if self._heap else None
+    
+    def pop_due(self, now):
+        """(device_id, deadline) for every passed deadline; each device is rescheduled one interval on"""
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, device_id = heapq.heappop(heap)
+            interval = self._intervals.get(device_id)
+            if interval is None:
+                continue
+            
+            lag = now - deadline
+            self.stats['due'] += 1
+            self.stats['lag_seconds_total'] += lag
+            if lag > self.stats['lag_seconds_max']:
+                self.stats['lag_seconds_max'] = lag
+            due.append((device_id, deadline))
+            
+            # The next deadline counts from this one, not from when the poll ends;
+            # deadlines that already passed (a stalled caller) are skipped
+            following = deadline + interval
+            if following <= now:
+                missed = int((now - following) // interval) + 1
+                following += missed * interval
+                self._skipped(device_id, missed)
+            heapq.heappush(heap, (following, next(self._seq), device_id))
+        return due
+    
+    def skip(self, device_id):
+        """Record a deadline that passed while the device's previous poll was still running"""
+        self._skipped(device_id, 1)
+    
+    def finished(self, device_id, seconds, interval):
+        """Record a poll's duration (an overrun if it exceeded the interval) and the device's current interval"""
+        if device_id in self._intervals:
+            self._intervals[device_id] = interval
+        if seconds <= interval:
+            return
+        
+        self.stats['overruns'] += 1
+        entry = self._entry(device_id)
+        entry['overruns'] += 1
+        entry['last_seconds'] = round(seconds, 3)
+        entry['interval'] = interval
+        if entry['overruns'] == 1 or entry['overruns'] % 100 == 0:
+            print(f"[Scheduler] {device_id} overran its {interval:g}s poll interval "
+                  f"({seconds:.1f}s; {entry['overruns']} overruns)")
+    
+    def _skipped(self, device_id, count):
+        self.stats['skipped_polls'] += count
+        self._entry(device_id)['skipped'] += count
+    
+    def _entry(self, device_id):
+        entry = self.overruns.get(device_id)
+        if entry is None:
+            entry = self.overruns[device_id] = {'overruns': 0, 'skipped': 0, 'last_seconds': None,
+                                                'interval': self._intervals.get(device_id)}
+        return entry
+    
+    def get_stats(self, top=10):
+        """Get deadline counts, lag and the devices that overrun most"""
+        stats = dict(self.stats)
+        stats['devices'] = len(self._intervals)
+        stats['lag_seconds_avg'] = stats['lag_seconds_total'] / stats['due'] if stats['due'] else 0.0
+        worst = sorted(self.overruns.items(), key=lambda item: item[1]['overruns'] + item[1]['skipped'], reverse=True)
+        stats['overrunning_devices'] = len(self.overruns)
+        stats['worst'] = {device_id: dict(entry) for device_id, entry in worst[:top]}
+        return stats
@@ -7,12 +7,32 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from pysnmp.hlapi import *
+import asyncio
 import time
 import json
 from datetime import datetime
-from config.config import Config
+from config.config import Config, config_cache
+from collectors.scheduler import PollScheduler, poll_interval
+from pipeline.telemetry import telemetry
+
+try:
+    from pysnmp.hlapi.asyncio import getCmd as get_cmd_async, UdpTransportTarget as AsyncUdpTransportTarget
+except ImportError:  # optional: without it the async runtime runs get_snmp_value on a thread pool
+    get_cmd_async = None
+
+# One engine shared by every device polled on the collector event loop
+_async_engine = None
+
+def _shared_engine():
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = SnmpEngine()
+    return _async_engine
 
 class SNMPCollector:
+    # Why collect_async falls back to a thread pool, if it does
+    async_fallback = None if get_cmd_async is not None else 'pysnmp.hlapi.asyncio is not available'
+    
     def __init__(self, device_config):
         self.device_id = device_config['device_id']
         self.device_type = device_config['device_type']
@@ -22,7 +42,16 @@ class SNMPCollector:
         self.port = device_config['port']
         self.community = device_config['community']
         self.oids = device_config['oids']
-        self.poll_interval = Config.SNMP_POLL_INTERVAL
+        self.poll_interval = poll_interval(device_config, Config.SNMP_POLL_INTERVAL)
+        config_cache.subscribe(self.on_config_reload, 'devices.json')
+    
+    def on_config_reload(self, name, config):
+        """Pick up this device's OIDs from a reloaded devices.json"""
+        for device in config.get('devices', []):
+            if device.get('device_id') == self.device_id:
+                self.oids = device['oids']
+                self.poll_interval = poll_interval(device, Config.SNMP_POLL_INTERVAL)
+                return
         
     def get_snmp_value(self, oid):
         """Get value for a specific OID"""
@@ -50,6 +79,47 @@ class SNMPCollector:
             print(f"[SNMP Collector] Exception: {e}")
             return None
     
+    async def get_snmp_value_async(self, oid):
+        """Get value for a specific OID without blocking the event loop"""
+        if get_cmd_async is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.get_snmp_value, oid)
+        
+        try:
+            error_indication, error_status, error_index, var_binds = await get_cmd_async(
+                _shared_engine(),
+                CommunityData(self.community),
+                AsyncUdpTransportTarget((self.ip, self.port), timeout=2, retries=1),
+                ContextData(),
+                ObjectType(ObjectIdentity(oid))
+            )
+            
+            if error_indication:
+                print(f"[SNMP Collector] Error: {error_indication}")
+                return None
+            elif error_status:
+                print(f"[SNMP Collector] Error: {error_status.prettyPrint()}")
+                return None
+            else:
+                for var_bind in var_binds:
+                    return var_bind[1].prettyPrint()
+        except Exception as e:
+            print(f"[SNMP Collector] Exception: {e}")
+            return None
+    
+    def _metric(self, param_name, oid, value, timestamp):
+        """Raw metric for one polled OID"""
+        print(f"[SNMP Collector] {self.device_id} - {param_name}: {value}")
+        return {
+            'device_id': self.device_id,
+            'device_type': self.device_type,
+            'protocol': self.protocol,
+            'location': self.location,
+            'parameter': param_name,
+            'value': value,
+            'oid': oid,
+            'timestamp': timestamp
+        }
+    
     def collect(self):
         """Collect all OID values and return raw metrics"""
         metrics = []
@@ -59,37 +129,53 @@ class SNMPCollector:
             value = self.get_snmp_value(oid)
             
             if value is not None:
-                metric = {
-                    'device_id': self.device_id,
-                    'device_type': self.device_type,
-                    'protocol': self.protocol,
-                    'location': self.location,
-                    'parameter': param_name,
-                    'value': value,
-                    'oid': oid,
-                    'timestamp': timestamp
-                }
-                metrics.append(metric)
-                print(f"[SNMP Collector] {self.device_id} - {param_name}: {value}")
+                metrics.append(self._metric(param_name, oid, value, timestamp))
         
         return metrics
     
+    async def collect_async(self):
+        """Collect all OID values concurrently (asyncio collector runtime)"""
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        oids = list(self.oids.items())
+        values = await asyncio.gather(*(self.get_snmp_value_async(oid) for _, oid in oids))
+        
+        return [
+            self._metric(param_name, oid, value, timestamp)
+            for (param_name, oid), value in zip(oids, values)
+            if value is not None
+        ]
+    
     def run(self, callback=None):
-        """Continuously poll device"""
+        """Continuously poll device on fixed deadlines (slow polls skip deadlines, never drift)
+        
+        Threaded mode keeps this device's deadlines in its own PollScheduler;
+        only the async runtime has the shared one reported in /api/collectors/stats.
+        """
         print(f"[SNMP Collector] Starting for {self.device_id} (interval: {self.poll_interval}s)")
         
+        scheduler = PollScheduler()
+        scheduler.add(self.device_id, self.poll_interval, time.monotonic())
         while True:
             try:
-                metrics = self.collect()
+                time.sleep(max(0.0, scheduler.next_due() - time.monotonic()))
+                if not scheduler.pop_due(time.monotonic()):
+                    continue
+                
+                started = time.monotonic()
+                try:
+                    metrics = self.collect()
+                finally:
+                    # Only the device's response can overrun, not a callback blocked on ingest
+                    seconds = time.monotonic() - started
+                    scheduler.finished(self.device_id, seconds, self.poll_interval)
+                telemetry.record_poll(self.device_id, self.protocol, seconds)
                 if callback and metrics:
                     callback(metrics)
-                time.sleep(self.poll_interval)
             except KeyboardInterrupt:
                 print(f"\n[SNMP Collector] Stopped {self.device_id}")
                 break
             except Exception as e:
                 print(f"[SNMP Collector] Error in {self.device_id}: {e}")
-                time.sleep(self.poll_interval)
 
 def main():
     """Test SNMP collector"""
@@ -1,8 +1,11 @@
 """
 Configuration Manager for Unified NMS
 """
+import hashlib
 import json
 import os
+import threading
+import time
 
 class Config:
     # Base directories
@@ -14,34 +17,210 @@ class Config:
     SNMP_POLL_INTERVAL = 10  # seconds
     RESTCONF_POLL_INTERVAL = 10  # seconds (reduced from 15 for more frequent checks)
     MQTT_QOS = 1
+    POLL_JITTER = 1.0  # first polls are spread over this fraction of each device's interval
+    COLLECTOR_RUNTIME = 'async'  # 'async': every device on one asyncio event loop; 'threads': one thread per device
+    COLLECTOR_MAX_CONCURRENCY = {'SNMP': 256, 'RESTCONF': 128}  # polls in flight at once, per protocol
+    COLLECTOR_HTTP_CONNECTIONS = 100  # pooled RESTCONF connections on the event loop
+    COLLECTOR_DELIVERY_THREADS = 4  # threads handing collected batches to the ingest pipeline (each device always uses the same one)
+    COLLECTOR_DELIVERY_QUEUE = 1000  # collected batches waiting for delivery before polls pause
+    
+    # Ingest pipeline: collectors queue raw batches, workers normalize/store/alarm
+    INGEST_WORKERS = 4
+    INGEST_QUEUE_SIZE = 1000  # raw batches queued across all workers
+    INGEST_OVERFLOW_POLICY = 'block'  # 'block', 'drop_oldest' or 'sample' when a queue is full
+    INGEST_SAMPLE_EVERY = 4  # 'sample': admit every Nth batch above the high-water mark
+    INGEST_SAMPLE_HIGH_WATER = 0.8  # 'sample': fraction of a queue where sampling starts
+    SHARD_PROCESSES = 0  # >0: normalize/threshold/anomaly work runs in this many processes, sharded by device (see benchmarks/bench_sharding.py)
+    SHARD_START_METHOD = None  # multiprocessing start method; None uses 'fork' where available, else 'spawn'
     
     # Alarm settings
     ALARM_AUTO_CLOSE_TIMEOUT = 300  # 5 minutes
     ALARM_DEDUP_WINDOW = 60  # 1 minute
+    ALARM_FLUSH_INTERVAL = 5  # seconds between write-behind flushes of repeat occurrences
+    THRESHOLD_BATCH_MIN = 128  # metrics per batch before thresholds are checked with NumPy (see benchmarks/bench_threshold_batch.py)
+    CONDITION_MAX_SERIES = 100000  # series with windowed/hysteresis/rate threshold state
+    ANOMALY_MAX_SERIES = 200000  # series the anomaly detector learns (66 bytes of state each)
+    ANOMALY_CHECKPOINT_INTERVAL = 300  # seconds between anomaly detector checkpoints to storage
+    
+    # Storage backend: 'sqlite', 'memory' (no disk I/O, for benchmarks) or 'segment_log'
+    STORAGE_BACKEND = 'sqlite'
+    SEGMENT_LOG_DIR = os.path.join(STORAGE_DIR, 'metric_log')
+    SEGMENT_LOG_SEGMENT_BYTES = 64 * 1024 * 1024  # preallocated size of each mmap'd segment
     
     # Database
     DB_PATH = os.path.join(STORAGE_DIR, 'nms.db')
+    DB_SYNCHRONOUS = 'NORMAL'  # Safe with WAL; FULL fsyncs every commit
+    
+    # Metric writer (single background writer thread)
+    WRITER_BATCH_SIZE = 5000  # rows per transaction before forcing a flush
+    WRITER_FLUSH_INTERVAL = 1.0  # seconds to wait for more rows before flushing
+    WRITER_QUEUE_SIZE = 10000  # queued batches before collectors block
+    
+    # Ingest journal (write-ahead log between collectors and storage)
+    JOURNAL_ENABLED = True
+    JOURNAL_DIR = os.path.join(STORAGE_DIR, 'ingest_wal')
+    JOURNAL_SEGMENT_BYTES = 16 * 1024 * 1024  # preallocated size of each journal segment
+    JOURNAL_FSYNC_INTERVAL = 0.2  # seconds between batched msyncs; 0 syncs on every append
+    JOURNAL_APPLY_BATCH = 50  # journaled batches applied per storage flush
+    JOURNAL_APPLY_TIMEOUT = 30  # seconds to wait for storage to commit an applied batch
+    JOURNAL_APPLY_ATTEMPTS = 5  # failed applies of one batch before it is quarantined
+    
+    # Retention in days per resolution (raw samples are dropped a day-partition at a time)
+    RETENTION_DAYS = {
+        'raw': 7,
+        '1m': 30,
+        '1h': 365,
+        '1d': 1825,
+    }
+    RETENTION_CHECK_INTERVAL = 3600  # seconds between retention passes
+    
+    # Cold tier: raw partitions older than this are compacted into compressed chunks
+    COLD_AFTER_DAYS = 1
+    CHUNK_SIZE = 512  # samples per chunk
+    
+    # Latest-value cache
+    LATEST_CACHE_MAX_SERIES = 100000  # (device, parameter) series kept in memory
+    LATEST_CACHE_HISTORY = 20  # recent samples kept per series
+    
+    # Metric queries
+    METRICS_DEFAULT_POINTS = 500  # points per series when /api/metrics gets no step
+    METRICS_DEFAULT_RANGE = 3600  # seconds looked back when only end/step is given
+    METRICS_MAX_LIMIT = 1000  # largest page /api/metrics returns; use next_cursor for more
+    EXPORT_CHUNK_BYTES = 64 * 1024  # response chunk size for /api/export/metrics
     
     # Dashboard
     DASHBOARD_PORT = 5000
     DASHBOARD_HOST = '0.0.0.0'
     
+    # Self-telemetry: histograms, counters and queue gauges at /api/internal/metrics
+    TELEMETRY_ENABLED = True
+    TELEMETRY_INTERVAL = 30  # seconds between samples stored as metrics of TELEMETRY_DEVICE_ID
+    TELEMETRY_DEVICE_ID = 'nms_self'
+    TELEMETRY_PER_DEVICE_POLLS = True  # per-device poll duration series (four per device in the Prometheus output)
+    
+    # Config files are cached; a watcher re-reads them when they change on disk
+    CONFIG_WATCH_INTERVAL = 2  # seconds between mtime checks
+    
     @staticmethod
     def load_devices():
-        """Load device configuration"""
-        path = os.path.join(Config.CONFIG_DIR, 'devices.json')
-        with open(path, 'r') as f:
-            return json.load(f)
+        """Load device configuration (cached; treat as read-only)"""
+        return config_cache.get('devices.json')
     
     @staticmethod
     def load_schemas():
-        """Load data schemas"""
-        path = os.path.join(Config.CONFIG_DIR, 'schemas.json')
-        with open(path, 'r') as f:
-            return json.load(f)
+        """Load data schemas (cached; treat as read-only)"""
+        return config_cache.get('schemas.json')
     
     @staticmethod
     def get_thresholds():
         """Get alarm thresholds"""
         devices = Config.load_devices()
         return devices.get('thresholds', {})
+
+class ConfigCache:
+    """Parsed config files, reloaded only when their mtime/size and content hash change"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}  # name -> (mtime_ns, size, sha256, parsed config)
+        self._subscribers = []  # (callback, name or None)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'checks': 0, 'reloads': 0, 'unchanged_rewrites': 0, 'errors': 0}
+    
+    def get(self, name):
+        """Get a parsed config file; no file I/O once it is cached"""
+        entry = self._files.get(name)
+        if entry is None:
+            with self._lock:
+                entry = self._files.get(name)
+                if entry is None:
+                    entry = self._files[name] = self._read(name)
+        return entry[3]
+    
+    def _read(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            raw = f.read()
+        return (stat.st_mtime_ns, stat.st_size, hashlib.sha256(raw).hexdigest(), json.loads(raw))
+    
+    def subscribe(self, callback, name=None):
+        """Call callback(name, config) after a file (or any file, if name is None) is reloaded"""
+        with self._lock:
+            self._subscribers.append((callback, name))
+    
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [entry for entry in self._subscribers if entry[0] != callback]
+    
+    def check(self):
+        """Reload changed files and notify subscribers; returns the names reloaded"""
+        reloaded = []
+        with self._lock:
+            self.stats['checks'] += 1
+            for name, (mtime_ns, size, digest, _) in list(self._files.items()):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                    if (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size):
+                        continue
+                    entry = self._read(name)
+                except (OSError, ValueError) as e:
+                    # Keep serving the last good config (e.g. a half-saved file);
+                    # invalid JSON is not retried until the file changes again
+                    self.stats['errors'] += 1
+                    print(f"[Config] Keeping previous {name}: {e}")
+                    if isinstance(e, ValueError):
+                        self._files[name] = (stat.st_mtime_ns, stat.st_size, digest, self._files[name][3])
+                    continue
+                
+                if entry[2] == digest:
+                    # Touched or rewritten with the same content
+                    self._files[name] = entry[:3] + (self._files[name][3],)
+                    self.stats['unchanged_rewrites'] += 1
+                    continue
+                
+                # Swapping the tuple is atomic; readers see the old or the new config
+                self._files[name] = entry
+                self.stats['reloads'] += 1
+                reloaded.append(name)
+            subscribers = list(self._subscribers)
+        
+        for name in reloaded:
+            print(f"[Config] Reloaded {name}")
+            config = self._files[name][3]
+            for callback, wanted in subscribers:
+                if wanted not in (None, name):
+                    continue
+                try:
+                    callback(name, config)
+                except Exception as e:
+                    print(f"[Config] Reload subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+        return reloaded
+    
+    def start(self, interval=None):
+        """Start the background watcher thread (idempotent)"""
+        if self._thread is not None:
+            return
+        interval = interval or Config.CONFIG_WATCH_INTERVAL
+        
+        def watch_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"[Config] Watcher error: {e}")
+        
+        self._thread = threading.Thread(target=watch_loop, name='config-watch', daemon=True)
+        self._thread.start()
+        print(f"[Config] Watching {self.directory} every {interval}s")
+    
+    def get_stats(self):
+        """Get watcher counters and the hash of each cached file"""
+        stats = dict(self.stats)
+        stats['files'] = {name: entry[2][:12] for name, entry in self._files.items()}
+        return stats
+
+# Global config cache instance
+config_cache = ConfigCache(Config.CONFIG_DIR)
@@ -6,15 +6,44 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory, stream_with_context
 from flask_cors import CORS
+import csv
+import io
+import json
+import time
+import zlib
 from storage.storage import storage
+from storage.journal import ingest_journal
+from storage.timeseries import parse_time, parse_duration, to_epoch_ms, encode_cursor, decode_cursor
 from storage.alarm_engine import alarm_engine
-from config.config import Config
+from storage.event_coalescer import event_coalescer
+from storage.latest_cache import latest_cache
+from normalizer.normalizer import normalizer
+from normalizer.anomaly import anomaly_detector
+from pipeline.ingest import ingest_pipeline
+from collectors.async_runtime import collector_runtime
+from pipeline.shards import shard_pool
+from pipeline.telemetry import telemetry
+from config.config import Config, config_cache
 
 app = Flask(__name__, static_folder='static')
 CORS(app)
 
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    """Request latency per endpoint (the view function name, so the label set stays small)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        telemetry.observe('nms_http_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+        telemetry.count('nms_http_requests_total', endpoint=endpoint, status=response.status_code)
+    return response
+
 # API Routes
 
 @app.route('/api/devices', methods=['GET'])
@@ -27,23 +56,222 @@ def get_devices():
         'devices': devices
     })
 
+def _arg_list(name):
+    """Read a filter given as repeated and/or comma-separated query args"""
+    values = []
+    for arg in request.args.getlist(name):
+        values.extend(v.strip() for v in arg.split(',') if v.strip())
+    return values or None
+
+def _arg_limit(default=100):
+    """Read ?limit=, clamped to Config.METRICS_MAX_LIMIT"""
+    limit = int(request.args.get('limit', default))
+    return max(1, min(limit, Config.METRICS_MAX_LIMIT))
+
 @app.route('/api/metrics', methods=['GET'])
 def get_metrics():
-    """Get metrics with optional filters"""
-    device_id = request.args.get('device_id')
-    parameter = request.args.get('parameter')
-    limit = int(request.args.get('limit', 100))
+    """Get metrics with optional filters
+    
+    With step the response holds aggregated points read from the coarsest
+    rollup that satisfies the step. Otherwise raw samples are returned newest
+    first, one page of at most METRICS_MAX_LIMIT rows at a time; pass the
+    returned next_cursor back as ?cursor= to get the following page.
+    """
+    device_ids = _arg_list('device_id')
+    parameters = _arg_list('parameter')
+    
+    try:
+        end = parse_time(request.args.get('end'))
+        start = parse_time(request.args.get('start'))
+        step = parse_duration(request.args.get('step'))
+        cursor = decode_cursor(request.args.get('cursor'))
+        limit = _arg_limit()
+    except (ValueError, TypeError) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {e}'
+        }), 400
+    
+    if start is not None and end is not None and end <= start:
+        return jsonify({
+            'success': False,
+            'error': 'end must be after start'
+        }), 400
+    
+    if step is not None:
+        if step <= 0:
+            return jsonify({
+                'success': False,
+                'error': 'step must be positive'
+            }), 400
+        
+        # An explicit 0 (the epoch) is a real bound, not a missing one
+        if end is None:
+            end = int(time.time() * 1000)
+        if start is None:
+            start = end - Config.METRICS_DEFAULT_RANGE * 1000
+        
+        resolution, points = storage.get_metric_series(
+            start=start,
+            end=end,
+            step=step,
+            device_id=device_ids,
+            parameter=parameters,
+            location=_arg_list('location')
+        )
+        
+        return jsonify({
+            'success': True,
+            'resolution': resolution,
+            'step': step,
+            'count': len(points),
+            'metrics': points
+        })
     
     metrics = storage.get_metrics(
-        device_id=device_id,
-        parameter=parameter,
-        limit=limit
+        device_id=device_ids,
+        parameter=parameters,
+        limit=limit,
+        start=start,
+        end=end,
+        cursor=cursor
     )
     
+    next_cursor = None
+    if len(metrics) == limit:
+        last = metrics[-1]
+        next_cursor = encode_cursor(to_epoch_ms(last['timestamp']), last['id'])
+    
     return jsonify({
         'success': True,
         'count': len(metrics),
-        'metrics': metrics
+        'metrics': metrics,
+        'next_cursor': next_cursor
+    })
+
+EXPORT_COLUMNS = ['timestamp', 'device_id', 'device_type', 'protocol', 'location', 'parameter', 'value', 'unit']
+
+def _export_lines(metrics, fmt):
+    """Render metrics as NDJSON or CSV lines"""
+    if fmt == 'ndjson':
+        for metric in metrics:
+            yield json.dumps(metric, separators=(',', ':')) + '\n'
+        return
+    
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for metric in metrics:
+        writer.writerow(metric)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def _export_chunks(lines, compress):
+    """Group lines into EXPORT_CHUNK_BYTES chunks, gzip-compressing on the fly if asked"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending = []
+    size = 0
+    
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size < Config.EXPORT_CHUNK_BYTES:
+            continue
+        
+        data = ''.join(pending).encode('utf-8')
+        pending, size = [], 0
+        data = compressor.compress(data) if compressor else data
+        if data:
+            yield data
+    
+    data = ''.join(pending).encode('utf-8')
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+@app.route('/api/export/metrics', methods=['GET'])
+def export_metrics():
+    """Stream raw metrics oldest first as NDJSON (default) or CSV
+    
+    The body is produced row by row from a storage cursor and sent with
+    chunked transfer encoding; ?gzip=1 (or Accept-Encoding: gzip) compresses
+    it on the fly.
+    """
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({
+            'success': False,
+            'error': 'format must be ndjson or csv'
+        }), 400
+    
+    try:
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+    except (ValueError, TypeError) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {e}'
+        }), 400
+    
+    gzip_arg = request.args.get('gzip')
+    if gzip_arg is None:
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    else:
+        compress = gzip_arg.lower() in ('1', 'true', 'yes')
+    
+    metrics = storage.iter_metrics(
+        device_id=_arg_list('device_id'),
+        parameter=_arg_list('parameter'),
+        start=start,
+        end=end
+    )
+    
+    headers = {'Content-Disposition': f'attachment; filename=metrics.{fmt}'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    
+    return Response(
+        stream_with_context(_export_chunks(_export_lines(metrics, fmt), compress)),
+        mimetype='application/x-ndjson' if fmt == 'ndjson' else 'text/csv',
+        headers=headers
+    )
+
+@app.route('/api/latest', methods=['GET'])
+def get_latest():
+    """Get the latest value of every series (served from memory)"""
+    values = latest_cache.snapshot(parameter=request.args.get('parameter'))
+    return jsonify({
+        'success': True,
+        'count': len(values),
+        'latest': values
+    })
+
+@app.route('/api/latest/<device_id>', methods=['GET'])
+def get_latest_device(device_id):
+    """Get the latest value of every parameter of a device"""
+    values = latest_cache.get_device(device_id)
+    return jsonify({
+        'success': True,
+        'count': len(values),
+        'latest': values
+    })
+
+@app.route('/api/latest/<device_id>/<parameter>', methods=['GET'])
+def get_latest_series(device_id, parameter):
+    """Get the latest value and recent samples of one series"""
+    value = latest_cache.get(device_id, parameter, with_history=True)
+    if value is None:
+        return jsonify({
+            'success': False,
+            'error': f'No recent value for {device_id}/{parameter}'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'latest': value
     })
 
 @app.route('/api/alarms', methods=['GET'])
@@ -71,7 +299,8 @@ def get_alarm_stats():
     stats = alarm_engine.get_alarm_statistics()
     return jsonify({
         'success': True,
-        'statistics': stats
+        'statistics': stats,
+        'deduplication': event_coalescer.get_stats()
     })
 
 @app.route('/api/alarms/<alarm_id>/acknowledge', methods=['POST'])
@@ -119,6 +348,114 @@ def close_alarm(alarm_id):
             'error': str(e)
         }), 500
 
+@app.route('/api/storage/stats', methods=['GET'])
+def get_storage_stats():
+    """Get metric writer, cold-tier compaction and ingest journal statistics"""
+    try:
+        return jsonify({
+            'success': True,
+            'writer': storage.get_writer_stats(),
+            'compaction': storage.get_compaction_stats(),
+            'journal': ingest_journal.get_stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/pipeline/stats', methods=['GET'])
+def get_pipeline_stats():
+    """Get ingest queue depth, wait times, drops, worker utilization and shard progress"""
+    try:
+        return jsonify({
+            'success': True,
+            'pipeline': ingest_pipeline.get_stats(),
+            'shards': shard_pool.get_stats() if Config.SHARD_PROCESSES else None
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/collectors/stats', methods=['GET'])
+def get_collector_stats():
+    """Get poll counts, errors and in-flight polls of the async collector runtime"""
+    try:
+        return jsonify({
+            'success': True,
+            'runtime': Config.COLLECTOR_RUNTIME,
+            'collectors': collector_runtime.get_stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/anomaly/stats', methods=['GET'])
+def get_anomaly_stats():
+    """Get anomaly detector counters and per-series state size"""
+    try:
+        return jsonify({
+            'success': True,
+            'anomaly': anomaly_detector.get_stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/internal/metrics', methods=['GET'])
+def get_internal_metrics():
+    """The NMS's own telemetry: Prometheus text by default, JSON with ?format=json"""
+    fmt = request.args.get('format')
+    if fmt is None and 'application/json' in request.headers.get('Accept', ''):
+        fmt = 'json'
+    
+    if fmt == 'json':
+        return jsonify({
+            'success': True,
+            'telemetry': telemetry.snapshot()
+        })
+    
+    return Response(telemetry.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/normalizer/reload', methods=['POST'])
+def reload_normalizer():
+    """Recompile normalization rules from config/schemas.json"""
+    try:
+        # Pick up on-disk edits now instead of at the next watcher pass
+        config_cache.check()
+        stats = normalizer.reload_rules()
+        return jsonify({
+            'success': True,
+            'rules': stats
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/config/reload', methods=['POST'])
+def reload_config():
+    """Re-read changed config files now and notify reload subscribers"""
+    try:
+        reloaded = config_cache.check()
+        return jsonify({
+            'success': True,
+            'reloaded': reloaded,
+            'stats': config_cache.get_stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -11,36 +11,78 @@ import time
 from collectors.snmp_collector import SNMPCollector
 from collectors.restconf_collector import RESTCONFCollector
 from collectors.mqtt_collector import MQTTCollector
+from collectors.async_runtime import collector_runtime
 from normalizer.normalizer import normalize_and_enrich
+from normalizer.anomaly import anomaly_detector
 from storage.storage import storage
+from storage.journal import ingest_journal
 from storage.alarm_engine import alarm_engine
+from storage.event_coalescer import event_coalescer
+from storage.latest_cache import latest_cache
+from pipeline.ingest import ingest_pipeline
+from pipeline.shards import shard_pool
+from pipeline.telemetry import telemetry
 from dashboard.dashboard import run_dashboard
-from config.config import Config
+from config.config import Config, config_cache
 
 class NMSOrchestrator:
     def __init__(self):
         self.config = Config.load_devices()
         self.collectors = []
-        self.latest_metrics = []
         self.running = False
         
     def process_metrics(self, raw_metrics):
-        """Process collected metrics"""
-        try:
-            # Normalize and check thresholds
-            normalized_metrics, events = normalize_and_enrich(raw_metrics)
-            
-            # Store metrics
-            if normalized_metrics:
+        """Process collected metrics (runs on an ingest pipeline worker, which logs and counts errors)"""
+        # Normalize and check thresholds
+        started = time.perf_counter()
+        normalized_metrics, events = normalize_and_enrich(raw_metrics)
+        telemetry.observe('nms_stage_seconds', time.perf_counter() - started, stage='normalize')
+        
+        # Judge samples against each series' learned baseline
+        if anomaly_detector.enabled:
+            started = time.perf_counter()
+            events.extend(anomaly_detector.process(normalized_metrics))
+            telemetry.observe('nms_stage_seconds', time.perf_counter() - started, stage='anomaly')
+        
+        self.apply_results(normalized_metrics, events)
+    
+    def apply_results(self, normalized_metrics, events):
+        """Store normalized metrics and raise their events (in-process or from a shard)"""
+        # Store metrics (through the journal so collectors never wait on storage)
+        if normalized_metrics:
+            started = time.perf_counter()
+            if Config.JOURNAL_ENABLED:
+                ingest_journal.append(normalized_metrics)
+            else:
                 storage.store_metrics(normalized_metrics)
-                self.latest_metrics = normalized_metrics
-            
-            # Process events (alarms)
+            latest_cache.update(normalized_metrics)
+            telemetry.observe('nms_stage_seconds', time.perf_counter() - started, stage='store')
+        
+        # Process events (alarms), merging repeats inside the dedup window
+        if events:
+            started = time.perf_counter()
             for event in events:
-                alarm_engine.process_event(event)
-            
-        except Exception as e:
-            print(f"[Orchestrator] Error processing metrics: {e}")
+                event_coalescer.submit(event)
+            telemetry.observe('nms_stage_seconds', time.perf_counter() - started, stage='alarm')
+    
+    def start_collectors(self):
+        """Start every configured collector on the asyncio runtime (or one thread per device)"""
+        if Config.COLLECTOR_RUNTIME == 'threads':
+            self.start_snmp_collectors()
+            self.start_restconf_collectors()
+            self.start_mqtt_collectors()
+            return
+        
+        collectors = []
+        for device in self.config['devices']:
+            if device['protocol'] == 'SNMP':
+                collectors.append(SNMPCollector(device))
+            elif device['protocol'] == 'RESTCONF':
+                collectors.append(RESTCONFCollector(device))
+            elif device['protocol'] == 'MQTT':
+                collectors.append(MQTTCollector(device))
+        
+        collector_runtime.start(collectors, callback=ingest_pipeline.submit)
     
     def start_snmp_collectors(self):
         """Start all SNMP collectors"""
@@ -50,7 +92,7 @@ class NMSOrchestrator:
             collector = SNMPCollector(device)
             
             def run_collector():
-                collector.run(callback=self.process_metrics)
+                collector.run(callback=ingest_pipeline.submit)
             
             thread = threading.Thread(target=run_collector, daemon=True)
             thread.start()
@@ -65,7 +107,7 @@ class NMSOrchestrator:
             collector = RESTCONFCollector(device)
             
             def run_collector():
-                collector.run(callback=self.process_metrics)
+                collector.run(callback=ingest_pipeline.submit)
             
             thread = threading.Thread(target=run_collector, daemon=True)
             thread.start()
@@ -77,7 +119,7 @@ class NMSOrchestrator:
         mqtt_devices = [d for d in self.config['devices'] if d['protocol'] == 'MQTT']
         
         for device in mqtt_devices:
-            collector = MQTTCollector(device, callback=self.process_metrics)
+            collector = MQTTCollector(device, callback=ingest_pipeline.submit)
             
             def run_collector():
                 collector.run()
@@ -92,7 +134,7 @@ class NMSOrchestrator:
         def maintenance_loop():
             while self.running:
                 try:
-                    alarm_engine.run_maintenance(current_metrics=self.latest_metrics)
+                    alarm_engine.run_maintenance(latest=latest_cache)
                     time.sleep(60)  # Run every minute
                 except Exception as e:
                     print(f"[Orchestrator] Alarm maintenance error: {e}")
@@ -101,6 +143,26 @@ class NMSOrchestrator:
         thread.start()
         print("[Orchestrator] Started alarm maintenance")
     
+    def start_storage_maintenance(self):
+        """Start storage retention and cold-tier compaction loop"""
+        def maintenance_loop():
+            while self.running:
+                try:
+                    storage.enforce_retention()
+                except Exception as e:
+                    print(f"[Orchestrator] Storage retention error: {e}")
+                
+                try:
+                    storage.compact()
+                except Exception as e:
+                    print(f"[Orchestrator] Storage compaction error: {e}")
+                
+                time.sleep(Config.RETENTION_CHECK_INTERVAL)
+        
+        thread = threading.Thread(target=maintenance_loop, daemon=True)
+        thread.start()
+        print("[Orchestrator] Started storage maintenance")
+    
     def start_dashboard(self):
         """Start web dashboard"""
         def run_dash():
@@ -118,19 +180,44 @@ class NMSOrchestrator:
         
         self.running = True
         
+        # Shard processes fork first, before any other thread is running
+        if Config.SHARD_PROCESSES:
+            shard_pool.start(self.apply_results)
+            shard_pool.start_checkpoints()
+            alarm_engine.clear_state = shard_pool
+            handler = shard_pool.submit
+        else:
+            # Resume anomaly baselines from the last checkpoint
+            anomaly_detector.start()
+            handler = self.process_metrics
+        
+        # Replay unapplied journal batches before new metrics arrive
+        if Config.JOURNAL_ENABLED:
+            ingest_journal.start()
+        
+        # Reload devices.json/schemas.json edits (thresholds, rules, OIDs) without a restart
+        config_cache.start()
+        
+        # Collectors only queue raw batches; pipeline workers process them (or pass them to the shards)
+        ingest_pipeline.start(handler)
+        
         # Start all collectors
         print("[Orchestrator] Starting collectors...")
-        self.start_snmp_collectors()
-        self.start_restconf_collectors()
-        self.start_mqtt_collectors()
+        self.start_collectors()
         
         # Start alarm maintenance
         self.start_alarm_maintenance()
         
+        # Start storage retention and compaction
+        self.start_storage_maintenance()
+        
         # Start dashboard
         print("\n[Orchestrator] Starting dashboard...")
         self.start_dashboard()
         
+        # Store the NMS's own health as metrics of the nms_self device
+        telemetry.start(lambda metrics: self.apply_results(metrics, []))
+        
         print("\n" + "="*60)
         print("✅ NMS System Running!")
         print("="*60)
@@ -145,6 +232,25 @@ class NMSOrchestrator:
         except KeyboardInterrupt:
             print("\n\n[Orchestrator] Shutting down...")
             self.running = False
+            
+            # Stop polling, process queued raw batches, then flush merged events,
+            # buffered alarm occurrences and queued metrics
+            collector_runtime.stop()
+            ingest_pipeline.stop()
+            print(f"[Orchestrator] Ingest pipeline stats: {ingest_pipeline.get_stats()['totals']}")
+            if Config.SHARD_PROCESSES:
+                shard_pool.stop()
+                print(f"[Orchestrator] Shard stats: {shard_pool.get_stats()['totals']}")
+            event_coalescer.flush_expired(force=True)
+            print(f"[Orchestrator] Event coalescer stats: {event_coalescer.get_stats()}")
+            alarm_engine.flush()
+            if not Config.SHARD_PROCESSES:
+                anomaly_detector.checkpoint()
+            ingest_journal.close()
+            print(f"[Orchestrator] Ingest journal stats: {ingest_journal.get_stats()}")
+            storage.close()
+            print(f"[Orchestrator] Storage writer stats: {storage.get_writer_stats()}")
+            
             time.sleep(2)
             print("[Orchestrator] Stopped")
 
@@ -0,0 +1,316 @@
+"""
+Streaming Anomaly Detector
+Optional stage after normalize_and_enrich that learns a baseline per
+(device_id, parameter) and raises `anomaly` events when a sample's z-score
+leaves the configured bounds, so slow degradations and devices whose normal
+level sits near a fixed threshold are judged against their own history.
+
+Per series it keeps an EWMA mean, an EWMA variance of the residual and 24
+hour-of-day offsets (in standard deviations), packed into one 66-byte
+record of a shared bytearray. Settings come from the "anomaly" block of
+devices.json and follow config reloads; state is checkpointed to storage
+(save_state/load_state) so a restart resumes from the learned baselines.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import math
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from config.config import Config, config_cache
+from normalizer.normalizer import normalizer
+from storage.storage import storage
+
+# mean (f64), residual variance (f32), samples seen (u32), last z (f16)
+_HEAD = struct.Struct('<dfIe')
+# One hour-of-day offset, in standard deviations (f16)
+_OFFSET = struct.Struct('<e')
+_HOURS = 24
+RECORD_SIZE = _HEAD.size + _HOURS * _OFFSET.size
+_MAX_F32 = 3.4e38
+
+_CHECKPOINT_MAGIC = b'NMSA'
+_CHECKPOINT_HEAD = struct.Struct('<4sHII')  # magic, record size, series, key bytes
+
+_DEFAULTS = {
+    'enabled': False,
+    'parameters': [],  # normalized parameters to watch, or "*" for every numeric one
+    'z_warning': 4.0,
+    'z_critical': 6.0,
+    'alpha': 0.05,  # EWMA weight of each sample for the mean and variance
+    'seasonal_alpha': 0.1,  # EWMA weight of each sample for its hour-of-day offset
+    'warmup': 30,  # samples learned before a series can raise events
+}
+
+class AnomalyDetector:
+    def __init__(self, create_event, max_series=None):
+        self.create_event = create_event
+        self.max_series = max_series or Config.ANOMALY_MAX_SERIES
+        
+        self._slots = {}  # (device_id, parameter) -> record index
+        self._keys = []  # record index -> (device_id, parameter)
+        self._data = bytearray()
+        self._lock = threading.Lock()
+        self._thread = None
+        
+        self.stats = {'samples': 0, 'anomalies': 0, 'untracked': 0, 'checkpoints': 0}
+        self._apply_settings(Config.load_devices())
+        config_cache.subscribe(self._on_devices_reload, 'devices.json')
+    
+    def _apply_settings(self, config):
+        settings = dict(_DEFAULTS)
+        settings.update(config.get('anomaly', {}))
+        parameters = settings['parameters']
+        # Swapped as one tuple so a batch never mixes old and new settings
+        self._settings = (
+            settings,
+            None if parameters == '*' else frozenset(parameters),
+        )
+    
+    def _on_devices_reload(self, name, config):
+        """Pick up changed anomaly settings from a reloaded devices.json"""
+        self._apply_settings(config)
+    
+    @property
+    def enabled(self):
+        return self._settings[0]['enabled']
+    
+    def process(self, metrics):
+        """Learn from a batch of normalized metrics; returns anomaly events"""
+        settings, parameters = self._settings
+        if not settings['enabled']:
+            return []
+        
+        events = []
+        with self._lock:
+            for metric in metrics:
+                if parameters is not None and metric['parameter'] not in parameters:
+                    continue
+                try:
+                    value = float(metric['value'])
+                except (ValueError, TypeError):
+                    continue
+                if not math.isfinite(value):
+                    continue
+                
+                z = self._update(metric, value, settings)
+                if z is None:
+                    continue
+                
+                magnitude = abs(z)
+                if magnitude >= settings['z_critical']:
+                    severity, bound = 'CRITICAL', settings['z_critical']
+                elif magnitude >= settings['z_warning']:
+                    severity, bound = 'WARNING', settings['z_warning']
+                else:
+                    continue
+                
+                self.stats['anomalies'] += 1
+                direction = 'above' if z > 0 else 'below'
+                events.append(self.create_event(
+                    metric,
+                    'anomaly',
+                    severity,
+                    f"{metric['parameter']} anomalous: {metric['value']} {metric['unit']} is "
+                    f"{magnitude:.1f} std devs {direction} baseline (|z| >= {bound})"
+                ))
+        
+        return events
+    
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            if len(self._keys) >= self.max_series:
+                self.stats['untracked'] += 1
+                return None
+            slot = self._slots[key] = len(self._keys)
+            self._keys.append(key)
+            self._data.extend(bytes(RECORD_SIZE))
+        return slot
+    
+    def _update(self, metric, value, settings):
+        """Score a sample against its series baseline, then learn it; returns z or None in warmup"""
+        slot = self._slot((metric['device_id'], metric['parameter']))
+        if slot is None:
+            return None
+        self.stats['samples'] += 1
+        
+        offset = slot * RECORD_SIZE
+        hour = _hour_of(metric.get('timestamp'))
+        hour_offset = offset + _HEAD.size + hour * _OFFSET.size
+        mean, variance, count, _ = _HEAD.unpack_from(self._data, offset)
+        
+        if count == 0:
+            _HEAD.pack_into(self._data, offset, value, 0.0, 1, 0.0)
+            return None
+        
+        std = math.sqrt(variance)
+        seasonal = _OFFSET.unpack_from(self._data, hour_offset)[0]
+        residual = value - (mean + seasonal * std)
+        z = residual / std if std > 0 else 0.0
+        
+        # Learn from the sample, clipped so one outlier cannot drag the baseline
+        limit = settings['z_critical']
+        if std > 0 and abs(z) > limit:
+            residual = math.copysign(limit * std, residual)
+            value = mean + seasonal * std + residual
+        alpha = settings['alpha']
+        variance = min((1 - alpha) * variance + alpha * residual * residual, _MAX_F32)
+        if std > 0:
+            seasonal += settings['seasonal_alpha'] * ((value - mean) / std - seasonal)
+            _OFFSET.pack_into(self._data, hour_offset, max(-limit, min(limit, seasonal)))
+        mean += alpha * (value - mean)
+        
+        scored = count >= settings['warmup']
+        _HEAD.pack_into(self._data, offset, mean, variance, min(count + 1, 0xFFFFFFFF),
+                        max(-60000.0, min(60000.0, z)) if scored else 0.0)
+        return z if scored else None
+    
+    def is_clear(self, device_id, parameter):
+        """Whether a series' last sample was back inside the warning bound (None if untracked)"""
+        with self._lock:
+            slot = self._slots.get((device_id, parameter))
+            if slot is None:
+                return None
+            last_z = _HEAD.unpack_from(self._data, slot * RECORD_SIZE)[3]
+        return abs(last_z) < self._settings[0]['z_warning']
+    
+    def clear_states(self, keys):
+        """is_clear for many (device_id, parameter) series at once, keyed (device_id, parameter, 'anomaly')"""
+        bound = self._settings[0]['z_warning']
+        states = {}
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is not None:
+                    last_z = _HEAD.unpack_from(self._data, slot * RECORD_SIZE)[3]
+                    states[key + ('anomaly',)] = abs(last_z) < bound
+        return states
+    
+    # Checkpoints
+    
+    def snapshot(self):
+        """Every series' state as one uncompressed blob (see load and merge_snapshots)"""
+        with self._lock:
+            return _pack_snapshot(self._keys, bytes(self._data))
+    
+    def load(self, blob, keep=None):
+        """Replace the state with a snapshot, keeping the series keep(key) accepts; returns the count"""
+        keys, records = _unpack_snapshot(blob)
+        if keep is not None:
+            kept = [slot for slot, key in enumerate(keys) if keep(key)]
+            keys = [keys[slot] for slot in kept]
+            records = b''.join(records[slot * RECORD_SIZE:(slot + 1) * RECORD_SIZE] for slot in kept)
+        
+        with self._lock:
+            self._keys = keys[:self.max_series]
+            self._slots = {key: slot for slot, key in enumerate(self._keys)}
+            self._data = bytearray(records[:len(self._keys) * RECORD_SIZE])
+        return len(self._keys)
+    
+    def checkpoint(self):
+        """Save every series' state to storage; returns the checkpoint size in bytes"""
+        size = save_checkpoint(self.snapshot())
+        self.stats['checkpoints'] += 1
+        return size
+    
+    def restore(self):
+        """Load the last checkpoint from storage; returns the number of series restored"""
+        blob = load_checkpoint()
+        if blob is None:
+            return 0
+        
+        try:
+            return self.load(blob)
+        except ValueError as e:
+            print(f"[Anomaly] Ignoring checkpoint: {e}")
+            return 0
+    
+    def start(self):
+        """Restore the last checkpoint and checkpoint periodically (idempotent)"""
+        if self._thread is not None:
+            return
+        
+        restored = self.restore()
+        print(f"[Anomaly] Restored baselines for {restored} series")
+        
+        def checkpoint_loop():
+            while True:
+                time.sleep(Config.ANOMALY_CHECKPOINT_INTERVAL)
+                try:
+                    self.checkpoint()
+                except Exception as e:
+                    print(f"[Anomaly] Checkpoint error: {e}")
+        
+        self._thread = threading.Thread(target=checkpoint_loop, name='anomaly-checkpoint', daemon=True)
+        self._thread.start()
+    
+    def get_stats(self):
+        """Get counters and memory use of the per-series state"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['series'] = len(self._keys)
+            stats['state_bytes'] = len(self._data)
+        stats['record_bytes'] = RECORD_SIZE
+        stats['enabled'] = self.enabled
+        return stats
+
+def _hour_of(timestamp):
+    """UTC hour of an ISO-8601 timestamp ('2025-11-06T10:30:00Z' -> 10)"""
+    try:
+        return int(timestamp[11:13]) % _HOURS
+    except (TypeError, ValueError):
+        return datetime.utcnow().hour
+
+def _pack_snapshot(keys, records):
+    encoded = json.dumps(keys, separators=(',', ':')).encode('utf-8')
+    return _CHECKPOINT_HEAD.pack(_CHECKPOINT_MAGIC, RECORD_SIZE, len(keys), len(encoded)) + encoded + records
+
+def _unpack_snapshot(blob):
+    """(keys, records) of a snapshot; raises ValueError if it is not one this version wrote"""
+    try:
+        magic, record_size, count, key_bytes = _CHECKPOINT_HEAD.unpack_from(blob)
+    except struct.error:
+        raise ValueError('truncated checkpoint')
+    if magic != _CHECKPOINT_MAGIC or record_size != RECORD_SIZE:
+        raise ValueError('incompatible checkpoint format')
+    start = _CHECKPOINT_HEAD.size
+    keys = [tuple(key) for key in json.loads(blob[start:start + key_bytes])]
+    records = blob[start + key_bytes:]
+    if len(keys) != count or len(records) != count * RECORD_SIZE:
+        raise ValueError('truncated checkpoint')
+    return keys, records
+
+def merge_snapshots(blobs):
+    """One snapshot holding the series of several (e.g. one per shard process)"""
+    keys, records = [], []
+    for blob in blobs:
+        part_keys, part_records = _unpack_snapshot(blob)
+        keys.extend(part_keys)
+        records.append(part_records)
+    return _pack_snapshot(keys, b''.join(records))
+
+def save_checkpoint(blob):
+    """Compress a snapshot into storage; returns its stored size"""
+    data = zlib.compress(blob, 1)
+    storage.save_state('anomaly_detector', data)
+    return len(data)
+
+def load_checkpoint():
+    """The last saved snapshot, or None"""
+    data = storage.load_state('anomaly_detector')
+    if not data:
+        return None
+    try:
+        return zlib.decompress(data)
+    except zlib.error as e:
+        print(f"[Anomaly] Ignoring checkpoint: {e}")
+        return None
+
+# Global anomaly detector instance
+anomaly_detector = AnomalyDetector(normalizer._create_event)
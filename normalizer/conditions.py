@@ -0,0 +1,213 @@
+"""
+Streaming Alarm Conditions
+Per-series state for threshold rules that look at more than one sample.
+A parameter's block in the devices.json "thresholds" section may add:
+
+    average_over   compare the mean of the last M samples instead of each sample
+    raise_after    raise only when N samples ...
+    raise_window   ... of the last M (default N) reach the warning level
+    clear          once raised, stay raised until the level drops below this
+                   (hysteresis; default: the warning level)
+    rate_warning   raise a rate_of_change event when the value moves faster
+    rate_critical  than this many units per second (either direction)
+
+Every update is O(1): running sums and counts over fixed-size windows.
+Parameters without these keys keep the single-sample check in Normalizer.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+from collections import OrderedDict, deque
+from config.config import Config
+from storage.timeseries import to_epoch_ms
+
+STREAMING_KEYS = ('average_over', 'raise_after', 'raise_window', 'clear', 'rate_warning', 'rate_critical')
+
+def is_streaming(threshold_config):
+    """Whether a threshold block needs per-series state"""
+    return any(key in threshold_config for key in STREAMING_KEYS)
+
+def clear_level(threshold_config):
+    """Level an alarm must drop below to clear (None if the block has no levels)"""
+    return threshold_config.get('clear', threshold_config.get('warning'))
+
+class SeriesState:
+    __slots__ = ('config', 'values', 'total', 'breaches', 'breach_count', 'samples',
+                 'level', 'raised', 'rate', 'rate_raised')
+    
+    def __init__(self, config):
+        self.config = config
+        self.values = deque()  # last average_over values
+        self.total = 0.0
+        self.breaches = deque()  # last raise_window breach flags
+        self.breach_count = 0
+        self.samples = deque()  # (seconds, value) pairs spanning the rate window
+        self.level = None
+        self.raised = False
+        self.rate = None
+        self.rate_raised = False
+
+class ConditionTracker:
+    def __init__(self, max_series=None):
+        self.max_series = max_series or Config.CONDITION_MAX_SERIES
+        
+        # (device_id, parameter) -> SeriesState, least recently updated first
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+    
+    def evaluate(self, metric, threshold_config):
+        """Feed one sample; returns (event_type, severity, message) for each raised condition"""
+        try:
+            value = float(metric['value'])
+        except (ValueError, TypeError):
+            return []  # Value not numeric, skip threshold check
+        if value != value:
+            return []
+        
+        key = (metric['device_id'], metric['parameter'])
+        with self._lock:
+            state = self._series.get(key)
+            if state is None or state.config is not threshold_config:
+                # New series, or thresholds were reloaded: start the windows over
+                raised = state.raised if state is not None else False
+                state = SeriesState(threshold_config)
+                state.raised = raised
+                self._series[key] = state
+                if len(self._series) > self.max_series:
+                    self._series.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._series.move_to_end(key)
+            
+            self._update_level(state, value)
+            conditions = []
+            
+            if self._update_raised(state):
+                conditions.append(('threshold_exceeded',) + self._describe_level(metric, state))
+            
+            if 'rate_warning' in threshold_config or 'rate_critical' in threshold_config:
+                severity = self._update_rate(state, metric, value)
+                if severity is not None:
+                    limit = threshold_config[f'rate_{severity.lower()}']
+                    conditions.append((
+                        'rate_of_change',
+                        severity,
+                        f"{metric['parameter']} changing at {state.rate:+.3g} {metric.get('unit', '')}/s "
+                        f"(|rate| >= {limit})"
+                    ))
+            
+            return conditions
+    
+    def _update_level(self, state, value):
+        """Slide the averaging window and take the level compared against thresholds"""
+        window = state.config.get('average_over', 1)
+        state.values.append(value)
+        state.total += value
+        if len(state.values) > window:
+            state.total -= state.values.popleft()
+        state.level = state.total / len(state.values)
+    
+    def _update_raised(self, state):
+        """Apply hold-down on the way up and the clear level on the way down"""
+        config = state.config
+        if 'warning' not in config and 'critical' not in config:
+            return False
+        
+        raise_level = config.get('warning', config.get('critical'))
+        breach = state.level >= raise_level
+        need = config.get('raise_after', 1)
+        window = config.get('raise_window', need)
+        
+        state.breaches.append(breach)
+        state.breach_count += breach
+        if len(state.breaches) > window:
+            state.breach_count -= state.breaches.popleft()
+        
+        if state.raised:
+            clear = config.get('clear', raise_level)
+            if state.level < clear:
+                state.raised = False
+        elif state.breach_count >= need:
+            state.raised = True
+        
+        return state.raised
+    
+    def _describe_level(self, metric, state):
+        config = state.config
+        param = metric['parameter']
+        unit = metric.get('unit', '')
+        window = config.get('average_over', 1)
+        shown = f"{state.level:.4g}" if window > 1 else metric['value']
+        suffix = f" ({window}-sample average)" if window > 1 else ''
+        
+        for severity in ('critical', 'warning'):
+            if severity in config and state.level >= config[severity]:
+                return (severity.upper(), f"{param} exceeded {severity} threshold: {shown} {unit} >= {config[severity]}{suffix}")
+        
+        # In the hysteresis band: still raised until it drops below the clear level
+        severity = 'WARNING' if 'warning' in config else 'CRITICAL'
+        return (severity, f"{param} above clear level: {shown} {unit} >= {clear_level(config)}{suffix}")
+    
+    def _update_rate(self, state, metric, value):
+        """Rate over the averaging window (at least two samples); returns a severity or None"""
+        config = state.config
+        try:
+            seconds = to_epoch_ms(metric['timestamp']) / 1000
+        except (KeyError, ValueError, TypeError, AttributeError):
+            return None
+        
+        state.samples.append((seconds, value))
+        if len(state.samples) > max(2, config.get('average_over', 1)):
+            state.samples.popleft()
+        
+        oldest_seconds, oldest_value = state.samples[0]
+        if len(state.samples) < 2 or seconds <= oldest_seconds:
+            state.rate = None
+            state.rate_raised = False
+            return None
+        
+        state.rate = (value - oldest_value) / (seconds - oldest_seconds)
+        for severity in ('critical', 'warning'):
+            limit = config.get(f'rate_{severity}')
+            if limit is not None and abs(state.rate) >= limit:
+                state.rate_raised = True
+                return severity.upper()
+        state.rate_raised = False
+        return None
+    
+    def is_clear(self, device_id, parameter, event_type='threshold_exceeded'):
+        """Whether a series' condition has cleared (None if the series has no state)"""
+        with self._lock:
+            state = self._series.get((device_id, parameter))
+            if state is None:
+                return None
+            if event_type == 'rate_of_change':
+                return not state.rate_raised
+            return not state.raised
+    
+    def clear_states(self, keys):
+        """is_clear for many (device_id, parameter) series at once, keyed (device_id, parameter, event_type)"""
+        states = {}
+        with self._lock:
+            for key in keys:
+                state = self._series.get(key)
+                if state is not None:
+                    states[key + ('threshold_exceeded',)] = not state.raised
+                    states[key + ('rate_of_change',)] = not state.rate_raised
+        return states
+    
+    def get_stats(self):
+        """Get tracked series counts"""
+        with self._lock:
+            return {
+                'series': len(self._series),
+                'raised': sum(1 for state in self._series.values() if state.raised),
+                'rate_raised': sum(1 for state in self._series.values() if state.rate_raised),
+                'evictions': self.evictions,
+            }
+
+# Global condition tracker instance
+series_conditions = ConditionTracker()
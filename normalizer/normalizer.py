@@ -7,14 +7,51 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from datetime import datetime
-from config.config import Config
+from config.config import Config, config_cache
+from normalizer.rules import NormalizationRules
+from normalizer.conditions import series_conditions, is_streaming
+
+try:
+    import numpy as np
+except ImportError:  # optional: without NumPy every batch takes the scalar path
+    np = None
 
 class Normalizer:
     def __init__(self):
         self.thresholds = Config.get_thresholds()
+        self._threshold_cache = None  # see _threshold_plan
+        self.rules = self._compile_rules()
+        
+        config_cache.subscribe(self._on_devices_reload, 'devices.json')
+        config_cache.subscribe(self._on_schemas_reload, 'schemas.json')
+    
+    def _on_devices_reload(self, name, config):
+        """Swap in thresholds from a reloaded devices.json"""
+        self.thresholds = config.get('thresholds', {})
+        print(f"[Normalizer] Reloaded thresholds for {len(self.thresholds)} parameters")
+    
+    def _on_schemas_reload(self, name, config):
+        """Recompile normalization rules from a reloaded schemas.json"""
+        self.reload_rules()
+    
+    def _compile_rules(self):
+        """Compile the normalization rules from config/schemas.json"""
+        return NormalizationRules(Config.load_schemas().get('normalization'))
+    
+    def reload_rules(self):
+        """Recompile the normalization rules without a restart"""
+        rules = self._compile_rules()
+        # Swapping the reference is atomic; in-flight batches finish on the old rules
+        self.rules = rules
+        
+        stats = rules.get_stats()
+        print(f"[Normalizer] Reloaded rules: {stats['exact_rules']} exact, {stats['patterns']} patterns")
+        return stats
         
     def normalize_metric(self, raw_metric):
         """Convert raw metric to unified format"""
+        # Standard parameter name, unit and value parser, from the compiled rules
+        parameter, unit, parse = self.rules.resolve(raw_metric.get('protocol'), raw_metric.get('parameter'))
         
         # Extract common fields
         normalized = {
@@ -22,67 +59,14 @@ class Normalizer:
             'device_type': raw_metric.get('device_type'),
             'protocol': raw_metric.get('protocol'),
             'location': raw_metric.get('location'),
-            'parameter': self._normalize_parameter_name(raw_metric.get('parameter')),
-            'value': self._normalize_value(raw_metric.get('parameter'), raw_metric.get('value')),
-            'unit': self._get_unit(raw_metric.get('parameter')),
+            'parameter': parameter,
+            'value': parse(raw_metric.get('value')),
+            'unit': unit if unit is not None else raw_metric.get('unit', ''),
             'timestamp': raw_metric.get('timestamp', datetime.utcnow().isoformat() + 'Z')
         }
         
         return normalized
     
-    def _normalize_parameter_name(self, param):
-        """Standardize parameter names across protocols"""
-        # Map protocol-specific names to standard names
-        mappings = {
-            # SNMP OID parameters
-            'cpu_usage': 'cpu_usage',
-            'memory_usage': 'memory_usage',
-            'uptime': 'uptime',
-            
-            # RESTCONF parameters
-            'system_cpu_usage': 'cpu_usage',
-            'system_memory_used': 'memory_used',
-            'system_temperature': 'temp_celsius',
-            'system_uptime': 'uptime',
-            
-            # MQTT parameters
-            'temp1': 'temp_celsius',
-            'humidity1': 'humidity_percent',
-            'pressure1': 'pressure_kpa',
-        }
-        
-        return mappings.get(param, param)
-    
-    def _normalize_value(self, param, value):
-        """Convert value to appropriate type and scale"""
-        try:
-            # Try to convert to number
-            if isinstance(value, str):
-                # Remove any non-numeric characters (except decimal point and minus)
-                cleaned = ''.join(c for c in value if c.isdigit() or c in ['.', '-'])
-                if cleaned:
-                    value = float(cleaned) if '.' in cleaned else int(cleaned)
-            
-            return value
-        except:
-            return value
-    
-    def _get_unit(self, param):
-        """Determine unit for parameter"""
-        unit_mappings = {
-            'cpu_usage': 'percent',
-            'memory_usage': 'MB',
-            'memory_used': 'MB',
-            'temp_celsius': 'celsius',
-            'humidity_percent': 'percent',
-            'pressure_kpa': 'kPa',
-            'uptime': 'seconds',
-            'tx_packets': 'count',
-            'rx_packets': 'count',
-        }
-        
-        return unit_mappings.get(param, '')
-    
     def check_thresholds(self, metric):
         """Check if metric exceeds thresholds and generate events"""
         events = []
@@ -96,6 +80,13 @@ class Normalizer:
         
         threshold_config = self.thresholds[param]
         
+        # Windowed, hysteresis and rate rules keep per-series state
+        if param in self._threshold_plan()[0]:
+            return [
+                self._create_event(metric, event_type, severity, message)
+                for event_type, severity, message in series_conditions.evaluate(metric, threshold_config)
+            ]
+        
         try:
             value_num = float(value)
             
@@ -124,6 +115,88 @@ class Normalizer:
         
         return events
     
+    def check_thresholds_batch(self, metrics):
+        """Check a batch against thresholds with one array comparison for the whole batch"""
+        streaming, index, critical, warning = self._threshold_plan()
+        
+        # Stateful rules see each series' samples in order, so they stay per metric
+        events = []
+        if streaming:
+            for row, metric in enumerate(metrics):
+                if metric['parameter'] in streaming:
+                    events.extend((row, event) for event in self.check_thresholds(metric))
+        
+        # Rows whose parameter has single-sample thresholds, and each row's threshold slot
+        codes = np.fromiter((index.get(metric['parameter'], -1) for metric in metrics),
+                            dtype=np.intp, count=len(metrics))
+        rows = np.flatnonzero(codes >= 0)
+        if not rows.size:
+            return [event for _, event in events]
+        codes = codes[rows]
+        values = self._to_array([metrics[i]['value'] for i in rows.tolist()])
+        
+        # Critical wins over warning, as in check_thresholds; NaN (missing level,
+        # non-numeric value) never breaches
+        hit_critical = values >= critical[codes]
+        hit_warning = (values >= warning[codes]) & ~hit_critical
+        
+        # Build events only for breaching rows, in batch order
+        merge = bool(events)
+        for i in np.flatnonzero(hit_critical | hit_warning).tolist():
+            row = int(rows[i])
+            metric = metrics[row]
+            param = metric['parameter']
+            severity, level = ('CRITICAL', 'critical') if hit_critical[i] else ('WARNING', 'warning')
+            events.append((row, self._create_event(
+                metric,
+                'threshold_exceeded',
+                severity,
+                f"{param} exceeded {level} threshold: {metric['value']} {metric['unit']} >= {self.thresholds[param][level]}"
+            )))
+        
+        if merge:
+            events.sort(key=lambda item: item[0])
+        return [event for _, event in events]
+    
+    def _threshold_plan(self):
+        """Thresholds as (streaming parameters, parameter -> slot, critical levels, warning levels)
+        
+        Rebuilt when the thresholds change; only single-sample parameters get
+        slots, and the arrays are None without NumPy.
+        """
+        thresholds = self.thresholds
+        cached = self._threshold_cache
+        if cached is None or cached[0] is not thresholds:
+            streaming = frozenset(param for param, level in thresholds.items() if is_streaming(level))
+            params = [param for param in thresholds if param not in streaming]
+            levels = [thresholds[param] for param in params]
+            arrays = (None, None)
+            if np is not None:
+                arrays = (
+                    np.array([level.get('critical', np.nan) for level in levels], dtype=float),
+                    np.array([level.get('warning', np.nan) for level in levels], dtype=float),
+                )
+            cached = self._threshold_cache = (
+                thresholds,
+                streaming,
+                {param: slot for slot, param in enumerate(params)},
+            ) + arrays
+        return cached[1:]
+    
+    def _to_array(self, values):
+        """Values as a float array; non-numeric values become NaN"""
+        try:
+            return np.array(values, dtype=float)
+        except (ValueError, TypeError):
+            return np.fromiter((self._to_float(value) for value in values), dtype=float, count=len(values))
+    
+    @staticmethod
+    def _to_float(value):
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            return float('nan')
+    
     def _create_event(self, metric, event_type, severity, message):
         """Create event from metric"""
         return {
@@ -141,17 +214,15 @@ class Normalizer:
     
     def process(self, raw_metrics):
         """Process raw metrics - normalize and check thresholds"""
-        normalized_metrics = []
-        events = []
+        normalized_metrics = [self.normalize_metric(raw_metric) for raw_metric in raw_metrics]
         
-        for raw_metric in raw_metrics:
-            # Normalize metric
-            normalized = self.normalize_metric(raw_metric)
-            normalized_metrics.append(normalized)
-            
-            # Check for threshold violations
-            threshold_events = self.check_thresholds(normalized)
-            events.extend(threshold_events)
+        # Check for threshold violations, vectorized once the batch is big enough to pay off
+        if np is not None and len(normalized_metrics) >= Config.THRESHOLD_BATCH_MIN:
+            return normalized_metrics, self.check_thresholds_batch(normalized_metrics)
+        
+        events = []
+        for normalized in normalized_metrics:
+            events.extend(self.check_thresholds(normalized))
         
         return normalized_metrics, events
 
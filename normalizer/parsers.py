@@ -0,0 +1,181 @@
+"""
+Value Parsers
+Typed parsers for raw metric values, built once per (protocol, raw
+parameter) from the "parsers" rules in config/schemas.json. Native numbers
+take the int()/float() fast path; strings are handled by C-level
+conversions and precompiled regexes instead of per-character loops.
+
+Parser specs are a name or a dict with a "type" and options:
+
+    number     int or float; "12.5 %" -> 12.5, "Gauge32: 7" -> 7, other text is kept (default)
+    integer    int
+    counter    int from Counter32/Counter64 output such as "Counter64: 123"
+    timeticks  hundredths of a second (or "Timeticks: (123) 0:00:01.23") -> seconds
+    boolean    True/False from true/false, yes/no, on/off, 1/0
+    enum       canonical status text via "values", e.g. {"1": "up", "2": "down"}
+    octets     text; "0x..." hex octet strings are decoded when printable
+    text       str(value)
+
+number, integer and counter accept "scale" (e.g. 0.001 for ms -> s).
+"""
+import json
+import re
+
+# A number with an optional SNMP type prefix ("Gauge32: 7") or unit suffix
+# ("42.5 %", "37C"); anything else (e.g. "Linux 5.4") is not a number
+_NUMBER = re.compile(
+    r'\s*(?:(?:Counter32|Counter64|Gauge32|Unsigned32|Integer32|INTEGER):\s*)?'
+    r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*(?:[^\d\s.][^\d]*)?'
+)
+# An integer behind a known SNMP type prefix ("Counter32: 42", "Timeticks: 12345");
+# other text ending in digits ("Linux 5.4", "1.2.3") is not a number
+_PREFIXED_INT = re.compile(
+    r'\s*(?:Counter32|Counter64|Gauge32|Unsigned32|Integer32|INTEGER|Timeticks):\s*(-?\d+)\s*'
+)
+# The tick count of net-snmp style TimeTicks output ("(12345) 0:02:03.45")
+_TICKS = re.compile(r'\s*(?:Timeticks:\s*)?\((\d+)\)')
+
+_TRUE = frozenset(('true', 'yes', 'on', '1', 'enabled'))
+_FALSE = frozenset(('false', 'no', 'off', '0', 'disabled'))
+
+def _to_number(text):
+    """Parse a numeric string as int or float, or return None"""
+    if text.isdigit():
+        return int(text)
+    match = _NUMBER.fullmatch(text)
+    if match is None:
+        return None
+    number = match.group(1)
+    if '.' in number or 'e' in number or 'E' in number:
+        return float(number)
+    return int(number)
+
+def _truncate(number):
+    """int(number), or number itself when it is NaN or infinite"""
+    try:
+        return int(number)
+    except (ValueError, OverflowError):
+        return number
+
+def _with_scale(parse, scale):
+    """Multiply a parser's numeric results by scale"""
+    if scale is None:
+        return parse
+    
+    def scaled(value):
+        value = parse(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value * scale
+        return value
+    return scaled
+
+def number_parser(scale=None):
+    def parse(value):
+        if isinstance(value, (int, float)):
+            return value
+        if isinstance(value, str):
+            parsed = _to_number(value)
+            return value if parsed is None else parsed
+        return value
+    return _with_scale(parse, scale)
+
+def integer_parser(scale=None):
+    def parse(value):
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            return _truncate(value)
+        if isinstance(value, str):
+            if value.isdigit():
+                return int(value)
+            parsed = _to_number(value)
+            if parsed is not None:
+                # NaN/inf ("1e400") have no int; keep the raw text
+                truncated = _truncate(parsed)
+                return value if isinstance(truncated, float) else truncated
+            match = _PREFIXED_INT.fullmatch(value)
+            return int(match.group(1)) if match else value
+        return value
+    return _with_scale(parse, scale)
+
+def timeticks_parser():
+    def parse(value):
+        if isinstance(value, (int, float)):
+            return value / 100
+        if isinstance(value, str):
+            if value.isdigit():
+                return int(value) / 100
+            match = _TICKS.match(value) or _PREFIXED_INT.fullmatch(value)
+            return int(match.group(1)) / 100 if match else value
+        return value
+    return parse
+
+def boolean_parser():
+    def parse(value):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)):
+            return value != 0
+        if isinstance(value, str):
+            lowered = value.strip().lower()
+            if lowered in _TRUE:
+                return True
+            if lowered in _FALSE:
+                return False
+        return value
+    return parse
+
+def enum_parser(values=None):
+    mapping = {str(key).lower(): canonical for key, canonical in (values or {}).items()}
+    
+    def parse(value):
+        if value is None:
+            return value
+        key = str(value).strip().lower()
+        return mapping.get(key, key)
+    return parse
+
+def octets_parser():
+    def parse(value):
+        if isinstance(value, str) and value.startswith('0x'):
+            try:
+                decoded = bytes.fromhex(value[2:]).decode('utf-8')
+            except ValueError:
+                return value
+            return decoded if decoded.isprintable() else value
+        return value if value is None else str(value)
+    return parse
+
+def text_parser():
+    def parse(value):
+        return value if value is None else str(value)
+    return parse
+
+PARSERS = {
+    'number': number_parser,
+    'integer': integer_parser,
+    'counter': integer_parser,
+    'timeticks': timeticks_parser,
+    'boolean': boolean_parser,
+    'enum': enum_parser,
+    'octets': octets_parser,
+    'text': text_parser,
+}
+
+_built = {}
+
+def build_parser(spec=None):
+    """Get the parser for a spec (name or {"type": ..., options}), shared per spec"""
+    spec = spec or 'number'
+    key = json.dumps(spec, sort_keys=True)
+    parser = _built.get(key)
+    if parser is None:
+        if isinstance(spec, str):
+            name, options = spec, {}
+        else:
+            options = dict(spec)
+            name = options.pop('type')
+        if name not in PARSERS:
+            raise ValueError(f"Unknown value parser: {name}")
+        parser = _built[key] = PARSERS[name](**options)
+    return parser
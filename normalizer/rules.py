@@ -0,0 +1,105 @@
+"""
+Normalization Rules
+Compiles the "normalization" section of config/schemas.json into a lookup
+table keyed by (protocol, raw_parameter) -> (parameter, unit, parser).
+Exact names are compiled up front; names resolved through regex patterns are
+memoized on first sight, so normalizing a metric is a single dict hit and
+the value parser (normalizer/parsers.py) is chosen once per series.
+"""
+import re
+from normalizer.parsers import build_parser
+
+# Cap on memoized pattern results (raw names are per device/interface, so
+# this only matters if a collector emits unbounded parameter names)
+MAX_MEMOIZED = 100000
+
+class NormalizationRules:
+    def __init__(self, config=None):
+        config = config or {}
+        self.units = dict(config.get('units', {}))
+        
+        # protocol ('*' for any) -> {raw: parameter}
+        self.parameters = {
+            protocol: dict(mapping)
+            for protocol, mapping in config.get('parameters', {}).items()
+        }
+        
+        # protocol ('*' for any) -> {parameter: parser}
+        self.parsers = {
+            protocol: {parameter: build_parser(spec) for parameter, spec in mapping.items()}
+            for protocol, mapping in config.get('parsers', {}).items()
+        }
+        self._default_parser = build_parser()
+        
+        # [(protocol, compiled regex, parameter template, unit or None, parser or None)]
+        self.patterns = [
+            (
+                rule.get('protocol', '*'),
+                re.compile(rule['match']),
+                rule.get('parameter'),
+                rule.get('unit'),
+                build_parser(rule['parser']) if rule.get('parser') else None
+            )
+            for rule in config.get('patterns', [])
+        ]
+        
+        # (protocol, raw) -> (parameter, unit, parser); exact rules are compiled now
+        self._table = {}
+        for protocol, mapping in self.parameters.items():
+            for raw, parameter in mapping.items():
+                self._table[(protocol, raw)] = (
+                    parameter, self.units.get(parameter), self._parser_for(protocol, parameter)
+                )
+        self._compiled = len(self._table)
+    
+    def _parser_for(self, protocol, parameter):
+        """Get the value parser for a normalized parameter, protocol rules first"""
+        parser = self.parsers.get(protocol, {}).get(parameter)
+        if parser is None:
+            parser = self.parsers.get('*', {}).get(parameter, self._default_parser)
+        return parser
+    
+    def resolve(self, protocol, raw):
+        """Get (parameter, unit, parser) for a raw parameter; unit is None when no rule sets one"""
+        result = self._table.get((protocol, raw))
+        if result is None:
+            result = self._resolve_slow(protocol, raw)
+        return result
+    
+    def _resolve_slow(self, protocol, raw):
+        """Resolve a table miss through '*' rules, then patterns, and memoize it"""
+        result = self._table.get(('*', raw))
+        if result is not None:
+            parameter, unit, _ = result
+            result = (parameter, unit, self._parser_for(protocol, parameter))
+        
+        if result is None:
+            for rule_protocol, pattern, template, unit, parser in self.patterns:
+                if rule_protocol not in ('*', protocol):
+                    continue
+                match = pattern.match(raw or '')
+                if match:
+                    parameter = template.format(**match.groupdict()) if template else raw
+                    result = (
+                        parameter,
+                        self.units.get(parameter) if unit is None else unit,
+                        parser or self._parser_for(protocol, parameter)
+                    )
+                    break
+        
+        if result is None:
+            result = (raw, self.units.get(raw), self._parser_for(protocol, raw))
+        
+        if len(self._table) < self._compiled + MAX_MEMOIZED:
+            self._table[(protocol, raw)] = result
+        return result
+    
+    def get_stats(self):
+        """Get rule and lookup table sizes"""
+        return {
+            'exact_rules': self._compiled,
+            'patterns': len(self.patterns),
+            'units': len(self.units),
+            'parsers': sum(len(mapping) for mapping in self.parsers.values()),
+            'memoized': len(self._table) - self._compiled,
+        }
@@ -0,0 +1,250 @@
+"""
+Ingest Pipeline
+Staged hand-off between the collectors and processing. Collector callbacks
+push raw batches onto bounded queues and return; a pool of workers runs
+normalize -> store -> alarm on them, so slow storage or alarm work no longer
+runs on SNMP poll threads or inside paho's network loop.
+
+Each worker owns one queue and batches are routed by a stable hash of the
+device_id, so a device's batches are processed in order (the streaming
+alarm conditions and anomaly baselines depend on it). When a queue is full
+the overflow policy decides:
+
+    block        the collector waits for room (backpressure; the default)
+    drop_oldest  the oldest queued batch is discarded to make room
+    sample       above INGEST_SAMPLE_HIGH_WATER only every
+                 INGEST_SAMPLE_EVERY-th batch is admitted; a full queue
+                 drops the incoming batch
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import time
+import zlib
+from collections import deque
+from config.config import Config
+from pipeline.telemetry import telemetry
+
+POLICIES = ('block', 'drop_oldest', 'sample')
+
+def shard_for(device_id, shards):
+    """Stable shard of a device (the same in every process and run)"""
+    return zlib.crc32(str(device_id).encode('utf-8')) % shards
+
+class IngestQueue:
+    """Bounded FIFO of raw batches with an overflow policy"""
+    
+    def __init__(self, maxsize, policy='block', sample_every=None, high_water=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.sample_every = sample_every or Config.INGEST_SAMPLE_EVERY
+        self.high_water = int(self.maxsize * (high_water or Config.INGEST_SAMPLE_HIGH_WATER))
+        
+        self._items = deque()  # (enqueued_at, batch)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._offered = 0  # batches offered while sampling
+        
+        self.stats = {
+            'enqueued': 0,
+            'dequeued': 0,
+            'dropped_batches': 0,
+            'dropped_metrics': 0,
+            'sampled_out': 0,
+            'blocked': 0,
+            'blocked_seconds': 0.0,
+            'max_depth': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+    
+    def put(self, batch):
+        """Queue a batch per the overflow policy; returns False if it was dropped"""
+        with self._cond:
+            if self._closed:
+                return False
+            
+            if len(self._items) >= self.maxsize and self.policy == 'block':
+                started = time.monotonic()
+                self.stats['blocked'] += 1
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._cond.wait()
+                self.stats['blocked_seconds'] += time.monotonic() - started
+                if self._closed:
+                    return False
+            
+            elif self.policy == 'drop_oldest':
+                while len(self._items) >= self.maxsize:
+                    _, dropped = self._items.popleft()
+                    self._drop(dropped)
+            
+            elif self.policy == 'sample':
+                if len(self._items) >= self.high_water:
+                    self._offered += 1
+                    if len(self._items) >= self.maxsize or self._offered % self.sample_every:
+                        self.stats['sampled_out'] += 1
+                        self._drop(batch)
+                        return False
+                else:
+                    self._offered = 0
+            
+            self._items.append((time.monotonic(), batch))
+            self.stats['enqueued'] += 1
+            if len(self._items) > self.stats['max_depth']:
+                self.stats['max_depth'] = len(self._items)
+            self._cond.notify_all()
+            return True
+    
+    def _drop(self, batch):
+        self.stats['dropped_batches'] += 1
+        self.stats['dropped_metrics'] += len(batch)
+    
+    def get(self, timeout=None):
+        """Take the oldest batch; None once closed and drained (or on timeout)"""
+        with self._cond:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            while not self._items:
+                if self._closed:
+                    return None
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            
+            enqueued_at, batch = self._items.popleft()
+            waited = time.monotonic() - enqueued_at
+            self.stats['dequeued'] += 1
+            self.stats['wait_seconds_total'] += waited
+            if waited > self.stats['wait_seconds_max']:
+                self.stats['wait_seconds_max'] = waited
+            self._cond.notify_all()
+            return batch
+    
+    def close(self):
+        """Refuse new batches and wake blocked producers; queued batches still drain"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+    
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['depth'] = len(self._items)
+            stats['oldest_wait_seconds'] = round(time.monotonic() - self._items[0][0], 3) if self._items else 0.0
+        stats['wait_seconds_avg'] = stats['wait_seconds_total'] / stats['dequeued'] if stats['dequeued'] else 0.0
+        return stats
+
+class IngestPipeline:
+    def __init__(self, workers=None, queue_size=None, policy=None):
+        self.workers = workers or Config.INGEST_WORKERS
+        self.queue_size = queue_size or Config.INGEST_QUEUE_SIZE
+        self.policy = policy or Config.INGEST_OVERFLOW_POLICY
+        
+        # The total capacity is split across the per-worker queues
+        per_queue = max(1, self.queue_size // self.workers)
+        self.queues = [IngestQueue(per_queue, self.policy) for _ in range(self.workers)]
+        
+        self.handler = None
+        self._started_at = None
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.worker_stats = [
+            {'batches': 0, 'metrics': 0, 'errors': 0, 'busy_seconds': 0.0, 'max_batch_seconds': 0.0}
+            for _ in range(self.workers)
+        ]
+    
+    def start(self, handler):
+        """Start the workers, each calling handler(raw_metrics) (idempotent)"""
+        with self._start_lock:
+            if self._threads:
+                return
+            
+            self.handler = handler
+            self._started_at = time.monotonic()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, args=(index,), name=f'ingest-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        telemetry.gauge('nms_ingest_queue_depth', lambda: {index: queue.get_stats()['depth'] for index, queue in enumerate(self.queues)},
+                        'Raw batches queued per ingest worker', label='worker')
+        print(f"[Pipeline] Started {self.workers} workers (queue={self.queue_size} batches, policy={self.policy})")
+    
+    def submit(self, raw_metrics):
+        """Collector callback: queue a raw batch for its device's worker"""
+        if not raw_metrics:
+            return True
+        queue = self.queues[shard_for(raw_metrics[0].get('device_id'), self.workers)]
+        return queue.put(raw_metrics)
+    
+    def _work(self, index):
+        queue = self.queues[index]
+        stats = self.worker_stats[index]
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            
+            started = time.perf_counter()
+            failed = False
+            try:
+                self.handler(batch)
+            except Exception as e:
+                failed = True
+                print(f"[Pipeline] Worker {index} error: {e}")
+            elapsed = time.perf_counter() - started
+            
+            with self._stats_lock:
+                stats['errors'] += failed
+                stats['batches'] += 1
+                stats['metrics'] += len(batch)
+                stats['busy_seconds'] += elapsed
+                if elapsed > stats['max_batch_seconds']:
+                    stats['max_batch_seconds'] = elapsed
+    
+    def stop(self, timeout=10):
+        """Stop taking batches, let the workers drain what is queued (up to timeout)"""
+        for queue in self.queues:
+            queue.close()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        
+        left = sum(queue.get_stats()['depth'] for queue in self.queues)
+        print(f"[Pipeline] Stopped ({left} batches left unprocessed)")
+    
+    def get_stats(self):
+        """Get queue depth, wait time, drops and worker utilization, in total and per worker"""
+        queues = [queue.get_stats() for queue in self.queues]
+        with self._stats_lock:
+            workers = [dict(stats) for stats in self.worker_stats]
+        
+        totals = {key: sum(stats[key] for stats in queues) for key in (
+            'depth', 'enqueued', 'dequeued', 'dropped_batches', 'dropped_metrics', 'sampled_out', 'blocked', 'blocked_seconds'
+        )}
+        totals['wait_seconds_max'] = max(stats['wait_seconds_max'] for stats in queues)
+        totals['wait_seconds_avg'] = (
+            sum(stats['wait_seconds_total'] for stats in queues) / totals['dequeued'] if totals['dequeued'] else 0.0
+        )
+        totals['errors'] = sum(stats['errors'] for stats in workers)
+        
+        # Share of wall time each worker spent in the handler; near 1.0 means add workers
+        uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+        for queue_stats, worker in zip(queues, workers):
+            worker['utilization'] = round(worker['busy_seconds'] / uptime, 3) if uptime else 0.0
+            worker['queue'] = queue_stats
+        
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'policy': self.policy,
+            'totals': totals,
+            'per_worker': workers,
+        }
+
+# Global ingest pipeline instance
+ingest_pipeline = IngestPipeline()
@@ -0,0 +1,300 @@
+"""
+Sharded Processing
+Multi-process mode for the CPU-bound stages (Config.SHARD_PROCESSES > 0).
+Normalization, threshold checks, streaming conditions and anomaly scoring
+are pure Python, so in one process they share one GIL and a single core
+saturates long before the machine does.
+
+Each shard is a worker process that owns the devices whose stable hash
+(shard_for) lands on it, with its own normalizer, condition and anomaly
+state for them. Raw batches go to a shard over a pipe; the shard sends back
+the normalized metrics, events and any change in its series' clear state.
+A reader thread per shard hands the results to the parent, so the journal
+and storage writer remain the only writer and the event coalescer and
+alarm engine keep one view of every alarm.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import multiprocessing
+import signal
+import threading
+import time
+from config.config import Config, config_cache
+from pipeline.ingest import shard_for
+from pipeline.telemetry import telemetry
+
+class ShardPool:
+    def __init__(self, processes=None, start_method=None):
+        self.processes = processes or Config.SHARD_PROCESSES or os.cpu_count() or 1
+        self.start_method = start_method or Config.SHARD_START_METHOD
+        
+        self.apply = None
+        self._shards = []  # (process, inbox writer, outbox reader, send lock)
+        self._readers = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._checkpoint_thread = None
+        
+        # (device_id, parameter, event_type) -> cleared, as last reported by the shards
+        self._clear = {}
+        self._snapshots = {}
+        self._snapshot_cond = threading.Condition()
+        
+        self.shard_stats = [
+            {'batches_sent': 0, 'metrics_sent': 0, 'batches_done': 0, 'metrics_done': 0, 'errors': 0}
+            for _ in range(self.processes)
+        ]
+    
+    def start(self, apply):
+        """Start the shard processes; apply(normalized_metrics, events) gets their results (idempotent)
+        
+        Call before other threads start: the default start method on POSIX is
+        fork, and the shards must not inherit locks held by running threads.
+        """
+        with self._start_lock:
+            if self._shards:
+                return
+            
+            from normalizer.anomaly import load_checkpoint
+            snapshot = load_checkpoint()
+            
+            self.apply = apply
+            if self.start_method:
+                context = multiprocessing.get_context(self.start_method)
+            else:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+            
+            for index in range(self.processes):
+                inbox_reader, inbox_writer = context.Pipe(duplex=False)
+                outbox_reader, outbox_writer = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_shard_main,
+                    args=(index, self.processes, inbox_reader, outbox_writer, snapshot),
+                    name=f'nms-shard-{index}',
+                    daemon=True
+                )
+                process.start()
+                # The child's ends belong to the child now; closing ours lets recv see EOF
+                inbox_reader.close()
+                outbox_writer.close()
+                self._shards.append((process, inbox_writer, outbox_reader, threading.Lock()))
+            
+            for index in range(self.processes):
+                thread = threading.Thread(target=self._read, args=(index,), name=f'shard-reader-{index}', daemon=True)
+                thread.start()
+                self._readers.append(thread)
+        
+        print(f"[Shards] Started {self.processes} shard processes ({context.get_start_method()})")
+    
+    def submit(self, raw_metrics):
+        """Send a raw batch to the shards owning its devices (blocks while a shard's pipe is full)"""
+        if not raw_metrics:
+            return True
+        
+        first = raw_metrics[0].get('device_id')
+        if all(metric.get('device_id') == first for metric in raw_metrics):
+            parts = {shard_for(first, self.processes): raw_metrics}
+        else:
+            parts = {}
+            for metric in raw_metrics:
+                parts.setdefault(shard_for(metric.get('device_id'), self.processes), []).append(metric)
+        
+        for index, batch in parts.items():
+            _, inbox, _, lock = self._shards[index]
+            with lock:
+                inbox.send(('batch', batch))
+            with self._stats_lock:
+                stats = self.shard_stats[index]
+                stats['batches_sent'] += 1
+                stats['metrics_sent'] += len(batch)
+        return True
+    
+    def _read(self, index):
+        """Apply one shard's results in the order it produced them"""
+        outbox = self._shards[index][2]
+        stats = self.shard_stats[index]
+        while True:
+            try:
+                message = outbox.recv()
+            except (EOFError, OSError):
+                return
+            
+            kind = message[0]
+            if kind == 'snapshot':
+                with self._snapshot_cond:
+                    self._snapshots[index] = message[1]
+                    self._snapshot_cond.notify_all()
+                continue
+            
+            if kind == 'batch':
+                _, normalized_metrics, events, clear, timings = message
+                if clear:
+                    self._clear.update(clear)
+                # Stage latency measured in the shard, recorded here where it is served
+                for stage, seconds in timings.items():
+                    telemetry.observe('nms_stage_seconds', seconds, stage=stage)
+                try:
+                    self.apply(normalized_metrics, events)
+                except Exception as e:
+                    print(f"[Shards] Error applying shard {index} results: {e}")
+                with self._stats_lock:
+                    stats['batches_done'] += 1
+                    stats['metrics_done'] += len(normalized_metrics)
+            
+            elif kind == 'error':
+                print(f"[Shards] Shard {index} error: {message[1]}")
+                with self._stats_lock:
+                    stats['errors'] += 1
+                    stats['batches_done'] += 1
+    
+    def is_clear(self, device_id, parameter, event_type='threshold_exceeded'):
+        """Whether a shard's stateful condition has cleared (None if no shard tracks the series)"""
+        return self._clear.get((device_id, parameter, event_type))
+    
+    # Anomaly checkpoints
+    
+    def checkpoint(self, timeout=30):
+        """Collect every shard's anomaly state and save it as one checkpoint; returns its size"""
+        from normalizer.anomaly import merge_snapshots, save_checkpoint
+        
+        with self._snapshot_cond:
+            self._snapshots = {}
+        for _, inbox, _, lock in self._shards:
+            with lock:
+                inbox.send(('snapshot',))
+        
+        deadline = time.monotonic() + timeout
+        with self._snapshot_cond:
+            while len(self._snapshots) < len(self._shards):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"{len(self._shards) - len(self._snapshots)} shards did not send their state")
+                self._snapshot_cond.wait(remaining)
+            snapshots = [self._snapshots[index] for index in range(len(self._shards))]
+        
+        return save_checkpoint(merge_snapshots(snapshots))
+    
+    def start_checkpoints(self):
+        """Checkpoint the shards' anomaly baselines periodically (idempotent)"""
+        if self._checkpoint_thread is not None:
+            return
+        
+        def checkpoint_loop():
+            while True:
+                time.sleep(Config.ANOMALY_CHECKPOINT_INTERVAL)
+                try:
+                    self.checkpoint()
+                except Exception as e:
+                    print(f"[Shards] Checkpoint error: {e}")
+        
+        self._checkpoint_thread = threading.Thread(target=checkpoint_loop, name='shard-checkpoint', daemon=True)
+        self._checkpoint_thread.start()
+    
+    def stop(self, timeout=10):
+        """Checkpoint, let the shards finish the batches sent to them, then stop them"""
+        if not self._shards:
+            return
+        
+        try:
+            self.checkpoint()
+        except Exception as e:
+            print(f"[Shards] Final checkpoint failed: {e}")
+        
+        for _, inbox, _, lock in self._shards:
+            with lock:
+                inbox.send(None)
+        
+        deadline = time.monotonic() + timeout
+        for thread in self._readers:
+            thread.join(max(0, deadline - time.monotonic()))
+        for process, inbox, _, _ in self._shards:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+            inbox.close()
+        
+        stats = self.get_stats()['totals']
+        print(f"[Shards] Stopped ({stats['in_flight']} batches unfinished)")
+    
+    def get_stats(self):
+        """Get batches sent, finished and in flight, in total and per shard"""
+        with self._stats_lock:
+            shards = [dict(stats) for stats in self.shard_stats]
+        for index, stats in enumerate(shards):
+            stats['in_flight'] = stats['batches_sent'] - stats['batches_done']
+            if index < len(self._shards):
+                process = self._shards[index][0]
+                stats['pid'] = process.pid
+                stats['alive'] = process.is_alive()
+        
+        totals = {key: sum(stats[key] for stats in shards) for key in (
+            'batches_sent', 'metrics_sent', 'batches_done', 'metrics_done', 'errors', 'in_flight'
+        )}
+        return {
+            'processes': self.processes,
+            'start_method': self.start_method,
+            'tracked_conditions': len(self._clear),
+            'totals': totals,
+            'per_shard': shards,
+        }
+
+def _shard_main(index, shards, inbox, outbox, snapshot):
+    """Shard process: normalize, check thresholds and score anomalies for its devices"""
+    # Ctrl+C reaches the whole process group; the parent drains and stops the shards
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    from normalizer.normalizer import normalizer
+    from normalizer.conditions import series_conditions
+    from normalizer.anomaly import anomaly_detector
+    
+    if snapshot:
+        try:
+            anomaly_detector.load(snapshot, keep=lambda key: shard_for(key[0], shards) == index)
+        except ValueError as e:
+            print(f"[Shards] Shard {index} ignoring anomaly checkpoint: {e}")
+    
+    # Follow devices.json/schemas.json edits like the parent does
+    config_cache.start()
+    
+    reported = {}  # clear states already sent to the parent
+    while True:
+        try:
+            message = inbox.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        
+        if message[0] == 'snapshot':
+            outbox.send(('snapshot', anomaly_detector.snapshot()))
+            continue
+        
+        try:
+            started = time.perf_counter()
+            normalized_metrics, events = normalizer.process(message[1])
+            timings = {'normalize': time.perf_counter() - started}
+            if anomaly_detector.enabled:
+                started = time.perf_counter()
+                events.extend(anomaly_detector.process(normalized_metrics))
+                timings['anomaly'] = time.perf_counter() - started
+            
+            # Only clear-state changes travel back, so steady series cost nothing
+            keys = {(metric['device_id'], metric['parameter']) for metric in normalized_metrics}
+            states = series_conditions.clear_states(keys)
+            if anomaly_detector.enabled:
+                states.update(anomaly_detector.clear_states(keys))
+            changed = {key: cleared for key, cleared in states.items() if reported.get(key) != cleared}
+            reported.update(changed)
+        except Exception as e:
+            outbox.send(('error', str(e)))
+            continue
+        
+        outbox.send(('batch', normalized_metrics, events, changed, timings))
+    
+    outbox.close()
+
+# Global shard pool instance (started only when Config.SHARD_PROCESSES > 0)
+shard_pool = ShardPool()
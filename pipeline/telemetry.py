@@ -0,0 +1,315 @@
+"""
+Self-Telemetry
+Low-overhead instrumentation of the NMS itself: fixed-bucket histograms
+(poll duration, normalize/store/alarm stage latency, rows per write, SQLite
+lock waits, dashboard request latency), counters, and gauges that are read
+only when someone asks (queue depths). /api/internal/metrics serves them in
+Prometheus text format or as JSON.
+
+Every TELEMETRY_INTERVAL seconds the reporter also turns what happened in
+the interval (average and p95 per histogram, current gauges) into metrics of
+the synthetic device TELEMETRY_DEVICE_ID ('nms_self'), stored like any other
+device so the dashboard can chart the NMS's own health.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bisect
+import threading
+import time
+from datetime import datetime
+from config.config import Config
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (1, 10, 50, 100, 500, 1000, 2500, 5000, 10000, 50000)
+
+# name -> (type, help, buckets, unit); unit 'seconds' is reported in ms on nms_self
+METRICS = {
+    'nms_poll_seconds': ('histogram', 'Device poll duration by protocol', LATENCY_BUCKETS, 'seconds'),
+    'nms_poll_errors_total': ('counter', 'Failed device polls by protocol', None, None),
+    'nms_collector_wait_seconds': ('histogram', 'Time polls spent waiting for a protocol slot (limit) or a delivery thread (delivery)', LATENCY_BUCKETS, 'seconds'),
+    'nms_stage_seconds': ('histogram', 'Per-batch latency of the normalize, anomaly, store and alarm stages', LATENCY_BUCKETS, 'seconds'),
+    'nms_storage_write_seconds': ('histogram', 'Duration of one metric writer transaction', LATENCY_BUCKETS, 'seconds'),
+    'nms_storage_write_rows': ('histogram', 'Rows written per metric writer transaction', ROW_BUCKETS, 'rows'),
+    'nms_sqlite_lock_wait_seconds': ('histogram', 'Time spent waiting for the SQLite write lock', LATENCY_BUCKETS, 'seconds'),
+    'nms_http_request_seconds': ('histogram', 'Dashboard request latency by endpoint', LATENCY_BUCKETS, 'seconds'),
+    'nms_http_requests_total': ('counter', 'Dashboard requests by endpoint and status', None, None),
+}
+
+class Histogram:
+    """Cumulative counts per upper bound, Prometheus style (the last bucket is +Inf)"""
+    
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+    
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+    
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+def quantile(buckets, counts, q):
+    """Estimate a quantile from per-bucket counts, interpolating inside the bucket"""
+    total = sum(counts)
+    if not total:
+        return None
+    
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if seen + count >= rank and count:
+            if index == len(buckets):
+                return buckets[-1]  # +Inf bucket: the largest finite bound is all we know
+            lower = buckets[index - 1] if index else 0.0
+            return lower + (buckets[index] - lower) * (rank - seen) / count
+        seen += count
+    return buckets[-1]
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Telemetry:
+    def __init__(self, enabled=None, interval=None, device_id=None):
+        self.enabled = Config.TELEMETRY_ENABLED if enabled is None else enabled
+        self.interval = interval or Config.TELEMETRY_INTERVAL
+        self.device_id = device_id or Config.TELEMETRY_DEVICE_ID
+        self.per_device = Config.TELEMETRY_PER_DEVICE_POLLS
+        
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}  # (name, labels) -> count
+        self._gauges = {}  # name -> (help, fn, label); fn returns a number or {label value: number}
+        self._polls = {}  # device_id -> [protocol, polls, seconds total, last seconds, max seconds]
+        self._lock = threading.Lock()
+        
+        self._previous = {}  # histogram key -> (counts, sum, count) at the last nms_self sample
+        self._thread = None
+    
+    def observe(self, name, value, **labels):
+        """Record one observation in histogram name (labels in a fixed order per call site)"""
+        if not self.enabled:
+            return
+        key = (name, tuple(labels.items()))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(METRICS[name][2])
+        histogram.observe(value)
+    
+    def count(self, name, amount=1, **labels):
+        """Add to counter name"""
+        if not self.enabled:
+            return
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def gauge(self, name, fn, help, label=None):
+        """Register a gauge read on demand: fn() returns a number, or {label value: number} for label"""
+        with self._lock:
+            self._gauges[name] = (help, fn, label)
+    
+    def record_poll(self, device_id, protocol, seconds, failed=False):
+        """Record one poll: the protocol histogram plus the device's own totals"""
+        if not self.enabled:
+            return
+        self.observe('nms_poll_seconds', seconds, protocol=protocol)
+        if failed:
+            self.count('nms_poll_errors_total', protocol=protocol)
+        if not self.per_device:
+            return
+        
+        with self._lock:
+            entry = self._polls.get(device_id)
+            if entry is None:
+                entry = self._polls[device_id] = [protocol, 0, 0.0, 0.0, 0.0]
+            entry[1] += 1
+            entry[2] += seconds
+            entry[3] = seconds
+            if seconds > entry[4]:
+                entry[4] = seconds
+    
+    def _read_gauges(self):
+        """name -> (help, label, {label value or None: number}); failing gauges are left out"""
+        with self._lock:
+            gauges = dict(self._gauges)
+        
+        values = {}
+        for name, (help, fn, label) in gauges.items():
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"[Telemetry] Gauge {name} failed: {e}")
+                continue
+            values[name] = (help, label, value if isinstance(value, dict) else {None: value})
+        return values
+    
+    def _collect(self):
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = dict(self._counters)
+            polls = {device_id: list(entry) for device_id, entry in self._polls.items()}
+        histograms = [(key, histogram.buckets, histogram.snapshot()) for key, histogram in sorted(histograms, key=lambda item: item[0])]
+        return histograms, counters, polls, self._read_gauges()
+    
+    def render_prometheus(self):
+        """Everything in Prometheus text exposition format"""
+        histograms, counters, polls, gauges = self._collect()
+        lines = []
+        described = set()
+        
+        def describe(name, kind, help):
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+        
+        for (name, labels), buckets, (counts, total, count) in histograms:
+            describe(name, 'histogram', METRICS[name][1])
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_labels(labels, ("le", _number(bound)))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+        
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, 'counter', METRICS[name][1])
+            lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        
+        for name, (help, label, values) in sorted(gauges.items()):
+            describe(name, 'gauge', help)
+            for label_value, value in values.items():
+                labels = ((label, label_value),) if label and label_value is not None else ()
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        
+        if polls:
+            for suffix, kind, help, index in (
+                ('_count', 'counter', 'Polls of one device', 1),
+                ('_seconds_total', 'counter', 'Total poll time of one device', 2),
+                ('_last_seconds', 'gauge', 'Duration of the last poll of one device', 3),
+                ('_max_seconds', 'gauge', 'Longest poll of one device', 4),
+            ):
+                name = 'nms_device_poll' + suffix
+                describe(name, kind, help)
+                for device_id, entry in sorted(polls.items()):
+                    lines.append(f'{name}{_labels((("device_id", device_id), ("protocol", entry[0])))} {_number(entry[index])}')
+        
+        return '\n'.join(lines) + '\n'
+    
+    def snapshot(self):
+        """Everything as a JSON-friendly dict, histograms with avg/p50/p95/p99"""
+        histograms, counters, polls, gauges = self._collect()
+        result = {'histograms': {}, 'counters': {}, 'gauges': {}, 'devices': {}}
+        
+        for (name, labels), buckets, (counts, total, count) in histograms:
+            result['histograms'].setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': count,
+                'sum': total,
+                'avg': total / count if count else None,
+                'p50': quantile(buckets, counts, 0.5),
+                'p95': quantile(buckets, counts, 0.95),
+                'p99': quantile(buckets, counts, 0.99),
+                'buckets': dict(zip([_number(bound) for bound in buckets] + ['+Inf'], counts)),
+            })
+        
+        for (name, labels), value in counters.items():
+            result['counters'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        
+        for name, (help, label, values) in gauges.items():
+            result['gauges'][name] = values[None] if list(values) == [None] else values
+        
+        for device_id, (protocol, count, total, last, longest) in polls.items():
+            result['devices'][device_id] = {
+                'protocol': protocol,
+                'polls': count,
+                'avg_seconds': total / count if count else None,
+                'last_seconds': last,
+                'max_seconds': longest,
+            }
+        return result
+    
+    def sample(self):
+        """nms_self metrics for the interval since the previous sample"""
+        histograms, counters, polls, gauges = self._collect()
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        metrics = []
+        
+        def add(parameter, value, unit):
+            metrics.append({
+                'device_id': self.device_id,
+                'device_type': 'nms',
+                'protocol': 'internal',
+                'location': 'local',
+                'parameter': parameter,
+                'value': round(value, 3),
+                'unit': unit,
+                'timestamp': timestamp,
+            })
+        
+        for key, buckets, (counts, total, count) in histograms:
+            previous_counts, previous_total, previous_count = self._previous.get(key, ([0] * len(counts), 0.0, 0))
+            self._previous[key] = (counts, total, count)
+            if count == previous_count:
+                continue
+            
+            # Only the observations made since the last sample
+            delta = [now - before for now, before in zip(counts, previous_counts)]
+            name, labels = key
+            parameter = '_'.join([name[len('nms_'):].replace('_seconds', '')] + [str(value) for _, value in labels])
+            scale, unit = (1000, 'ms') if METRICS[name][3] == 'seconds' else (1, METRICS[name][3])
+            add(f'{parameter}_avg', scale * (total - previous_total) / (count - previous_count), unit)
+            add(f'{parameter}_p95', scale * quantile(buckets, delta, 0.95), unit)
+            add(f'{parameter}_count', count - previous_count, '')
+        
+        for name, (help, label, values) in gauges.items():
+            for label_value, value in values.items():
+                parameter = name[len('nms_'):] + (f'_{label_value}' if label_value is not None else '')
+                add(parameter, value, '')
+        
+        return metrics
+    
+    def start(self, sink):
+        """Hand sink(metrics) an nms_self sample every interval (idempotent)"""
+        if not self.enabled or self._thread is not None:
+            return
+        
+        def report_loop():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    metrics = self.sample()
+                    if metrics:
+                        sink(metrics)
+                except Exception as e:
+                    print(f"[Telemetry] Report error: {e}")
+        
+        self._thread = threading.Thread(target=report_loop, name='telemetry-reporter', daemon=True)
+        self._thread.start()
+        print(f"[Telemetry] Reporting as {self.device_id} every {self.interval}s")
+
+# Global telemetry instance
+telemetry = Telemetry()
@@ -7,78 +7,261 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import threading
 import time
 from datetime import datetime, timedelta
-from storage.storage import storage
-from config.config import Config
+from storage.storage import storage, alarm_id_for
+from config.config import Config, config_cache
+from normalizer.conditions import series_conditions, is_streaming, clear_level
+from normalizer.anomaly import anomaly_detector
 
 class AlarmEngine:
     def __init__(self):
         self.auto_close_timeout = Config.ALARM_AUTO_CLOSE_TIMEOUT
+        self.flush_interval = Config.ALARM_FLUSH_INTERVAL
+        self.thresholds = Config.get_thresholds()
+        config_cache.subscribe(self._on_devices_reload, 'devices.json')
         
-    def process_event(self, event):
-        """Process an event and update alarm state"""
-        # Store the alarm (creates new or updates existing)
-        storage.store_alarm(event)
+        # Set in sharded mode, where streaming conditions and anomaly baselines
+        # live in the shard processes (anything with is_clear(device, parameter, type))
+        self.clear_state = None
+        
+        # In-memory index of non-closed alarms keyed by alarm_id
+        self.active = {}
+        # alarm_id -> occurrences not yet written to storage
+        self.pending = {}
+        # alarm_id -> Event set once a new alarm's write-through has finished
+        self._inserting = {}
+        
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._flush_thread = None
+    
+    def _on_devices_reload(self, name, config):
+        """Swap in thresholds from a reloaded devices.json"""
+        self.thresholds = config.get('thresholds', {})
+    
+    def _ensure_loaded(self):
+        """Load non-closed alarms from storage into the index (once)"""
+        if self._loaded:
+            return
+        
+        for alarm in storage.get_active_alarms():
+            self.active[alarm['alarm_id']] = alarm
+        self._loaded = True
+        print(f"[Alarm Engine] Loaded {len(self.active)} active alarms")
+    
+    def _start_flusher(self):
+        """Start the write-behind flush loop (idempotent)"""
+        if self._flush_thread and self._flush_thread.is_alive():
+            return
+        
+        def flush_loop():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"[Alarm Engine] Flush error: {e}")
+        
+        self._flush_thread = threading.Thread(target=flush_loop, name='alarm-flusher', daemon=True)
+        self._flush_thread.start()
+    
+    def process_event(self, event, occurrences=1):
+        """Process an event and update alarm state
+        
+        New alarms are written through immediately (after the index lock is
+        released, with transitions of that alarm waiting for the insert);
+        repeat occurrences of an active alarm are counted in memory and
+        flushed in batches.
+        """
+        alarm_id = alarm_id_for(event)
+        
+        with self._lock:
+            self._ensure_loaded()
+            self._start_flusher()
+            
+            alarm = self.active.get(alarm_id)
+            if alarm is not None:
+                alarm['last_seen'] = event['timestamp']
+                alarm['severity'] = event['severity']
+                alarm['message'] = event['message']
+                alarm['occurrence_count'] = alarm.get('occurrence_count', 0) + occurrences
+                self.pending[alarm_id] = self.pending.get(alarm_id, 0) + occurrences
+                return
+            
+            alarm = {
+                'alarm_id': alarm_id,
+                'device_id': event['device_id'],
+                'device_type': event.get('device_type'),
+                'protocol': event.get('protocol'),
+                'location': event.get('location'),
+                'type': event['type'],
+                'category': event.get('category'),
+                'severity': event['severity'],
+                'state': 'OPEN',
+                'message': event['message'],
+                'first_seen': event['timestamp'],
+                'last_seen': event['timestamp'],
+                'acknowledged_at': None,
+                'resolved_at': None,
+                'closed_at': None,
+                'occurrence_count': occurrences
+            }
+            self.active[alarm_id] = alarm
+            snapshot = dict(alarm)
+            inserted = self._inserting[alarm_id] = threading.Event()
+        
+        # Write through so the new alarm shows up right away, outside the lock so a
+        # busy writer queue does not stall other events, flushes and transitions
+        try:
+            storage.upsert_alarms([(snapshot, occurrences)])
+            print(f"[Alarm Engine] New alarm {alarm_id}")
+        except Exception as e:
+            # Upserts add counts, so the flusher can insert it later without double counting
+            with self._lock:
+                self.pending[alarm_id] = self.pending.get(alarm_id, 0) + occurrences
+            print(f"[Alarm Engine] Deferred write of new alarm {alarm_id}: {e}")
+        finally:
+            with self._lock:
+                if self._inserting.get(alarm_id) is inserted:
+                    del self._inserting[alarm_id]
+            inserted.set()
+    
+    def flush(self):
+        """Write buffered repeat occurrences to storage in one batch"""
+        with self._lock:
+            if not self.pending:
+                return 0
+            
+            batch = [
+                (dict(self.active[alarm_id]), count)
+                for alarm_id, count in self.pending.items()
+                if alarm_id in self.active
+            ]
+            self.pending = {}
+            
+            try:
+                storage.upsert_alarms(batch)
+            except Exception:
+                # Keep the counts so the next flush retries them
+                for alarm, count in batch:
+                    self.pending[alarm['alarm_id']] = self.pending.get(alarm['alarm_id'], 0) + count
+                raise
+        
+        return len(batch)
+    
+    def _transition(self, alarm_id, new_state, timestamp_field):
+        """Move an alarm to a new state in memory and in storage"""
+        # The row must exist before its state is updated, or the late insert would reopen it
+        inserted = self._inserting.get(alarm_id)
+        if inserted is not None:
+            inserted.wait()
+        
+        with self._lock:
+            self._ensure_loaded()
+            
+            # Pending occurrences belong to the row before it changes state
+            self.flush()
+            
+            timestamp = datetime.utcnow().isoformat() + 'Z'
+            storage.update_alarm_state(alarm_id, new_state, timestamp=timestamp)
+            
+            alarm = self.active.get(alarm_id)
+            if alarm is None:
+                return
+            
+            if new_state == 'CLOSED':
+                del self.active[alarm_id]
+            else:
+                alarm['state'] = new_state
+                alarm[timestamp_field] = timestamp
     
     def acknowledge_alarm(self, alarm_id):
         """Acknowledge an alarm (operator action)"""
-        storage.update_alarm_state(alarm_id, 'ACK')
+        self._transition(alarm_id, 'ACK', 'acknowledged_at')
         print(f"[Alarm Engine] Alarm {alarm_id} acknowledged")
     
     def resolve_alarm(self, alarm_id):
         """Resolve an alarm (recovery detected or operator action)"""
-        storage.update_alarm_state(alarm_id, 'RESOLVED')
+        self._transition(alarm_id, 'RESOLVED', 'resolved_at')
         print(f"[Alarm Engine] Alarm {alarm_id} resolved")
     
     def close_alarm(self, alarm_id):
         """Close an alarm (operator action)"""
-        storage.update_alarm_state(alarm_id, 'CLOSED')
+        self._transition(alarm_id, 'CLOSED', 'closed_at')
         print(f"[Alarm Engine] Alarm {alarm_id} closed")
     
-    def auto_resolve_alarms(self, current_metrics):
-        """Auto-resolve alarms when conditions return to normal"""
-        # Get all OPEN and ACK alarms
-        open_alarms = storage.get_alarms(state='OPEN', limit=1000)
-        ack_alarms = storage.get_alarms(state='ACK', limit=1000)
-        
-        all_active = open_alarms + ack_alarms
+    def get_active_alarms(self, states=('OPEN', 'ACK', 'RESOLVED')):
+        """Snapshot of in-memory alarms in the given states"""
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(alarm) for alarm in self.active.values() if alarm['state'] in states]
+    
+    def auto_resolve_alarms(self, latest):
+        """Auto-resolve alarms when conditions return to normal
         
-        # Build current metric state
-        metric_state = {}
-        for metric in current_metrics:
-            key = f"{metric['device_id']}_{metric['parameter']}"
-            metric_state[key] = metric
+        Every OPEN/ACK alarm is checked against the latest cached value of its
+        (device, parameter) series, so the cost is O(active alarms). Series with
+        windowed/hysteresis/rate rules clear when the normalizer's streaming
+        state does, so both sides use the same clear levels.
+        """
+        # Get all OPEN and ACK alarms from the in-memory index
+        all_active = self.get_active_alarms(states=('OPEN', 'ACK'))
         
         # Check each alarm against current state
-        thresholds = Config.get_thresholds()
+        thresholds = self.thresholds
         
         for alarm in all_active:
-            alarm_key = f"{alarm['device_id']}_{alarm['category']}"
+            param = alarm['category']
             
             # Check if we have current metric for this alarm
-            if alarm_key in metric_state:
-                metric = metric_state[alarm_key]
-                param = alarm['category']
+            metric = latest.get(alarm['device_id'], param)
+            if metric is None:
+                continue
+            
+            # Anomalies clear when the series is back inside its learned bounds
+            if alarm['type'] == 'anomaly':
+                if self._is_clear(alarm['device_id'], param, 'anomaly'):
+                    self.resolve_alarm(alarm['alarm_id'])
+                    print(f"[Alarm Engine] Auto-resolved {alarm['alarm_id']} - back within baseline")
+                continue
+            
+            # Check if condition has cleared
+            if param in thresholds:
+                threshold_config = thresholds[param]
                 
-                # Check if condition has cleared
-                if param in thresholds:
-                    threshold_config = thresholds[param]
+                # Stateful rules: the normalizer's streaming state decides
+                if is_streaming(threshold_config):
+                    cleared = self._is_clear(alarm['device_id'], param, alarm['type'])
+                    if cleared:
+                        self.resolve_alarm(alarm['alarm_id'])
+                        print(f"[Alarm Engine] Auto-resolved {alarm['alarm_id']} - condition cleared")
+                    if cleared is not None or alarm['type'] != 'threshold_exceeded':
+                        continue
+                
+                try:
+                    value = float(metric['value'])
                     
-                    try:
-                        value = float(metric['value'])
-                        
-                        # If value is now below warning threshold, resolve
-                        if 'warning' in threshold_config:
-                            if value < threshold_config['warning']:
-                                self.resolve_alarm(alarm['alarm_id'])
-                                print(f"[Alarm Engine] Auto-resolved {alarm['alarm_id']} - value returned to normal")
-                    except (ValueError, TypeError):
-                        pass
+                    # If value is now below the clear level (warning unless set), resolve
+                    level = clear_level(threshold_config)
+                    if level is not None and value < level:
+                        self.resolve_alarm(alarm['alarm_id'])
+                        print(f"[Alarm Engine] Auto-resolved {alarm['alarm_id']} - value returned to normal")
+                except (ValueError, TypeError):
+                    pass
+    
+    def _is_clear(self, device_id, parameter, event_type):
+        """Whether a stateful condition has cleared (None if nothing tracks the series)"""
+        if self.clear_state is not None:
+            return self.clear_state.is_clear(device_id, parameter, event_type)
+        if event_type == 'anomaly':
+            return anomaly_detector.is_clear(device_id, parameter)
+        return series_conditions.is_clear(device_id, parameter, event_type)
     
     def auto_close_resolved_alarms(self):
         """Auto-close alarms that have been RESOLVED for too long"""
-        resolved_alarms = storage.get_alarms(state='RESOLVED', limit=1000)
+        resolved_alarms = self.get_active_alarms(states=('RESOLVED',))
         
         current_time = datetime.utcnow()
         
@@ -97,32 +280,14 @@ class AlarmEngine:
                     pass
     
     def get_alarm_statistics(self):
-        """Get alarm statistics"""
-        stats = {
-            'open': len(storage.get_alarms(state='OPEN', limit=10000)),
-            'acknowledged': len(storage.get_alarms(state='ACK', limit=10000)),
-            'resolved': len(storage.get_alarms(state='RESOLVED', limit=10000)),
-            'closed': len(storage.get_alarms(state='CLOSED', limit=10000)),
-        }
-        
-        # Get severity breakdown for active alarms
-        all_alarms = storage.get_alarms(limit=10000)
-        active_alarms = [a for a in all_alarms if a['state'] != 'CLOSED']
-        
-        stats['by_severity'] = {
-            'CRITICAL': len([a for a in active_alarms if a['severity'] == 'CRITICAL']),
-            'WARNING': len([a for a in active_alarms if a['severity'] == 'WARNING']),
-        }
-        
-        stats['total_active'] = len(active_alarms)
-        
-        return stats
+        """Get alarm statistics (read from counters maintained on every transition)"""
+        return storage.get_alarm_statistics()
     
-    def run_maintenance(self, current_metrics=None):
+    def run_maintenance(self, latest=None):
         """Run periodic maintenance tasks"""
-        # Auto-resolve alarms based on current metrics
-        if current_metrics:
-            self.auto_resolve_alarms(current_metrics)
+        # Auto-resolve alarms based on the latest-value cache
+        if latest is not None:
+            self.auto_resolve_alarms(latest)
         
         # Auto-close long-resolved alarms
         self.auto_close_resolved_alarms()
@@ -0,0 +1,74 @@
+"""
+Alarm Statistics Counters
+Per-(state, severity) alarm counts kept current by triggers on the alarms
+table, so alarm statistics are read from a handful of rows no matter how
+large the alarms table grows.
+"""
+
+def create_tables(cursor):
+    """Create the alarm_stats table and the triggers that maintain it"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alarm_stats (
+            state TEXT NOT NULL,
+            severity TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (state, severity)
+        ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_alarm_stats_insert
+        AFTER INSERT ON alarms
+        BEGIN
+            INSERT INTO alarm_stats (state, severity, count) VALUES (NEW.state, NEW.severity, 1)
+            ON CONFLICT (state, severity) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_alarm_stats_update
+        AFTER UPDATE OF state, severity ON alarms
+        WHEN OLD.state != NEW.state OR OLD.severity != NEW.severity
+        BEGIN
+            UPDATE alarm_stats SET count = count - 1
+            WHERE state = OLD.state AND severity = OLD.severity;
+            INSERT INTO alarm_stats (state, severity, count) VALUES (NEW.state, NEW.severity, 1)
+            ON CONFLICT (state, severity) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_alarm_stats_delete
+        AFTER DELETE ON alarms
+        BEGIN
+            UPDATE alarm_stats SET count = count - 1
+            WHERE state = OLD.state AND severity = OLD.severity;
+        END
+    ''')
+
+def rebuild(conn):
+    """Recompute the counters from the alarms table"""
+    conn.execute('DELETE FROM alarm_stats')
+    conn.execute('''
+        INSERT INTO alarm_stats (state, severity, count)
+        SELECT state, severity, COUNT(*) FROM alarms GROUP BY state, severity
+    ''')
+
+def summarize(rows):
+    """Build the alarm statistics dict from (state, severity, count) rows"""
+    by_state = {}
+    by_severity = {'CRITICAL': 0, 'WARNING': 0}
+    
+    for state, severity, count in rows:
+        by_state[state] = by_state.get(state, 0) + count
+        if state != 'CLOSED':
+            by_severity[severity] = by_severity.get(severity, 0) + count
+    
+    return {
+        'open': by_state.get('OPEN', 0),
+        'acknowledged': by_state.get('ACK', 0),
+        'resolved': by_state.get('RESOLVED', 0),
+        'closed': by_state.get('CLOSED', 0),
+        'by_severity': by_severity,
+        'total_active': sum(count for state, count in by_state.items() if state != 'CLOSED'),
+    }
@@ -0,0 +1,117 @@
+"""
+Storage Backend Interface
+Every storage engine implements this interface so the alarm engine, the
+dashboard and the orchestrator can run against any of them. The engine used
+by the global `storage` instance is chosen with Config.STORAGE_BACKEND:
+
+- 'sqlite'       Storage (storage/storage.py), the default
+- 'memory'       MemoryStorage (storage/memory_backend.py), no disk I/O
+- 'segment_log'  SegmentLogStorage (storage/segment_log.py), mmap append log
+"""
+from abc import ABC, abstractmethod
+
+class StorageBackend(ABC):
+    # Metrics
+    
+    @abstractmethod
+    def store_metrics(self, metrics):
+        """Persist a batch of normalized metrics"""
+    
+    @abstractmethod
+    def get_metrics(self, device_id=None, parameter=None, limit=100, start=None, end=None, cursor=None):
+        """Get metrics newest first within [start, end) epoch ms
+        
+        device_id and parameter accept a single value or a list; cursor is a
+        (ts, id) keyset position and only strictly older rows are returned.
+        """
+    
+    @abstractmethod
+    def iter_metrics(self, device_id=None, parameter=None, start=None, end=None):
+        """Yield metrics oldest first within [start, end) epoch ms"""
+    
+    @abstractmethod
+    def get_metric_series(self, start, end, step, device_id=None, parameter=None, location=None):
+        """Get (resolution, aggregated points) between start and end at the given step"""
+    
+    def flush(self, timeout=None):
+        """Wait until everything stored so far is durable"""
+        return True
+    
+    def close(self):
+        """Flush and release resources (shutdown hook)"""
+    
+    # Maintenance
+    
+    def enforce_retention(self, now=None):
+        """Drop data older than Config.RETENTION_DAYS"""
+        return []
+    
+    def compact(self, now=None):
+        """Move cold data into a compact format; returns units compacted"""
+        return 0
+    
+    def get_writer_stats(self):
+        """Get ingest counters"""
+        return {}
+    
+    def write_failures(self):
+        """Count of stored batches that failed to commit after store_metrics returned"""
+        return 0
+    
+    def get_compaction_stats(self):
+        """Get cold-tier statistics"""
+        return {}
+    
+    # Alarms
+    
+    def store_alarm(self, alarm):
+        """Store or update an alarm (single upsert against the active alarm_id)"""
+        self.upsert_alarms([(alarm, 1)])
+    
+    @abstractmethod
+    def upsert_alarms(self, alarms):
+        """Create or update non-closed alarms from (alarm, occurrences) pairs"""
+    
+    @abstractmethod
+    def get_active_alarms(self):
+        """Get every non-closed alarm"""
+    
+    @abstractmethod
+    def update_alarm_state(self, alarm_id, new_state, timestamp=None):
+        """Update the state of the non-closed alarm with this alarm_id"""
+    
+    @abstractmethod
+    def get_alarms(self, state=None, severity=None, limit=100):
+        """Get alarms, newest first_seen first"""
+    
+    # Summaries
+    
+    @abstractmethod
+    def get_alarm_statistics(self):
+        """Get alarm counts per state and active counts per severity"""
+    
+    @abstractmethod
+    def get_device_summary(self):
+        """Get last_seen, metric count and active alarm counts per device"""
+    
+    # Saved state (checkpoints of in-memory components, e.g. the anomaly detector)
+    
+    @abstractmethod
+    def save_state(self, name, data):
+        """Durably replace the bytes saved under name"""
+    
+    @abstractmethod
+    def load_state(self, name):
+        """Get the bytes last saved under name, or None"""
+
+def alarm_id_for(alarm):
+    """Build the deduplication key of an alarm/event"""
+    return f"{alarm['device_id']}_{alarm['category']}_{alarm['type']}"
+
+def state_timestamp_field(state):
+    """Get the alarm column stamped when an alarm enters state (or None)"""
+    return {
+        'ACK': 'acknowledged_at',
+        'RESOLVED': 'resolved_at',
+        'CLOSED': 'closed_at',
+    }.get(state)
@@ -0,0 +1,436 @@
+"""
+Cold Chunk Storage
+Older raw samples are packed per series into fixed-size compressed chunks
+stored as BLOBs in the chunks table:
+
+- timestamps as delta-of-delta values in variable-width bit buckets
+- numeric values XOR-compressed against the previous value (Gorilla style)
+- value kinds and status strings run-length encoded
+- sample ids as varint deltas, so keyset cursors keep working on cold data
+
+The compactor in Storage moves whole day partitions into chunks once they
+are older than Config.COLD_AFTER_DAYS; reads decode chunks transparently.
+"""
+import heapq
+import struct
+from storage.partitions import DAY_MS
+
+FORMAT_VERSION = 1
+
+# Value kinds, run-length encoded per chunk
+_NUMERIC = 0
+_NULL = 1
+_TEXT = 2
+
+# Delta-of-delta buckets: (prefix, prefix bits, payload bits); the last one always fits
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 12),
+    (0b1110, 4, 20),
+    (0b1111, 4, 64),
+)
+
+def create_table(cursor):
+    """Create the chunks table and its indexes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chunks (
+            chunk_id INTEGER PRIMARY KEY,
+            series_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chunks_series_time
+        ON chunks(series_id, start_ts)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chunks_day
+        ON chunks(day)
+    ''')
+
+class _BitWriter:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.acc = 0
+        self.bits = 0
+    
+    def write(self, value, nbits):
+        self.acc = (self.acc << nbits) | (value & ((1 << nbits) - 1))
+        self.bits += nbits
+        while self.bits >= 8:
+            self.bits -= 8
+            self.buffer.append((self.acc >> self.bits) & 0xFF)
+        self.acc &= (1 << self.bits) - 1
+    
+    def getvalue(self):
+        if self.bits:
+            return bytes(self.buffer) + bytes([(self.acc << (8 - self.bits)) & 0xFF])
+        return bytes(self.buffer)
+
+class _BitReader:
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'big')
+        self.size = len(data) * 8
+        self.pos = 0
+    
+    def read(self, nbits):
+        self.pos += nbits
+        return (self.value >> (self.size - self.pos)) & ((1 << nbits) - 1)
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+def _write_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def _float_bits(value):
+    return struct.unpack('>Q', struct.pack('>d', value))[0]
+
+def _bits_float(bits):
+    return struct.unpack('>d', struct.pack('>Q', bits))[0]
+
+def _encode_timestamps(timestamps):
+    writer = _BitWriter()
+    writer.write(timestamps[0], 64)
+    previous, delta = timestamps[0], 0
+    
+    for ts in timestamps[1:]:
+        dod = _zigzag((ts - previous) - delta)
+        delta = ts - previous
+        previous = ts
+        
+        if dod == 0:
+            writer.write(0, 1)
+            continue
+        
+        for prefix, prefix_bits, payload_bits in _DOD_BUCKETS:
+            if dod < (1 << payload_bits):
+                writer.write(prefix, prefix_bits)
+                writer.write(dod, payload_bits)
+                break
+    
+    return writer.getvalue()
+
+def _decode_timestamps(data, count):
+    reader = _BitReader(data)
+    ts = reader.read(64)
+    timestamps = [ts]
+    delta = 0
+    
+    for _ in range(count - 1):
+        dod = 0
+        if reader.read(1):
+            ones = 1
+            while ones < 4 and reader.read(1):
+                ones += 1
+            dod = _unzigzag(reader.read(_DOD_BUCKETS[ones - 1][2]))
+        delta += dod
+        ts += delta
+        timestamps.append(ts)
+    
+    return timestamps
+
+def _encode_values(values):
+    writer = _BitWriter()
+    if not values:
+        return writer.getvalue()
+    
+    previous = _float_bits(values[0])
+    writer.write(previous, 64)
+    leading, trailing = -1, 0
+    
+    for value in values[1:]:
+        bits = _float_bits(value)
+        xor = bits ^ previous
+        previous = bits
+        
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        
+        writer.write(1, 1)
+        new_leading = min(64 - xor.bit_length(), 31)
+        new_trailing = (xor & -xor).bit_length() - 1
+        
+        if leading >= 0 and new_leading >= leading and new_trailing >= trailing:
+            # Meaningful bits fit inside the previous window
+            writer.write(0, 1)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = new_leading, new_trailing
+            meaningful = 64 - leading - trailing
+            writer.write(1, 1)
+            writer.write(leading, 5)
+            writer.write(meaningful & 0x3F, 6)
+            writer.write(xor >> trailing, meaningful)
+    
+    return writer.getvalue()
+
+def _decode_values(data, count):
+    if not count:
+        return []
+    
+    reader = _BitReader(data)
+    previous = reader.read(64)
+    values = [_bits_float(previous)]
+    leading, trailing = 0, 0
+    
+    for _ in range(count - 1):
+        if reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        values.append(_bits_float(previous))
+    
+    return values
+
+def _encode_kinds(points):
+    """Run-length encode (kind, text) per point"""
+    out = bytearray()
+    runs = []
+    for _, _, value, value_text in points:
+        if value_text is not None:
+            kind = (_TEXT, value_text)
+        elif value is None:
+            kind = (_NULL, None)
+        else:
+            kind = (_NUMERIC, None)
+        
+        if runs and runs[-1][0] == kind:
+            runs[-1][1] += 1
+        else:
+            runs.append([kind, 1])
+    
+    _write_varint(out, len(runs))
+    for (kind, text), length in runs:
+        _write_varint(out, length)
+        out.append(kind)
+        if kind == _TEXT:
+            encoded = text.encode('utf-8')
+            _write_varint(out, len(encoded))
+            out.extend(encoded)
+    
+    return bytes(out)
+
+def _decode_kinds(data):
+    kinds = []
+    run_count, pos = _read_varint(data, 0)
+    for _ in range(run_count):
+        length, pos = _read_varint(data, pos)
+        kind = data[pos]
+        pos += 1
+        text = None
+        if kind == _TEXT:
+            size, pos = _read_varint(data, pos)
+            text = data[pos:pos + size].decode('utf-8')
+            pos += size
+        kinds.extend([(kind, text)] * length)
+    return kinds
+
+def encode_chunk(points):
+    """Encode (id, ts, value, value_text) points, ordered by (ts, id), into a BLOB"""
+    ids = bytearray()
+    previous_id = 0
+    for point_id, _, _, _ in points:
+        _write_varint(ids, _zigzag(point_id - previous_id))
+        previous_id = point_id
+    
+    sections = [
+        bytes(ids),
+        _encode_kinds(points),
+        _encode_timestamps([point[1] for point in points]),
+    ]
+    values = _encode_values([point[2] for point in points if point[3] is None and point[2] is not None])
+    
+    out = bytearray([FORMAT_VERSION])
+    _write_varint(out, len(points))
+    for section in sections:
+        _write_varint(out, len(section))
+        out.extend(section)
+    out.extend(values)
+    return bytes(out)
+
+def decode_chunk(data):
+    """Decode a BLOB back into a list of (id, ts, value, value_text) points"""
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported chunk format {data[0]}')
+    
+    count, pos = _read_varint(data, 1)
+    sections = []
+    for _ in range(3):
+        size, pos = _read_varint(data, pos)
+        sections.append(data[pos:pos + size])
+        pos += size
+    
+    ids = []
+    id_pos, point_id = 0, 0
+    for _ in range(count):
+        delta, id_pos = _read_varint(sections[0], id_pos)
+        point_id += _unzigzag(delta)
+        ids.append(point_id)
+    
+    kinds = _decode_kinds(sections[1])
+    timestamps = _decode_timestamps(sections[2], count)
+    values = iter(_decode_values(data[pos:], sum(1 for kind, _ in kinds if kind == _NUMERIC)))
+    
+    points = []
+    for point_id, ts, (kind, text) in zip(ids, timestamps, kinds):
+        value = next(values) if kind == _NUMERIC else None
+        points.append((point_id, ts, value, text))
+    return points
+
+def write_chunks(conn, series_id, points, chunk_size):
+    """Store one series' points (ordered by ts, id) as chunks; returns bytes written"""
+    written = 0
+    for offset in range(0, len(points), chunk_size):
+        block = points[offset:offset + chunk_size]
+        data = encode_chunk(block)
+        conn.execute('''
+            INSERT INTO chunks (series_id, day, start_ts, end_ts, max_id, count, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            series_id,
+            block[0][1] - block[0][1] % DAY_MS,
+            block[0][1],
+            block[-1][1],
+            max(point[0] for point in block),
+            len(block),
+            data
+        ))
+        written += len(data)
+    return written
+
+def list_days(conn, start=None, end=None):
+    """Get the day starts (epoch ms) holding chunks that overlap [start, end)"""
+    query = 'SELECT DISTINCT day FROM chunks WHERE 1=1'
+    params = []
+    
+    if start is not None:
+        query += ' AND day > ?'
+        params.append(start - DAY_MS)
+    
+    if end is not None:
+        query += ' AND day < ?'
+        params.append(end)
+    
+    return [row[0] for row in conn.execute(query, params).fetchall()]
+
+def scan(conn, series_ids=None, start=None, end=None, cursor=None, day=None, newest_first=True):
+    """Decode chunk samples as row dicts (id, series_id, ts, value, value_text)
+    
+    Filters mirror the raw partition scans: [start, end) epoch ms, a (ts, id)
+    keyset cursor, and optionally a single day. Rows are ordered by (ts, id).
+    """
+    query = 'SELECT series_id, data FROM chunks WHERE 1=1'
+    params = []
+    
+    if series_ids is not None:
+        query += f" AND series_id IN ({','.join('?' * len(series_ids))})"
+        params.extend(series_ids)
+    
+    if day is not None:
+        query += ' AND day = ?'
+        params.append(day)
+    
+    if start is not None:
+        query += ' AND end_ts >= ?'
+        params.append(start)
+    
+    if end is not None:
+        query += ' AND start_ts < ?'
+        params.append(end)
+    
+    if cursor is not None:
+        query += ' AND start_ts <= ?'
+        params.append(cursor[0])
+    
+    rows = []
+    for series_id, data in conn.execute(query, params).fetchall():
+        for point_id, ts, value, value_text in decode_chunk(data):
+            if start is not None and ts < start:
+                continue
+            if end is not None and ts >= end:
+                continue
+            if cursor is not None and (ts, point_id) >= cursor:
+                continue
+            rows.append({'id': point_id, 'series_id': series_id, 'ts': ts, 'value': value, 'value_text': value_text})
+    
+    rows.sort(key=lambda row: (row['ts'], row['id']), reverse=newest_first)
+    return rows
+
+def stream(conn, series_id, day, start=None, end=None):
+    """Yield one series' chunk samples of one day as row dicts, oldest first
+    
+    Chunks are decoded one at a time, so memory holds about one chunk even
+    when late data left chunks with overlapping time ranges.
+    """
+    query = 'SELECT start_ts, data FROM chunks WHERE series_id = ? AND day = ?'
+    params = [series_id, day]
+    
+    if start is not None:
+        query += ' AND end_ts >= ?'
+        params.append(start)
+    
+    if end is not None:
+        query += ' AND start_ts < ?'
+        params.append(end)
+    
+    pending = []
+    for chunk_start, data in conn.execute(query + ' ORDER BY start_ts', params):
+        # Everything before this chunk's first sample is final
+        while pending and pending[0][0] < chunk_start:
+            yield _point_row(series_id, heapq.heappop(pending))
+        for point_id, ts, value, value_text in decode_chunk(data):
+            if (start is None or ts >= start) and (end is None or ts < end):
+                heapq.heappush(pending, (ts, point_id, value, value_text))
+    
+    while pending:
+        yield _point_row(series_id, heapq.heappop(pending))
+
+def _point_row(series_id, point):
+    ts, point_id, value, value_text = point
+    return {'id': point_id, 'series_id': series_id, 'ts': ts, 'value': value, 'value_text': value_text}
+
+def drop_before(conn, cutoff_ts):
+    """Delete chunks of days that end at or before cutoff_ts; returns rows deleted"""
+    return conn.execute('DELETE FROM chunks WHERE day <= ?', (cutoff_ts - DAY_MS,)).rowcount
+
+def max_sample_id(conn):
+    """Get the highest sample id stored in chunks (0 when empty)"""
+    row = conn.execute('SELECT MAX(max_id) FROM chunks').fetchone()
+    return row[0] or 0
+
+def summarize(conn):
+    """Get chunk counts and sizes for compaction stats"""
+    chunk_count, samples, size = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(count), 0), COALESCE(SUM(LENGTH(data)), 0) FROM chunks'
+    ).fetchone()
+    return {
+        'chunks': chunk_count,
+        'samples': samples,
+        'bytes': size,
+        'bytes_per_sample': round(size / samples, 2) if samples else 0,
+    }
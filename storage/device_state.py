@@ -0,0 +1,110 @@
+"""
+Materialized Device State
+One row per device holding last_seen, the cumulative metric count and the
+number of active alarms per state. The metric writer updates it on ingest
+and triggers on the alarms table keep the alarm counts in step with every
+alarm transition, so the device summary is a single read.
+"""
+
+# Active alarm states and the device_state column counting each
+ALARM_STATE_COLUMNS = {
+    'OPEN': 'open_alarms',
+    'ACK': 'ack_alarms',
+    'RESOLVED': 'resolved_alarms',
+}
+
+def create_tables(cursor):
+    """Create the device_state table and the alarm triggers that maintain it"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS device_state (
+            device_id TEXT PRIMARY KEY,
+            device_type TEXT,
+            protocol TEXT,
+            location TEXT,
+            last_seen INTEGER,
+            metric_count INTEGER NOT NULL DEFAULT 0,
+            open_alarms INTEGER NOT NULL DEFAULT 0,
+            ack_alarms INTEGER NOT NULL DEFAULT 0,
+            resolved_alarms INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    increments = ', '.join(
+        f"{column} = {column} + (NEW.state = '{state}')"
+        for state, column in ALARM_STATE_COLUMNS.items()
+    )
+    transitions = ', '.join(
+        f"{column} = {column} + (NEW.state = '{state}') - (OLD.state = '{state}')"
+        for state, column in ALARM_STATE_COLUMNS.items()
+    )
+    decrements = ', '.join(
+        f"{column} = {column} - (OLD.state = '{state}')"
+        for state, column in ALARM_STATE_COLUMNS.items()
+    )
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_device_state_alarm_insert
+        AFTER INSERT ON alarms
+        BEGIN
+            INSERT OR IGNORE INTO device_state (device_id, device_type, protocol, location)
+            VALUES (NEW.device_id, NEW.device_type, NEW.protocol, NEW.location);
+            UPDATE device_state SET {increments} WHERE device_id = NEW.device_id;
+        END
+    ''')
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_device_state_alarm_update
+        AFTER UPDATE OF state ON alarms
+        WHEN OLD.state != NEW.state
+        BEGIN
+            UPDATE device_state SET {transitions} WHERE device_id = NEW.device_id;
+        END
+    ''')
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_device_state_alarm_delete
+        AFTER DELETE ON alarms
+        BEGIN
+            UPDATE device_state SET {decrements} WHERE device_id = OLD.device_id;
+        END
+    ''')
+
+def apply(conn, devices):
+    """Merge per-device ingest aggregates into device_state
+    
+    devices maps device_id -> (device_type, protocol, location, last_seen, count)
+    """
+    if not devices:
+        return
+    
+    conn.executemany('''
+        INSERT INTO device_state (device_id, device_type, protocol, location, last_seen, metric_count)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (device_id) DO UPDATE SET
+            device_type = excluded.device_type,
+            protocol = excluded.protocol,
+            location = excluded.location,
+            last_seen = MAX(COALESCE(last_seen, 0), excluded.last_seen),
+            metric_count = metric_count + excluded.metric_count
+    ''', [(device_id, *aggregate) for device_id, aggregate in devices.items()])
+
+def rebuild(conn, summaries):
+    """Rebuild device_state from scratch
+    
+    summaries maps device_id -> (device_type, protocol, location, last_seen, count)
+    taken from stored samples; alarm counts are recomputed from the alarms table.
+    """
+    conn.execute('DELETE FROM device_state')
+    apply(conn, summaries)
+    
+    conn.execute('''
+        INSERT OR IGNORE INTO device_state (device_id, device_type, protocol, location)
+        SELECT device_id, device_type, protocol, location FROM alarms WHERE state != 'CLOSED'
+    ''')
+    for state, column in ALARM_STATE_COLUMNS.items():
+        conn.execute(f'''
+            UPDATE device_state SET {column} = (
+                SELECT COUNT(*) FROM alarms
+                WHERE alarms.device_id = device_state.device_id AND alarms.state = ?
+            )
+        ''', (state,))
@@ -0,0 +1,122 @@
+"""
+Event Coalescer
+Merges threshold events for the same (device, category, type) inside the
+ALARM_DEDUP_WINDOW so a burst of breaches becomes one alarm update per window.
+Sits between normalize_and_enrich and AlarmEngine.process_event.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import time
+from storage.alarm_engine import alarm_engine
+from config.config import Config
+
+SEVERITY_RANK = {'INFO': 0, 'WARNING': 1, 'MAJOR': 2, 'CRITICAL': 3}
+
+class EventCoalescer:
+    def __init__(self, emit, window=None):
+        self.emit = emit  # called as emit(event, occurrences)
+        self.window = window or Config.ALARM_DEDUP_WINDOW
+        
+        # (device_id, category, type) -> {'opened', 'event', 'count'}
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._ticker = None
+        
+        self.stats = {
+            'received': 0,
+            'emitted': 0,
+            'suppressed': 0,
+        }
+    
+    def submit(self, event):
+        """Submit an event; the first in a window is emitted at once, the rest are merged"""
+        key = (event['device_id'], event.get('category'), event['type'])
+        now = time.monotonic()
+        ready = []
+        
+        with self._lock:
+            self._start_ticker()
+            self.stats['received'] += 1
+            
+            window = self._windows.get(key)
+            if window and now - window['opened'] >= self.window:
+                ready.extend(self._close_window(key, window, now))
+                window = self._windows.get(key)
+            
+            if window is None:
+                # Leading edge: nothing emitted for this key recently
+                self._windows[key] = {'opened': now, 'event': None, 'count': 0}
+                self.stats['emitted'] += 1
+                ready.append((event, 1))
+            else:
+                self._merge(window, event)
+        
+        for merged, occurrences in ready:
+            self.emit(merged, occurrences)
+    
+    def _merge(self, window, event):
+        """Fold an event into a window: keep the highest severity and the latest message"""
+        pending = window['event']
+        merged = dict(event)
+        if pending and SEVERITY_RANK.get(pending['severity'], 0) > SEVERITY_RANK.get(event['severity'], 0):
+            merged['severity'] = pending['severity']
+        
+        window['event'] = merged
+        window['count'] += 1
+    
+    def _close_window(self, key, window, now):
+        """Close an expired window, returning its merged event (if any) for emission"""
+        if not window['event']:
+            del self._windows[key]
+            return []
+        
+        # The trailing update also opens the next window, so a steady stream
+        # of breaches produces one update per window
+        self._windows[key] = {'opened': now, 'event': None, 'count': 0}
+        self.stats['emitted'] += 1
+        self.stats['suppressed'] += window['count'] - 1
+        return [(window['event'], window['count'])]
+    
+    def flush_expired(self, force=False):
+        """Emit merged events of every expired window (all windows when force=True)"""
+        now = time.monotonic()
+        ready = []
+        
+        with self._lock:
+            for key, window in list(self._windows.items()):
+                if force or now - window['opened'] >= self.window:
+                    ready.extend(self._close_window(key, window, now))
+        
+        for merged, occurrences in ready:
+            self.emit(merged, occurrences)
+        
+        return len(ready)
+    
+    def _start_ticker(self):
+        """Start the loop that closes expired windows (idempotent)"""
+        if self._ticker and self._ticker.is_alive():
+            return
+        
+        def tick():
+            while True:
+                time.sleep(1)
+                try:
+                    self.flush_expired()
+                except Exception as e:
+                    print(f"[Event Coalescer] Error flushing windows: {e}")
+        
+        self._ticker = threading.Thread(target=tick, name='event-coalescer', daemon=True)
+        self._ticker.start()
+    
+    def get_stats(self):
+        """Get received/emitted/suppressed event counters"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['open_windows'] = len(self._windows)
+        return stats
+
+# Global event coalescer instance
+event_coalescer = EventCoalescer(alarm_engine.process_event)
@@ -0,0 +1,260 @@
+"""
+Ingest Journal
+Write-ahead journal between the collectors and storage. Collector callbacks
+append each normalized batch to rotating, length-prefixed segment files
+(storage/segments.py) and return at once; a background syncer msyncs the
+journal every JOURNAL_FSYNC_INTERVAL (group commit) and an applier thread
+feeds journaled batches into storage. The applier records the last batch
+storage has committed in an `applied` file, so anything journaled but not
+yet applied is replayed after a crash or restart (delivery is at least once).
+A batch storage keeps rejecting is moved to quarantine.jsonl after
+JOURNAL_APPLY_ATTEMPTS tries so it cannot hold up the batches behind it.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import struct
+import threading
+import time
+from collections import deque
+from config.config import Config
+from storage.segments import SegmentLog
+from storage.storage import storage
+from pipeline.telemetry import telemetry
+
+_SEQ = struct.Struct('<Q')
+
+class IngestJournal:
+    def __init__(self, store, directory=None, segment_bytes=None, fsync_interval=None):
+        self.storage = store
+        self.directory = directory or Config.JOURNAL_DIR
+        self.fsync_interval = Config.JOURNAL_FSYNC_INTERVAL if fsync_interval is None else fsync_interval
+        self.log = SegmentLog(self.directory, segment_bytes or Config.JOURNAL_SEGMENT_BYTES)
+        self._applied_path = os.path.join(self.directory, 'applied')
+        self._quarantine_path = os.path.join(self.directory, 'quarantine.jsonl')
+        
+        self._cond = threading.Condition()
+        self._pending = deque()  # (seq, appended_at, metrics) not yet applied
+        self._pending_metrics = 0
+        self._segment_last_seq = {}  # segment seq -> last record seq in it
+        self._seq = 0
+        self._applied = 0
+        self._attempts = 0  # failed applies of the batch at the head of _pending
+        self._isolate_until = 0  # apply one batch at a time up to this seq after a failure
+        self._dirty = False
+        self._running = False
+        self._threads = []
+        
+        self.stats = {
+            'batches_appended': 0,
+            'metrics_appended': 0,
+            'batches_applied': 0,
+            'metrics_applied': 0,
+            'batches_replayed': 0,
+            'apply_errors': 0,
+            'batches_quarantined': 0,
+        }
+    
+    def start(self):
+        """Replay unapplied batches and start the syncer and applier threads (idempotent)"""
+        with self._cond:
+            if self._running:
+                return
+            
+            self._applied = self._load_applied()
+            self._seq = self._applied
+            
+            for segment, payload in self.log.replay():
+                seq = _SEQ.unpack_from(payload)[0]
+                self._segment_last_seq[segment] = seq
+                self._seq = max(self._seq, seq)
+                if seq > self._applied:
+                    metrics = json.loads(payload[_SEQ.size:])
+                    self._pending.append((seq, time.time(), metrics))
+                    self._pending_metrics += len(metrics)
+                    self.stats['batches_replayed'] += 1
+            
+            self.log.open()
+            self._drop_applied_segments()
+            self._running = True
+        
+        for target, name in ((self._sync_loop, 'journal-sync'), (self._apply_loop, 'journal-apply')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        telemetry.gauge('nms_journal_lag_batches', lambda: len(self._pending), 'Journaled batches not yet applied to storage')
+        
+        print(f"[Journal] Started at {self.directory} "
+              f"(replaying {self.stats['batches_replayed']} unapplied batches)")
+    
+    def append(self, metrics):
+        """Journal a batch of normalized metrics for the applier; never waits on storage"""
+        if not metrics:
+            return
+        
+        body = json.dumps(metrics, separators=(',', ':'), default=str).encode('utf-8')
+        
+        with self._cond:
+            self._seq += 1
+            segment = self.log.append(_SEQ.pack(self._seq) + body)
+            self._segment_last_seq[segment] = self._seq
+            self._pending.append((self._seq, time.time(), metrics))
+            self._pending_metrics += len(metrics)
+            self.stats['batches_appended'] += 1
+            self.stats['metrics_appended'] += len(metrics)
+            
+            if self.fsync_interval:
+                self._dirty = True
+            else:
+                self.log.flush()
+            
+            self._cond.notify_all()
+    
+    def _sync_loop(self):
+        """Group commit: msync whatever was appended since the last pass"""
+        while self._running:
+            time.sleep(self.fsync_interval or 1)
+            with self._cond:
+                if self._dirty:
+                    self.log.flush()
+                    self._dirty = False
+    
+    def _apply_loop(self):
+        """Feed journaled batches into storage, oldest first"""
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                count = 1 if self._pending[0][0] <= self._isolate_until else Config.JOURNAL_APPLY_BATCH
+                batch = [self._pending[i] for i in range(min(len(self._pending), count))]
+            
+            metrics = [metric for _, _, batch_metrics in batch for metric in batch_metrics]
+            quarantined = False
+            try:
+                self._store(metrics)
+            except Exception as e:
+                self.stats['apply_errors'] += 1
+                # Retry the group one batch at a time to find the one storage rejects
+                self._isolate_until = max(self._isolate_until, batch[-1][0])
+                if len(batch) > 1:
+                    print(f"[Journal] Error applying {len(batch)} batches, retrying one at a time: {e}")
+                    continue
+                
+                self._attempts += 1
+                if self._attempts < Config.JOURNAL_APPLY_ATTEMPTS:
+                    print(f"[Journal] Error applying batch {batch[0][0]} (attempt {self._attempts}): {e}")
+                    time.sleep(1)
+                    continue
+                self._quarantine(batch[0], e)
+                quarantined = True
+            
+            self._attempts = 0
+            with self._cond:
+                for _ in batch:
+                    self._pending.popleft()
+                self._pending_metrics -= len(metrics)
+                self._applied = batch[-1][0]
+                if quarantined:
+                    self.stats['batches_quarantined'] += 1
+                else:
+                    self.stats['batches_applied'] += len(batch)
+                    self.stats['metrics_applied'] += len(metrics)
+                self._save_applied()
+                self._drop_applied_segments()
+                self._cond.notify_all()
+    
+    def _store(self, metrics):
+        """Hand metrics to storage and wait until they are committed; raises if they were not"""
+        failures = self.storage.write_failures()
+        self.storage.store_metrics(metrics)
+        if not self.storage.flush(Config.JOURNAL_APPLY_TIMEOUT):
+            raise TimeoutError(f'storage did not commit within {Config.JOURNAL_APPLY_TIMEOUT}s')
+        # The failed batch may be another producer's; retrying ours then only risks duplicates
+        if self.storage.write_failures() != failures:
+            raise RuntimeError('storage failed to commit a batch')
+    
+    def _quarantine(self, entry, error):
+        """Set aside a batch that keeps failing, keeping a copy for re-ingest"""
+        seq, appended_at, metrics = entry
+        record = {'seq': seq, 'appended_at': appended_at, 'error': str(error), 'metrics': metrics}
+        try:
+            with open(self._quarantine_path, 'a') as f:
+                f.write(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"[Journal] Could not save quarantined batch {seq}: {e}")
+        print(f"[Journal] Quarantined batch {seq} ({len(metrics)} metrics) after "
+              f"{self._attempts} failed applies: {error}")
+    
+    def _load_applied(self):
+        try:
+            with open(self._applied_path) as f:
+                return json.load(f)['seq']
+        except (OSError, ValueError, KeyError):
+            return 0
+    
+    def _save_applied(self):
+        """Durably record the last applied batch (write, fsync, rename)"""
+        tmp_path = self._applied_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'seq': self._applied}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._applied_path)
+    
+    def _drop_applied_segments(self):
+        """Delete sealed segments whose batches have all been applied"""
+        for segment in self.log.segments():
+            if segment == self.log.seq:
+                break
+            if self._segment_last_seq.get(segment, 0) <= self._applied:
+                self.log.drop(segment)
+                self._segment_last_seq.pop(segment, None)
+    
+    def wait_applied(self, timeout=None):
+        """Block until every batch journaled so far has been applied"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._pending:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+    
+    def close(self, timeout=10):
+        """Apply what is pending (up to timeout), then stop and seal the journal"""
+        if not self._running:
+            return
+        
+        self.wait_applied(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        
+        with self._cond:
+            self.log.close()
+        print(f"[Journal] Stopped ({self.stats['batches_applied']} batches applied, "
+              f"{len(self._pending)} left for replay)")
+    
+    def get_stats(self):
+        """Get journal counters and lag (batches, metrics and seconds behind)"""
+        with self._cond:
+            stats = dict(self.stats)
+            stats['appended_seq'] = self._seq
+            stats['applied_seq'] = self._applied
+            stats['lag_batches'] = len(self._pending)
+            stats['lag_metrics'] = self._pending_metrics
+            stats['lag_seconds'] = round(time.time() - self._pending[0][1], 3) if self._pending else 0.0
+            stats['log'] = self.log.get_stats()
+        return stats
+
+# Global ingest journal instance
+ingest_journal = IngestJournal(storage)
@@ -0,0 +1,108 @@
+"""
+Latest-Value Cache
+Thread-safe, bounded cache of the newest value per (device_id, parameter)
+with a small ring buffer of recent samples per series. Fed by the
+orchestrator after normalization; read by alarm auto-resolve and the
+/api/latest endpoints without touching SQLite.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+from collections import OrderedDict, deque
+from config.config import Config
+
+class LatestValueCache:
+    def __init__(self, max_series=None, history_size=None):
+        self.max_series = max_series or Config.LATEST_CACHE_MAX_SERIES
+        self.history_size = history_size or Config.LATEST_CACHE_HISTORY
+        
+        # (device_id, parameter) -> entry, least recently updated first
+        self._series = OrderedDict()
+        # device_id -> set of parameters, for per-device reads
+        self._devices = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+    
+    def update(self, metrics):
+        """Record a batch of normalized metrics"""
+        with self._lock:
+            for metric in metrics:
+                key = (metric['device_id'], metric['parameter'])
+                entry = self._series.get(key)
+                
+                if entry is None:
+                    entry = {
+                        'device_id': metric['device_id'],
+                        'parameter': metric['parameter'],
+                        'history': deque(maxlen=self.history_size)
+                    }
+                    self._series[key] = entry
+                    self._devices.setdefault(metric['device_id'], set()).add(metric['parameter'])
+                    self._evict()
+                else:
+                    self._series.move_to_end(key)
+                
+                entry['device_type'] = metric.get('device_type')
+                entry['protocol'] = metric.get('protocol')
+                entry['location'] = metric.get('location')
+                entry['value'] = metric['value']
+                entry['unit'] = metric.get('unit')
+                entry['timestamp'] = metric['timestamp']
+                entry['history'].append((metric['timestamp'], metric['value']))
+    
+    def _evict(self):
+        """Drop the least recently updated series beyond max_series"""
+        while len(self._series) > self.max_series:
+            (device_id, parameter), _ = self._series.popitem(last=False)
+            parameters = self._devices.get(device_id)
+            if parameters is not None:
+                parameters.discard(parameter)
+                if not parameters:
+                    del self._devices[device_id]
+            self.evictions += 1
+    
+    def _public(self, entry, with_history=False):
+        """Copy an entry for callers (history only on request)"""
+        result = {k: v for k, v in entry.items() if k != 'history'}
+        if with_history:
+            result['history'] = [
+                {'timestamp': timestamp, 'value': value}
+                for timestamp, value in entry['history']
+            ]
+        return result
+    
+    def get(self, device_id, parameter, with_history=False):
+        """Get the latest value of one series, or None"""
+        with self._lock:
+            entry = self._series.get((device_id, parameter))
+            return self._public(entry, with_history) if entry else None
+    
+    def get_device(self, device_id):
+        """Get the latest value of every parameter of a device"""
+        with self._lock:
+            parameters = sorted(self._devices.get(device_id, ()))
+            return [self._public(self._series[(device_id, parameter)]) for parameter in parameters]
+    
+    def snapshot(self, parameter=None):
+        """Get the latest value of every cached series (optionally one parameter)"""
+        with self._lock:
+            return [
+                self._public(entry)
+                for (_, entry_parameter), entry in self._series.items()
+                if parameter is None or entry_parameter == parameter
+            ]
+    
+    def get_stats(self):
+        """Get cache size counters"""
+        with self._lock:
+            return {
+                'series': len(self._series),
+                'devices': len(self._devices),
+                'max_series': self.max_series,
+                'evictions': self.evictions
+            }
+
+# Global latest-value cache instance
+latest_cache = LatestValueCache()
@@ -0,0 +1,376 @@
+"""
+In-Memory Storage Backend
+Keeps metrics and alarms in Python structures with no disk I/O, for
+benchmarking the pipeline and for tests. Each series holds its samples as a
+list of (ts, id, value, value_text) tuples sorted by (ts, id), so range
+reads and keyset cursors are bisects. Nothing survives a restart.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bisect
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from config.config import Config
+from storage.timeseries import to_epoch_ms, from_epoch_ms, split_value, join_value
+from storage.backend import StorageBackend, alarm_id_for, state_timestamp_field
+from storage import alarm_stats
+from storage import rollups
+from storage import device_state
+from storage.partitions import DAY_MS
+
+SERIES_FIELDS = ('device_id', 'device_type', 'protocol', 'location', 'parameter', 'unit')
+
+def _now_text():
+    """Current time in the format of SQLite's CURRENT_TIMESTAMP"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+class MemoryStorage(StorageBackend):
+    """In-memory backend (Config.STORAGE_BACKEND = 'memory')"""
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        
+        # (device_id, parameter) -> series dict; series_id -> series dict
+        self._series = {}
+        self._series_by_id = {}
+        self._samples = {}  # series_id -> [(ts, id, value, value_text)]
+        self._devices = {}  # device_id -> [device_type, protocol, location, last_seen, count]
+        self._next_id = 1
+        
+        self._alarms = []  # every alarm row, oldest first
+        self._active = {}  # alarm_id -> non-closed alarm row
+        self._alarm_counts = Counter()  # (state, severity) -> count
+        self._next_alarm_id = 1
+        
+        self._saved_state = {}  # name -> bytes (lost on restart, like everything here)
+        
+        print("[Storage] Using in-memory backend")
+    
+    # Metrics
+    
+    def store_metrics(self, metrics):
+        """Index a batch of normalized metrics"""
+        with self._lock:
+            for metric in metrics:
+                prepared = self._prepare(metric)
+                if prepared:
+                    self._append(*prepared[:4])
+    
+    def _prepare(self, metric):
+        """Resolve a metric to (series, ts, value, value_text, series_changed), or None"""
+        try:
+            ts = to_epoch_ms(metric['timestamp'])
+        except (ValueError, TypeError, AttributeError):
+            print(f"[Storage] Skipping metric with bad timestamp: {metric.get('timestamp')}")
+            return None
+        
+        value, value_text = split_value(metric['value'])
+        
+        key = (metric['device_id'], metric['parameter'])
+        series = self._series.get(key)
+        metadata = {field: metric.get(field) for field in SERIES_FIELDS}
+        changed = series is None
+        
+        if series is None:
+            series = dict(metadata, series_id=len(self._series) + 1)
+            self._restore_series(series)
+        elif any(series[field] != metadata[field] for field in SERIES_FIELDS):
+            series.update(metadata)
+            changed = True
+        
+        return series, ts, value, value_text, changed
+    
+    def _restore_series(self, series):
+        """Register (or refresh) a series dict that already has its series_id"""
+        existing = self._series_by_id.get(series['series_id'])
+        if existing is not None:
+            existing.update(series)
+            return existing
+        
+        self._series[(series['device_id'], series['parameter'])] = series
+        self._series_by_id[series['series_id']] = series
+        self._samples[series['series_id']] = []
+        return series
+    
+    def _append(self, series, ts, value, value_text):
+        """Add one sample to its series and to the device state"""
+        sample = (ts, self._next_id, value, value_text)
+        self._next_id += 1
+        
+        samples = self._samples[series['series_id']]
+        if samples and sample < samples[-1]:
+            bisect.insort(samples, sample)  # late data
+        else:
+            samples.append(sample)
+        
+        device = self._devices.get(series['device_id'])
+        if device is None:
+            self._devices[series['device_id']] = [
+                series['device_type'], series['protocol'], series['location'], ts, 1
+            ]
+        else:
+            device[:3] = series['device_type'], series['protocol'], series['location']
+            device[3] = max(device[3], ts)
+            device[4] += 1
+    
+    def _find_series(self, device_id=None, parameter=None, location=None):
+        """Get the series matching the filters (each a single value or a list)"""
+        filters = [
+            (field, {value} if isinstance(value, str) else set(value))
+            for field, value in (('device_id', device_id), ('parameter', parameter), ('location', location))
+            if value
+        ]
+        return [
+            series for series in self._series.values()
+            if all(series[field] in values for field, values in filters)
+        ]
+    
+    def _slice(self, series_id, start=None, end=None, cursor=None, limit=None):
+        """Copy the samples of a series in [start, end) older than cursor (newest limit only)"""
+        samples = self._samples[series_id]
+        lo = bisect.bisect_left(samples, (start,)) if start is not None else 0
+        hi = bisect.bisect_left(samples, (end,)) if end is not None else len(samples)
+        if cursor is not None:
+            hi = min(hi, bisect.bisect_left(samples, tuple(cursor)))
+        if limit is not None:
+            lo = max(lo, hi - limit)
+        return samples[lo:hi]
+    
+    def _to_metric(self, series, sample):
+        ts, sample_id, value, value_text = sample
+        return {
+            'id': sample_id,
+            'device_id': series['device_id'],
+            'device_type': series['device_type'],
+            'protocol': series['protocol'],
+            'location': series['location'],
+            'parameter': series['parameter'],
+            'value': join_value(value, value_text),
+            'unit': series['unit'],
+            'timestamp': from_epoch_ms(ts)
+        }
+    
+    def get_metrics(self, device_id=None, parameter=None, limit=100, start=None, end=None, cursor=None):
+        """Get metrics newest first, optionally within [start, end) and before cursor"""
+        with self._lock:
+            sources = [
+                [(sample, series) for sample in reversed(self._slice(series['series_id'], start, end, cursor, limit))]
+                for series in self._find_series(device_id, parameter)
+            ]
+        
+        rows = heapq.merge(*sources, key=lambda row: row[0][:2], reverse=True)
+        return [self._to_metric(series, sample) for sample, series in itertools.islice(rows, limit)]
+    
+    def iter_metrics(self, device_id=None, parameter=None, start=None, end=None):
+        """Yield metrics oldest first within [start, end)"""
+        with self._lock:
+            sources = [
+                [(sample, series) for sample in self._slice(series['series_id'], start, end)]
+                for series in self._find_series(device_id, parameter)
+            ]
+        
+        for sample, series in heapq.merge(*sources, key=lambda row: row[0][:2]):
+            yield self._to_metric(series, sample)
+    
+    def get_metric_series(self, start, end, step, device_id=None, parameter=None, location=None):
+        """Get aggregated points at the given step, computed from raw samples"""
+        points = []
+        with self._lock:
+            matched = [
+                (series, self._slice(series['series_id'], start, end))
+                for series in self._find_series(device_id, parameter, location)
+            ]
+        
+        for series, samples in matched:
+            rows = (
+                (series['series_id'], ts, value, value, value, 1, value)
+                for ts, _, value, _ in samples if value is not None
+            )
+            for _, bucket, lo, hi, total, count, last in rollups.rebucket(rows, step):
+                points.append({
+                    'device_id': series['device_id'],
+                    'parameter': series['parameter'],
+                    'location': series['location'],
+                    'unit': series['unit'],
+                    'timestamp': from_epoch_ms(bucket),
+                    'min': lo,
+                    'max': hi,
+                    'avg': total / count,
+                    'count': count,
+                    'last': last
+                })
+        
+        return 'raw', points
+    
+    def enforce_retention(self, now=None):
+        """Drop samples older than the raw retention; returns the number dropped"""
+        now = now or int(time.time() * 1000)
+        cutoff = now - Config.RETENTION_DAYS['raw'] * DAY_MS
+        
+        dropped = 0
+        with self._lock:
+            for samples in self._samples.values():
+                index = bisect.bisect_left(samples, (cutoff,))
+                del samples[:index]
+                dropped += index
+        
+        if dropped:
+            print(f"[Storage] Retention dropped {dropped} samples")
+        return dropped
+    
+    def get_writer_stats(self):
+        """Get in-memory sizes"""
+        with self._lock:
+            return {
+                'series': len(self._series),
+                'samples': sum(len(samples) for samples in self._samples.values()),
+                'alarms': len(self._alarms),
+            }
+    
+    # Alarms
+    
+    def upsert_alarms(self, alarms):
+        """Create or update non-closed alarms from (alarm, occurrences) pairs"""
+        with self._lock:
+            for alarm, occurrences in alarms:
+                self._upsert_alarm(alarm, occurrences)
+    
+    def _upsert_alarm(self, alarm, occurrences):
+        alarm_id = alarm_id_for(alarm)
+        row = self._active.get(alarm_id)
+        now = _now_text()
+        
+        if row is not None:
+            self._count_alarm(row, -1)
+            row['last_seen'] = alarm.get('last_seen', alarm.get('timestamp'))
+            row['severity'] = alarm['severity']
+            row['message'] = alarm['message']
+            row['occurrence_count'] += occurrences
+            row['updated_at'] = now
+            self._count_alarm(row, 1)
+            return row
+        
+        row = {
+            'id': self._next_alarm_id,
+            'alarm_id': alarm_id,
+            'device_id': alarm['device_id'],
+            'device_type': alarm.get('device_type'),
+            'protocol': alarm.get('protocol'),
+            'location': alarm.get('location'),
+            'type': alarm['type'],
+            'category': alarm.get('category'),
+            'severity': alarm['severity'],
+            'state': alarm.get('state', 'OPEN'),
+            'message': alarm['message'],
+            'first_seen': alarm.get('first_seen', alarm.get('timestamp')),
+            'last_seen': alarm.get('last_seen', alarm.get('timestamp')),
+            'acknowledged_at': None,
+            'resolved_at': None,
+            'closed_at': None,
+            'occurrence_count': occurrences,
+            'created_at': now,
+            'updated_at': now,
+        }
+        self._next_alarm_id += 1
+        self._restore_alarm(row)
+        return row
+    
+    def _restore_alarm(self, row):
+        """Add a complete alarm row to the indexes"""
+        self._alarms.append(row)
+        if row['state'] != 'CLOSED':
+            self._active[row['alarm_id']] = row
+        self._count_alarm(row, 1)
+    
+    def _count_alarm(self, row, delta):
+        self._alarm_counts[(row['state'], row['severity'])] += delta
+    
+    def get_active_alarms(self):
+        """Get every non-closed alarm"""
+        with self._lock:
+            return [dict(row) for row in self._active.values()]
+    
+    def update_alarm_state(self, alarm_id, new_state, timestamp=None):
+        """Update the state of the non-closed alarm with this alarm_id"""
+        with self._lock:
+            self._set_alarm_state(alarm_id, new_state, timestamp or datetime.utcnow().isoformat() + 'Z')
+        
+        print(f"[Storage] Updated alarm {alarm_id} to state {new_state}")
+    
+    def _set_alarm_state(self, alarm_id, new_state, timestamp):
+        row = self._active.get(alarm_id)
+        if row is None:
+            return
+        
+        self._count_alarm(row, -1)
+        row['state'] = new_state
+        row['updated_at'] = _now_text()
+        timestamp_field = state_timestamp_field(new_state)
+        if timestamp_field:
+            row[timestamp_field] = timestamp
+        self._count_alarm(row, 1)
+        
+        if new_state == 'CLOSED':
+            del self._active[alarm_id]
+    
+    def get_alarms(self, state=None, severity=None, limit=100):
+        """Get alarms, newest first_seen first"""
+        with self._lock:
+            rows = [
+                row for row in self._alarms
+                if (not state or row['state'] == state) and (not severity or row['severity'] == severity)
+            ]
+            rows = heapq.nlargest(limit, rows, key=lambda row: row['first_seen'] or '')
+            return [dict(row) for row in rows]
+    
+    # Summaries
+    
+    def get_alarm_statistics(self):
+        """Get alarm counts per state and active counts per severity"""
+        with self._lock:
+            rows = [(state, severity, count) for (state, severity), count in self._alarm_counts.items()]
+        return alarm_stats.summarize(rows)
+    
+    def get_device_summary(self):
+        """Get last_seen, metric count and active alarm counts per device"""
+        with self._lock:
+            breakdown = {}
+            for row in self._active.values():
+                if row['state'] in device_state.ALARM_STATE_COLUMNS:
+                    counts = breakdown.setdefault(row['device_id'], {})
+                    counts[row['state']] = counts.get(row['state'], 0) + 1
+            
+            devices = []
+            for device_id in sorted(self._devices):
+                device_type, protocol, location, last_seen, count = self._devices[device_id]
+                alarm_counts = breakdown.get(device_id, {})
+                devices.append({
+                    'device_id': device_id,
+                    'device_type': device_type,
+                    'protocol': protocol,
+                    'location': location,
+                    'last_seen': from_epoch_ms(last_seen),
+                    'metric_count': count,
+                    'active_alarms': sum(alarm_counts.values()),
+                    'alarm_breakdown': alarm_counts
+                })
+        
+        return devices
+    
+    # Saved state
+    
+    def save_state(self, name, data):
+        """Keep the bytes saved under name (in memory only)"""
+        with self._lock:
+            self._saved_state[name] = bytes(data)
+    
+    def load_state(self, name):
+        """Get the bytes last saved under name, or None"""
+        with self._lock:
+            return self._saved_state.get(name)
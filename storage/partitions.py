@@ -0,0 +1,91 @@
+"""
+Time Partitions
+Raw samples live in one table per UTC day (samples_YYYYMMDD) registered in a
+partitions catalog. Queries only touch the partitions overlapping their time
+range, and retention drops whole partitions instead of running DELETEs.
+"""
+from datetime import datetime, timezone
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+def create_catalog(cursor):
+    """Create the partitions catalog table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS partitions (
+            name TEXT PRIMARY KEY,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL
+        )
+    ''')
+
+def day_start(ts):
+    """Get the start (epoch ms) of the UTC day containing ts"""
+    return ts - ts % DAY_MS
+
+def partition_name(start_ts):
+    """Get the table name for the partition starting at start_ts"""
+    day = datetime.fromtimestamp(start_ts // 1000, tz=timezone.utc)
+    return f"samples_{day.strftime('%Y%m%d')}"
+
+def create_partition(conn, start_ts):
+    """Create the partition for the day starting at start_ts (idempotent)"""
+    name = partition_name(start_ts)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY,
+            series_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            value REAL,
+            value_text TEXT
+        )
+    ''')
+    conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_{name}_series_time
+        ON {name}(series_id, ts)
+    ''')
+    conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_{name}_time
+        ON {name}(ts)
+    ''')
+    conn.execute(
+        'INSERT OR IGNORE INTO partitions (name, start_ts, end_ts) VALUES (?, ?, ?)',
+        (name, start_ts, start_ts + DAY_MS)
+    )
+    return name
+
+def list_partitions(conn, start=None, end=None, newest_first=False):
+    """List (name, start_ts, end_ts) of partitions overlapping [start, end)"""
+    query = 'SELECT name, start_ts, end_ts FROM partitions WHERE 1=1'
+    params = []
+    
+    if start is not None:
+        query += ' AND end_ts > ?'
+        params.append(start)
+    
+    if end is not None:
+        query += ' AND start_ts < ?'
+        params.append(end)
+    
+    query += ' ORDER BY start_ts DESC' if newest_first else ' ORDER BY start_ts'
+    return [tuple(row) for row in conn.execute(query, params).fetchall()]
+
+def drop_before(conn, cutoff_ts):
+    """Drop every partition that ends at or before cutoff_ts; returns dropped names"""
+    expired = [row[0] for row in conn.execute(
+        'SELECT name FROM partitions WHERE end_ts <= ? ORDER BY start_ts', (cutoff_ts,)
+    ).fetchall()]
+    
+    for name in expired:
+        conn.execute(f'DROP TABLE IF EXISTS {name}')
+        conn.execute('DELETE FROM partitions WHERE name = ?', (name,))
+    
+    return expired
+
+def max_sample_id(conn):
+    """Get the highest sample id across all partitions (0 when empty)"""
+    highest = 0
+    for name, _, _ in list_partitions(conn):
+        row = conn.execute(f'SELECT MAX(id) FROM {name}').fetchone()
+        if row[0] is not None:
+            highest = max(highest, row[0])
+    return highest
@@ -0,0 +1,127 @@
+"""
+Continuous Rollups
+Per-series min/max/sum/count/last aggregates at 1m, 1h and 1d resolution.
+The metric writer folds every ingested batch into the rollup tables in the
+same transaction, so aggregates are always current without batch rebuilds.
+"""
+
+# (name, bucket size in ms), finest first
+RESOLUTIONS = [
+    ('1m', 60 * 1000),
+    ('1h', 60 * 60 * 1000),
+    ('1d', 24 * 60 * 60 * 1000),
+]
+
+def table_name(resolution):
+    """Get the rollup table for a resolution name"""
+    return f'rollup_{resolution}'
+
+def create_tables(cursor):
+    """Create one rollup table per resolution"""
+    for name, _ in RESOLUTIONS:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name(name)} (
+                series_id INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                min REAL,
+                max REAL,
+                sum REAL,
+                count INTEGER,
+                last REAL,
+                last_ts INTEGER,
+                PRIMARY KEY (series_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+def aggregate(samples, bucket_ms):
+    """Fold (series_id, ts, value) samples into per-bucket aggregates
+    
+    Returns {(series_id, bucket): [min, max, sum, count, last, last_ts]}
+    """
+    buckets = {}
+    for series_id, ts, value in samples:
+        key = (series_id, ts - ts % bucket_ms)
+        agg = buckets.get(key)
+        if agg is None:
+            buckets[key] = [value, value, value, 1, value, ts]
+            continue
+        
+        if value < agg[0]:
+            agg[0] = value
+        if value > agg[1]:
+            agg[1] = value
+        agg[2] += value
+        agg[3] += 1
+        if ts >= agg[5]:
+            agg[4] = value
+            agg[5] = ts
+    
+    return buckets
+
+def apply(conn, samples):
+    """Merge a batch of numeric (series_id, ts, value) samples into every rollup"""
+    if not samples:
+        return
+    
+    for name, bucket_ms in RESOLUTIONS:
+        rows = [
+            (series_id, bucket, *agg)
+            for (series_id, bucket), agg in aggregate(samples, bucket_ms).items()
+        ]
+        conn.executemany(f'''
+            INSERT INTO {table_name(name)} (series_id, bucket, min, max, sum, count, last, last_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (series_id, bucket) DO UPDATE SET
+                min = MIN(min, excluded.min),
+                max = MAX(max, excluded.max),
+                sum = sum + excluded.sum,
+                count = count + excluded.count,
+                last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last ELSE last END,
+                last_ts = MAX(last_ts, excluded.last_ts)
+        ''', rows)
+
+def trim(conn, resolution, cutoff_ts, series_ids):
+    """Delete buckets older than cutoff_ts, walking the (series_id, bucket) key per series"""
+    table = table_name(resolution)
+    deleted = 0
+    for series_id in series_ids:
+        deleted += conn.execute(
+            f'DELETE FROM {table} WHERE series_id = ? AND bucket < ?', (series_id, cutoff_ts)
+        ).rowcount
+    return deleted
+
+def choose_resolution(step_ms):
+    """Pick the coarsest rollup whose bucket still fits inside the step
+    
+    Returns (name, bucket_ms), or ('raw', None) when the step is finer than
+    the smallest rollup.
+    """
+    chosen = ('raw', None)
+    for name, bucket_ms in RESOLUTIONS:
+        if bucket_ms <= step_ms:
+            chosen = (name, bucket_ms)
+    return chosen
+
+def rebucket(rows, step_ms):
+    """Re-aggregate ordered (series_id, ts, min, max, sum, count, last) rows into step buckets
+    
+    Rows must be ordered by series_id then ts. Yields
+    (series_id, bucket, min, max, sum, count, last).
+    """
+    current = None
+    for series_id, ts, lo, hi, total, count, last in rows:
+        bucket = ts - ts % step_ms
+        if current and current[0] == series_id and current[1] == bucket:
+            current[2] = min(current[2], lo)
+            current[3] = max(current[3], hi)
+            current[4] += total
+            current[5] += count
+            current[6] = last
+            continue
+        
+        if current:
+            yield tuple(current)
+        current = [series_id, bucket, lo, hi, total, count, last]
+    
+    if current:
+        yield tuple(current)
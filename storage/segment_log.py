@@ -0,0 +1,242 @@
+"""
+Segment-Log Storage Backend
+High-rate ingest backend: every write is appended as a record to an
+mmap'd append-only segment log (storage/segments.py) and applied to the
+in-memory indexes of MemoryStorage, which serve all reads. On startup the
+log is replayed to rebuild the indexes.
+
+Every new segment starts with a checkpoint of series, device state and
+active alarms, so retention can delete whole old segments and replay can
+start from the oldest segment still on disk (closed alarms recorded only
+in deleted segments are gone after a restart).
+
+Records (first byte is the type):
+    S  sample        <u32 series_id><i64 ts><u8 kind> + f64 value or UTF-8 text
+    D  series        JSON series dict
+    U  alarm upsert  JSON [[alarm, occurrences], ...]
+    T  alarm state   JSON [alarm_id, new_state, timestamp]
+    C  checkpoint    JSON {next_id, next_alarm_id, series, devices, alarms, alarm_counts}
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import struct
+import time
+from datetime import datetime
+from config.config import Config
+from storage.memory_backend import MemoryStorage
+from storage.segments import SegmentLog
+from storage.partitions import DAY_MS
+
+_SAMPLE = struct.Struct('<IqB')
+_FLOAT = struct.Struct('<d')
+
+# Sample value kinds
+_NUMERIC = 0
+_NULL = 1
+_TEXT = 2
+
+def _json_record(kind, body):
+    return kind + json.dumps(body, separators=(',', ':'), default=str).encode('utf-8')
+
+def _sample_record(series_id, ts, value, value_text):
+    if value_text is not None:
+        return b'S' + _SAMPLE.pack(series_id, ts, _TEXT) + value_text.encode('utf-8')
+    if value is None:
+        return b'S' + _SAMPLE.pack(series_id, ts, _NULL)
+    return b'S' + _SAMPLE.pack(series_id, ts, _NUMERIC) + _FLOAT.pack(value)
+
+class SegmentLogStorage(MemoryStorage):
+    """mmap append-log backend (Config.STORAGE_BACKEND = 'segment_log')"""
+    
+    def __init__(self, directory=None, segment_bytes=None):
+        super().__init__()
+        
+        self.log = SegmentLog(
+            directory or Config.SEGMENT_LOG_DIR,
+            segment_bytes or Config.SEGMENT_LOG_SEGMENT_BYTES,
+            checkpoint=self._checkpoint
+        )
+        self._segment_max_ts = {}  # segment seq -> newest sample ts in it
+        
+        started = time.perf_counter()
+        records = self._replay()
+        self.log.open()
+        
+        print(f"[Storage] Segment log at {self.log.directory}: replayed {records} records "
+              f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+    
+    def _replay(self):
+        """Rebuild the in-memory indexes from the segments on disk
+        
+        Samples past the raw retention are skipped like enforce_retention
+        drops them; their segment may still be on disk until all of it expires.
+        Skipped samples still use up their id, so every kept sample gets back
+        the id it had before the restart and (ts, id) cursors stay valid.
+        """
+        records = 0
+        cutoff = int(time.time() * 1000) - Config.RETENTION_DAYS['raw'] * DAY_MS
+        with self._lock:
+            for seq, payload in self.log.replay():
+                kind, body = payload[:1], payload[1:]
+                
+                if kind == b'S':
+                    series_id, ts, value_kind = _SAMPLE.unpack_from(body)
+                    self._track(seq, ts)
+                    if ts < cutoff:
+                        self._next_id += 1
+                        records += 1
+                        continue
+                    rest = body[_SAMPLE.size:]
+                    value = _FLOAT.unpack(rest)[0] if value_kind == _NUMERIC else None
+                    value_text = rest.decode('utf-8') if value_kind == _TEXT else None
+                    self._append(self._series_by_id[series_id], ts, value, value_text)
+                elif kind == b'D':
+                    self._restore_series(json.loads(body))
+                elif kind == b'U':
+                    for alarm, occurrences in json.loads(body):
+                        self._upsert_alarm(alarm, occurrences)
+                elif kind == b'T':
+                    self._set_alarm_state(*json.loads(body))
+                elif kind == b'C' and records == 0:
+                    # Only the oldest surviving segment's checkpoint matters;
+                    # later ones repeat state the replay already rebuilt
+                    self._restore_checkpoint(json.loads(body))
+                
+                records += 1
+        return records
+    
+    def _track(self, seq, ts):
+        newest = self._segment_max_ts.get(seq)
+        if newest is None or ts > newest:
+            self._segment_max_ts[seq] = ts
+    
+    def _checkpoint(self):
+        """Checkpoint payload written at the head of every new segment"""
+        return _json_record(b'C', {
+            'next_id': self._next_id,
+            'next_alarm_id': self._next_alarm_id,
+            'series': list(self._series.values()),
+            'devices': self._devices,
+            'alarms': list(self._active.values()),
+            'alarm_counts': [[state, severity, count] for (state, severity), count in self._alarm_counts.items()],
+        })
+    
+    def _restore_checkpoint(self, checkpoint):
+        self._next_id = checkpoint['next_id']
+        self._next_alarm_id = checkpoint['next_alarm_id']
+        for series in checkpoint['series']:
+            self._restore_series(series)
+        self._devices.update(checkpoint['devices'])
+        for row in checkpoint['alarms']:
+            self._alarms.append(row)
+            self._active[row['alarm_id']] = row
+        for state, severity, count in checkpoint['alarm_counts']:
+            self._alarm_counts[(state, severity)] = count
+    
+    # Metrics
+    
+    def store_metrics(self, metrics):
+        """Append a batch of metrics to the log and index them"""
+        with self._lock:
+            for metric in metrics:
+                prepared = self._prepare(metric)
+                if not prepared:
+                    continue
+                
+                series, ts, value, value_text, changed = prepared
+                if changed:
+                    self.log.append(_json_record(b'D', series))
+                seq = self.log.append(_sample_record(series['series_id'], ts, value, value_text))
+                self._append(series, ts, value, value_text)
+                self._track(seq, ts)
+    
+    def flush(self, timeout=None):
+        """msync the segment being written"""
+        with self._lock:
+            self.log.flush()
+        return True
+    
+    def close(self):
+        """Flush and seal the segment being written"""
+        with self._lock:
+            self.log.close()
+    
+    def enforce_retention(self, now=None):
+        """Drop expired samples and delete the old segments holding only expired data
+        
+        Only a prefix of the log is deleted, so the oldest remaining segment
+        still starts with a checkpoint of everything before it.
+        """
+        now = now or int(time.time() * 1000)
+        cutoff = now - Config.RETENTION_DAYS['raw'] * DAY_MS
+        dropped = super().enforce_retention(now)
+        
+        deleted = 0
+        with self._lock:
+            for seq in self.log.segments():
+                if seq == self.log.seq or self._segment_max_ts.get(seq, cutoff - 1) >= cutoff:
+                    break
+                self.log.drop(seq)
+                self._segment_max_ts.pop(seq, None)
+                deleted += 1
+        
+        if deleted:
+            print(f"[Storage] Retention deleted {deleted} log segments")
+        return dropped
+    
+    def get_writer_stats(self):
+        """Get in-memory sizes and segment log counters"""
+        stats = super().get_writer_stats()
+        with self._lock:
+            stats['log'] = self.log.get_stats()
+        return stats
+    
+    # Alarms
+    
+    def upsert_alarms(self, alarms):
+        """Log and apply a batch of alarm upserts"""
+        alarms = [(alarm, occurrences) for alarm, occurrences in alarms]
+        if not alarms:
+            return
+        
+        with self._lock:
+            self.log.append(_json_record(b'U', alarms))
+            for alarm, occurrences in alarms:
+                self._upsert_alarm(alarm, occurrences)
+    
+    def update_alarm_state(self, alarm_id, new_state, timestamp=None):
+        """Log and apply an alarm state change"""
+        timestamp = timestamp or datetime.utcnow().isoformat() + 'Z'
+        with self._lock:
+            if alarm_id not in self._active:
+                return
+            self.log.append(_json_record(b'T', [alarm_id, new_state, timestamp]))
+            self._set_alarm_state(alarm_id, new_state, timestamp)
+        
+        print(f"[Storage] Updated alarm {alarm_id} to state {new_state}")
+    
+    # Saved state
+    
+    def _state_path(self, name):
+        return os.path.join(self.log.directory, f'{name}.state')
+    
+    def save_state(self, name, data):
+        """Durably replace the bytes saved under name (a file beside the segments)"""
+        path = self._state_path(name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    
+    def load_state(self, name):
+        """Get the bytes last saved under name, or None"""
+        try:
+            with open(self._state_path(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,157 @@
+"""
+Segment Files
+Append-only log split into numbered segment files (0000000001.seg, ...).
+Each segment is preallocated and mmap'd, so appending a record is a memory
+copy; flush() msyncs the mapping. Records are framed as
+
+    <u32 length><u32 crc32><payload>
+
+and a zero length marks the end of the written part of a segment. Replay
+stops at the first torn or corrupt frame of a segment.
+"""
+import mmap
+import os
+import struct
+import zlib
+
+FRAME = struct.Struct('<II')
+
+def read_segment(path):
+    """Yield the payloads of one segment file in order"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < FRAME.size:
+            return
+        
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            while offset + FRAME.size <= size:
+                length, crc = FRAME.unpack_from(data, offset)
+                end = offset + FRAME.size + length
+                if length == 0 or end > size:
+                    break
+                
+                payload = data[offset + FRAME.size:end]
+                if zlib.crc32(payload) != crc:
+                    print(f"[Segments] Corrupt record in {os.path.basename(path)} at {offset}, stopping replay")
+                    break
+                
+                yield payload
+                offset = end
+
+class SegmentLog:
+    def __init__(self, directory, segment_bytes, checkpoint=None):
+        """checkpoint() may return a payload written at the head of every new segment"""
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.checkpoint = checkpoint
+        
+        self.seq = None  # sequence number of the segment being written
+        self._file = None
+        self._map = None
+        self._offset = 0
+        
+        self.stats = {
+            'records': 0,
+            'bytes': 0,
+            'rotations': 0,
+            'flushes': 0,
+        }
+        
+        os.makedirs(directory, exist_ok=True)
+    
+    def _path(self, seq):
+        return os.path.join(self.directory, f'{seq:010d}.seg')
+    
+    def segments(self):
+        """List the sequence numbers of the segments on disk, oldest first"""
+        return sorted(
+            int(name[:-4]) for name in os.listdir(self.directory)
+            if name.endswith('.seg') and name[:-4].isdigit()
+        )
+    
+    def replay(self):
+        """Yield (seq, payload) for every record on disk, oldest first"""
+        for seq in self.segments():
+            if seq == self.seq:
+                break
+            for payload in read_segment(self._path(seq)):
+                yield seq, payload
+    
+    def open(self):
+        """Start writing a fresh segment after the existing ones"""
+        if self._map is None:
+            existing = self.segments()
+            self._rotate(0, (existing[-1] if existing else 0) + 1)
+    
+    def append(self, payload):
+        """Append one record; returns the sequence number of its segment"""
+        if self._map is None:
+            self.open()
+        
+        frame = FRAME.size + len(payload)
+        if self._offset + frame > len(self._map):
+            self._rotate(frame, self.seq + 1)
+            self.stats['rotations'] += 1
+        
+        self._write(payload)
+        return self.seq
+    
+    def _write(self, payload):
+        end = self._offset + FRAME.size + len(payload)
+        FRAME.pack_into(self._map, self._offset, len(payload), zlib.crc32(payload))
+        self._map[self._offset + FRAME.size:end] = payload
+        self._offset = end
+        
+        self.stats['records'] += 1
+        self.stats['bytes'] += FRAME.size + len(payload)
+    
+    def _rotate(self, needed, seq):
+        """Seal the current segment and map a new one with room for needed bytes"""
+        self._seal()
+        
+        head = self.checkpoint() if self.checkpoint else None
+        if head is not None:
+            needed += FRAME.size + len(head)
+        
+        self.seq = seq
+        self._file = open(self._path(seq), 'w+b')
+        # One spare frame header so the zero-length end marker always fits
+        self._file.truncate(max(self.segment_bytes, needed + FRAME.size))
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._offset = 0
+        
+        if head is not None:
+            self._write(head)
+    
+    def _seal(self):
+        """Flush the current segment and trim its unused preallocated tail"""
+        if self._map is None:
+            return
+        
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self._offset)
+        self._file.close()
+        self._map = self._file = None
+    
+    def flush(self):
+        """msync the segment being written"""
+        if self._map is not None:
+            self._map.flush()
+            self.stats['flushes'] += 1
+    
+    def drop(self, seq):
+        """Delete a sealed segment"""
+        if seq != self.seq:
+            os.remove(self._path(seq))
+    
+    def close(self):
+        """Flush and seal the segment being written"""
+        self._seal()
+    
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['segments'] = len(self.segments())
+        stats['current_segment'] = self.seq
+        return stats
@@ -8,13 +8,42 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import sqlite3
 import json
+import time
+import heapq
+import itertools
 from datetime import datetime
 from config.config import Config
+from storage.timeseries import to_epoch_ms, from_epoch_ms, split_value, join_value
+from storage.writer import MetricWriter
+from storage import rollups
+from storage import partitions
+from storage import device_state
+from storage import alarm_stats
+from storage import chunks
+from storage.backend import StorageBackend, alarm_id_for, state_timestamp_field
+from pipeline.telemetry import telemetry
 
-class Storage:
+class Storage(StorageBackend):
+    """SQLite backend (Config.STORAGE_BACKEND = 'sqlite')"""
+    
     def __init__(self, db_path=None):
         self.db_path = db_path or Config.DB_PATH
         self._init_database()
+        self.writer = MetricWriter(self.db_path)
+        
+        # Totals for partitions compacted by this process
+        self.compaction_stats = {'partitions': 0, 'samples': 0, 'hot_bytes': 0, 'chunk_bytes': 0}
+    
+    def _connect(self, snapshot=False):
+        """Open a short-lived connection for reads and alarm updates
+        
+        With snapshot=True a read transaction is opened so that multi-query
+        reads (series + partitions) see one consistent view of the database.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if snapshot:
+            conn.execute('BEGIN')
+        return conn
     
     def _init_database(self):
         """Initialize database schema"""
@@ -24,38 +53,67 @@ class Storage:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # Metrics table (time-series data)
+        # WAL lets dashboard reads run alongside the metric writer
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
+        # Series dimension table: one row per (device, parameter)
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS metrics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+            CREATE TABLE IF NOT EXISTS series (
+                series_id INTEGER PRIMARY KEY,
                 device_id TEXT NOT NULL,
                 device_type TEXT,
                 protocol TEXT,
                 location TEXT,
                 parameter TEXT NOT NULL,
-                value TEXT,
                 unit TEXT,
-                timestamp TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                UNIQUE (device_id, parameter)
             )
         ''')
         
-        # Create index for faster queries
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_metrics_device_time 
-            ON metrics(device_id, timestamp)
-        ''')
+        # Raw samples are stored in daily partitions listed in this catalog
+        partitions.create_catalog(cursor)
         
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_metrics_parameter 
-            ON metrics(parameter, timestamp)
-        ''')
+        # Cold tier: older samples compacted into compressed per-series chunks
+        chunks.create_table(cursor)
+        
+        # Rollup tables (1m / 1h / 1d aggregates per series)
+        rollups.create_tables(cursor)
         
         # Alarms table (event lifecycle)
+        self._create_alarms_table(cursor)
+        
+        # Materialized per-device state (maintained on ingest and by alarm triggers)
+        device_state.create_tables(cursor)
+        
+        # Per-(state, severity) alarm counters (maintained by alarm triggers)
+        alarm_stats.create_tables(cursor)
+        
+        # Checkpoints of in-memory components (save_state/load_state)
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS alarms (
+            CREATE TABLE IF NOT EXISTS saved_state (
+                name TEXT PRIMARY KEY,
+                updated_at INTEGER NOT NULL,
+                data BLOB NOT NULL
+            )
+        ''')
+        
+        conn.commit()
+        
+        self._migrate(conn)
+        conn.close()
+        
+        print(f"[Storage] Database initialized at {self.db_path}")
+    
+    def _create_alarms_table(self, cursor, name='alarms'):
+        """Create the alarms table and its indexes
+        
+        alarm_id is only unique among non-closed alarms (partial unique index),
+        so an alarm can reopen after its previous occurrence was CLOSED.
+        """
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {name} (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                alarm_id TEXT UNIQUE NOT NULL,
+                alarm_id TEXT NOT NULL,
                 device_id TEXT NOT NULL,
                 device_type TEXT,
                 protocol TEXT,
@@ -76,6 +134,14 @@ class Storage:
             )
         ''')
         
+        if name != 'alarms':
+            return
+        
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_alarms_active_id 
+            ON alarms(alarm_id) WHERE state != 'CLOSED'
+        ''')
+        
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_alarms_state 
             ON alarms(state, severity)
@@ -85,109 +151,550 @@ class Storage:
             CREATE INDEX IF NOT EXISTS idx_alarms_device 
             ON alarms(device_id, state)
         ''')
+    
+    def _migrate(self, conn):
+        """Upgrade databases created by older versions of the schema"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        
+        if version < 2:
+            self._migrate_metrics_to_samples(conn)
+            conn.execute('PRAGMA user_version = 2')
+        
+        if version < 3:
+            self._backfill_rollups(conn)
+            conn.execute('PRAGMA user_version = 3')
+        
+        if version < 4:
+            self._partition_samples(conn)
+            conn.execute('PRAGMA user_version = 4')
+        
+        if version < 5:
+            self._rebuild_device_state(conn)
+            conn.execute('PRAGMA user_version = 5')
+        
+        if version < 6:
+            alarm_stats.rebuild(conn)
+            conn.commit()
+            conn.execute('PRAGMA user_version = 6')
+        
+        if version < 7:
+            self._drop_alarm_id_unique(conn)
+            conn.execute('PRAGMA user_version = 7')
+    
+    def _drop_alarm_id_unique(self, conn):
+        """Rebuild alarms without the table-wide UNIQUE constraint on alarm_id"""
+        sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'alarms'"
+        ).fetchone()[0]
+        if 'alarm_id TEXT UNIQUE' not in sql:
+            return
         
+        print("[Storage] Rebuilding alarms table with partial unique index...")
+        
+        cursor = conn.cursor()
+        self._create_alarms_table(cursor, name='alarms_rebuild')
+        cursor.execute('INSERT INTO alarms_rebuild SELECT * FROM alarms')
+        cursor.execute('DROP TABLE alarms')
+        cursor.execute('ALTER TABLE alarms_rebuild RENAME TO alarms')
+        
+        # Indexes and triggers went with the old table
+        self._create_alarms_table(cursor)
+        device_state.create_tables(cursor)
+        alarm_stats.create_tables(cursor)
+        alarm_stats.rebuild(conn)
         conn.commit()
-        conn.close()
+    
+    def _table_exists(self, conn, name):
+        """Check whether a table exists"""
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone() is not None
+    
+    def _migrate_metrics_to_samples(self, conn, chunk_size=10000):
+        """Convert the legacy TEXT metrics table into series + samples"""
+        if not self._table_exists(conn, 'metrics'):
+            return
         
-        print(f"[Storage] Database initialized at {self.db_path}")
+        print("[Storage] Migrating legacy metrics table to series/samples...")
+        
+        # Unpartitioned staging table, split into daily partitions by _partition_samples
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS samples (
+                id INTEGER PRIMARY KEY,
+                series_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                value REAL,
+                value_text TEXT
+            )
+        ''')
+        
+        # Latest metadata wins for each (device, parameter)
+        conn.execute('''
+            INSERT OR IGNORE INTO series (device_id, device_type, protocol, location, parameter, unit)
+            SELECT device_id, device_type, protocol, location, parameter, unit
+            FROM metrics
+            ORDER BY id DESC
+        ''')
+        series_ids = {
+            (row[0], row[1]): row[2]
+            for row in conn.execute('SELECT device_id, parameter, series_id FROM series')
+        }
+        
+        migrated = 0
+        last_id = 0
+        while True:
+            rows = conn.execute('''
+                SELECT id, device_id, parameter, value, timestamp
+                FROM metrics WHERE id > ? ORDER BY id LIMIT ?
+            ''', (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            
+            samples = []
+            for row_id, device_id, parameter, value, timestamp in rows:
+                try:
+                    ts = to_epoch_ms(timestamp)
+                except (ValueError, TypeError, AttributeError):
+                    continue
+                
+                value_num, value_text = split_value(value)
+                samples.append((series_ids[(device_id, parameter)], ts, value_num, value_text))
+            
+            conn.executemany(
+                'INSERT INTO samples (series_id, ts, value, value_text) VALUES (?, ?, ?, ?)',
+                samples
+            )
+            migrated += len(samples)
+            last_id = rows[-1][0]
+        
+        conn.execute('DROP TABLE metrics')
+        conn.commit()
+        
+        print(f"[Storage] Migrated {migrated} metrics into {len(series_ids)} series")
+    
+    def _backfill_rollups(self, conn, chunk_size=50000):
+        """Build rollups for samples stored before rollups existed"""
+        if not self._table_exists(conn, 'samples'):
+            return
+        
+        last_id = 0
+        while True:
+            rows = conn.execute('''
+                SELECT id, series_id, ts, value FROM samples
+                WHERE id > ? ORDER BY id LIMIT ?
+            ''', (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            
+            rollups.apply(conn, [(row[1], row[2], row[3]) for row in rows if row[3] is not None])
+            last_id = rows[-1][0]
+        
+        conn.commit()
+    
+    def _partition_samples(self, conn):
+        """Split the unpartitioned samples table into daily partitions"""
+        if not self._table_exists(conn, 'samples'):
+            return
+        
+        print("[Storage] Splitting samples into daily partitions...")
+        
+        days = [row[0] for row in conn.execute(
+            f'SELECT DISTINCT ts - ts % {partitions.DAY_MS} FROM samples'
+        ).fetchall()]
+        
+        for day in days:
+            name = partitions.create_partition(conn, day)
+            conn.execute(f'''
+                INSERT INTO {name} (id, series_id, ts, value, value_text)
+                SELECT id, series_id, ts, value, value_text FROM samples
+                WHERE ts >= ? AND ts < ?
+            ''', (day, day + partitions.DAY_MS))
+        
+        conn.execute('DROP TABLE samples')
+        conn.commit()
+        
+        print(f"[Storage] Created {len(days)} daily partitions")
+    
+    def _rebuild_device_state(self, conn):
+        """Populate device_state from the stored samples and alarms"""
+        series = {
+            row[0]: row[1:]
+            for row in conn.execute('SELECT series_id, device_id, device_type, protocol, location FROM series')
+        }
+        
+        summaries = {}
+        for name, _, _ in partitions.list_partitions(conn):
+            rows = conn.execute(
+                f'SELECT series_id, MAX(ts), COUNT(*) FROM {name} GROUP BY series_id'
+            ).fetchall()
+            for series_id, last_seen, count in rows:
+                device_id, device_type, protocol, location = series[series_id]
+                previous = summaries.get(device_id)
+                if previous:
+                    last_seen = max(last_seen, previous[3])
+                    count += previous[4]
+                summaries[device_id] = (device_type, protocol, location, last_seen, count)
+        
+        device_state.rebuild(conn, summaries)
+        conn.commit()
     
     def store_metrics(self, metrics):
-        """Store metrics to database"""
+        """Queue metrics for the background writer"""
         if not metrics:
             return
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.writer.submit(metrics)
+    
+    def flush(self, timeout=None):
+        """Wait until all queued metrics are committed"""
+        return self.writer.flush(timeout)
+    
+    def close(self):
+        """Flush pending metrics and stop the writer (shutdown hook)"""
+        self.writer.close()
+    
+    def get_writer_stats(self):
+        """Get ingest counters (rows per transaction, flush latency)"""
+        return self.writer.get_stats()
+    
+    def write_failures(self):
+        """Count of queued batches the writer failed to commit"""
+        return self.writer.failures()
+    
+    def get_metrics(self, device_id=None, parameter=None, limit=100, start=None, end=None, cursor=None):
+        """Retrieve metrics newest first, optionally within [start, end) epoch ms
+        
+        device_id and parameter accept a single value or a list. cursor is a
+        (ts, id) keyset position from a previous page: only rows strictly
+        older than it are returned, so deep pages cost the same as the first.
+        Days are scanned newest first and only those overlapping the range
+        (and older than the cursor) are touched; compacted days are decoded
+        from their chunks.
+        """
+        conn = self._connect(snapshot=True)
+        conn.row_factory = sqlite3.Row
+        db = conn.cursor()
         
-        for metric in metrics:
-            cursor.execute('''
-                INSERT INTO metrics (device_id, device_type, protocol, location, 
-                                   parameter, value, unit, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                metric['device_id'],
-                metric.get('device_type'),
-                metric.get('protocol'),
-                metric.get('location'),
-                metric['parameter'],
-                str(metric['value']),
-                metric.get('unit'),
-                metric['timestamp']
+        series = self._find_series(db, device_id=device_id, parameter=parameter)
+        filtered = bool(device_id or parameter)
+        
+        if cursor is not None:
+            end = min(end, cursor[0] + 1) if end is not None else cursor[0] + 1
+        
+        # A day may be hot (partition), cold (chunks) or both after late data
+        hot = {day: name for name, day, _ in partitions.list_partitions(conn, start, end)}
+        days = sorted(set(hot) | set(chunks.list_days(conn, start, end)), reverse=True)
+        
+        metrics = []
+        for day in days:
+            if not series or len(metrics) >= limit:
+                break
+            
+            remaining = limit - len(metrics)
+            sources = []
+            if day in hot and filtered:
+                # Walk idx_<partition>_series_time once per series
+                sources.extend(
+                    self._scan_partition(db, hot[day], remaining, start, end, cursor, series_id)
+                    for series_id in series
+                )
+            elif day in hot:
+                # Walk idx_<partition>_time directly
+                sources.append(self._scan_partition(db, hot[day], remaining, start, end, cursor))
+            
+            sources.append(chunks.scan(
+                conn, list(series) if filtered else None, start, end, cursor, day=day
             ))
+            
+            rows = heapq.merge(*sources, key=lambda row: (row['ts'], row['id']), reverse=True)
+            for row in itertools.islice(rows, remaining):
+                metrics.append(self._row_to_metric(row, series[row['series_id']]))
         
-        conn.commit()
         conn.close()
         
-        print(f"[Storage] Stored {len(metrics)} metrics")
+        return metrics
     
-    def get_metrics(self, device_id=None, parameter=None, limit=100):
-        """Retrieve metrics from database"""
-        conn = sqlite3.connect(self.db_path)
+    def iter_metrics(self, device_id=None, parameter=None, start=None, end=None):
+        """Yield metrics oldest first within [start, end) epoch ms, for bulk export
+        
+        Rows stream from SQLite cursors day by day (hot partitions and cold
+        chunks merged per day) instead of being collected into a list, so
+        memory stays flat however large the range is. The whole export reads
+        one snapshot, so concurrent compaction or retention cannot break it.
+        """
+        conn = self._connect(snapshot=True)
         conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
         
-        query = 'SELECT * FROM metrics WHERE 1=1'
+        try:
+            series = self._find_series(conn.cursor(), device_id=device_id, parameter=parameter)
+            if not series:
+                return
+            filtered = bool(device_id or parameter)
+            
+            hot = {day: name for name, day, _ in partitions.list_partitions(conn, start, end)}
+            days = sorted(set(hot) | set(chunks.list_days(conn, start, end)))
+            
+            for day in days:
+                sources = []
+                if day in hot:
+                    sources.extend(
+                        self._stream_partition(conn, hot[day], start, end, series_id)
+                        for series_id in (series if filtered else [None])
+                    )
+                sources.extend(chunks.stream(conn, series_id, day, start, end) for series_id in series)
+                
+                for row in heapq.merge(*sources, key=lambda row: (row['ts'], row['id'])):
+                    yield self._row_to_metric(row, series[row['series_id']])
+        finally:
+            conn.close()
+    
+    def _stream_partition(self, conn, name, start=None, end=None, series_id=None):
+        """Lazily iterate one partition in (ts, id) ascending order"""
+        query = f'SELECT id, series_id, ts, value, value_text FROM {name} WHERE 1=1'
         params = []
         
-        if device_id:
-            query += ' AND device_id = ?'
-            params.append(device_id)
+        if series_id is not None:
+            query += ' AND series_id = ?'
+            params.append(series_id)
+        
+        if start is not None:
+            query += ' AND ts >= ?'
+            params.append(start)
+        
+        if end is not None:
+            query += ' AND ts < ?'
+            params.append(end)
+        
+        return conn.execute(query + ' ORDER BY ts, id', params)
+    
+    def _scan_partition(self, db, name, limit, start=None, end=None, cursor=None, series_id=None):
+        """Read up to limit rows of one partition in (ts, id) descending order"""
+        query = f'SELECT id, series_id, ts, value, value_text FROM {name} WHERE 1=1'
+        params = []
+        
+        if series_id is not None:
+            query += ' AND series_id = ?'
+            params.append(series_id)
+        
+        if start is not None:
+            query += ' AND ts >= ?'
+            params.append(start)
+        
+        if end is not None:
+            query += ' AND ts < ?'
+            params.append(end)
         
-        if parameter:
-            query += ' AND parameter = ?'
-            params.append(parameter)
+        if cursor is not None:
+            # The plain ts bound keeps the index range scan; the OR breaks ties on id
+            query += ' AND ts <= ? AND (ts < ? OR id < ?)'
+            params.extend([cursor[0], cursor[0], cursor[1]])
         
-        query += ' ORDER BY timestamp DESC LIMIT ?'
+        query += ' ORDER BY ts DESC, id DESC LIMIT ?'
         params.append(limit)
         
+        db.execute(query, params)
+        return db.fetchall()
+    
+    def _find_series(self, cursor, device_id=None, parameter=None, location=None):
+        """Get {series_id: series row} for series matching the filters
+        
+        Each filter accepts a single value or a list of values.
+        """
+        query = 'SELECT * FROM series WHERE 1=1'
+        params = []
+        
+        for column, value in (('device_id', device_id), ('parameter', parameter), ('location', location)):
+            if not value:
+                continue
+            
+            values = [value] if isinstance(value, str) else list(value)
+            query += f" AND {column} IN ({','.join('?' * len(values))})"
+            params.extend(values)
+        
         cursor.execute(query, params)
-        rows = cursor.fetchall()
+        return {row['series_id']: dict(row) for row in cursor.fetchall()}
+    
+    def get_metric_series(self, start, end, step, device_id=None, parameter=None, location=None):
+        """Get aggregated points between start and end (epoch ms) at the given step
+        
+        Reads from the coarsest rollup whose bucket fits inside the step, or
+        from the overlapping raw partitions and chunks when the step is finer
+        than one minute.
+        """
+        resolution, bucket_ms = rollups.choose_resolution(step)
+        
+        conn = self._connect(snapshot=True)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        series = self._find_series(cursor, device_id=device_id, parameter=parameter, location=location)
+        raw_partitions = partitions.list_partitions(conn, start, end) if resolution == 'raw' else []
+        
+        points = []
+        for series_id, info in series.items():
+            if resolution == 'raw':
+                rows = []
+                for name, _, _ in raw_partitions:
+                    cursor.execute(f'''
+                        SELECT series_id, ts, value AS min, value AS max, value AS sum, 1 AS count, value AS last
+                        FROM {name}
+                        WHERE series_id = ? AND ts >= ? AND ts < ? AND value IS NOT NULL
+                        ORDER BY ts
+                    ''', (series_id, start, end))
+                    rows.extend(cursor.fetchall())
+                
+                for row in chunks.scan(conn, [series_id], start, end, newest_first=False):
+                    if row['value'] is not None:
+                        value = row['value']
+                        rows.append((series_id, row['ts'], value, value, value, 1, value))
+                rows.sort(key=lambda row: row[1])
+            else:
+                cursor.execute(f'''
+                    SELECT series_id, bucket, min, max, sum, count, last
+                    FROM {rollups.table_name(resolution)}
+                    WHERE series_id = ? AND bucket >= ? AND bucket < ?
+                    ORDER BY bucket
+                ''', (series_id, start - start % bucket_ms, end))
+                rows = cursor.fetchall()
+            
+            for _, bucket, lo, hi, total, count, last in rollups.rebucket(rows, step):
+                points.append({
+                    'device_id': info['device_id'],
+                    'parameter': info['parameter'],
+                    'location': info['location'],
+                    'unit': info['unit'],
+                    'timestamp': from_epoch_ms(bucket),
+                    'min': lo,
+                    'max': hi,
+                    'avg': total / count if count else None,
+                    'count': count,
+                    'last': last
+                })
         
-        metrics = [dict(row) for row in rows]
         conn.close()
         
-        return metrics
+        return resolution, points
     
-    def store_alarm(self, alarm):
-        """Store or update alarm"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _row_to_metric(self, row, series):
+        """Rebuild the unified metric dict from a sample row and its series"""
+        return {
+            'id': row['id'],
+            'device_id': series['device_id'],
+            'device_type': series['device_type'],
+            'protocol': series['protocol'],
+            'location': series['location'],
+            'parameter': series['parameter'],
+            'value': join_value(row['value'], row['value_text']),
+            'unit': series['unit'],
+            'timestamp': from_epoch_ms(row['ts'])
+        }
+    
+    def enforce_retention(self, now=None):
+        """Drop expired raw partitions and trim rollups per Config.RETENTION_DAYS"""
+        now = now or int(time.time() * 1000)
+        retention = Config.RETENTION_DAYS
+        
+        def apply(conn):
+            dropped = partitions.drop_before(conn, now - retention['raw'] * partitions.DAY_MS)
+            chunks.drop_before(conn, now - retention['raw'] * partitions.DAY_MS)
+            
+            trimmed = 0
+            series_ids = [row[0] for row in conn.execute('SELECT series_id FROM series')]
+            for name, _ in rollups.RESOLUTIONS:
+                trimmed += rollups.trim(conn, name, now - retention[name] * partitions.DAY_MS, series_ids)
+            
+            return dropped, trimmed
         
-        # Generate alarm_id for deduplication
-        alarm_id = f"{alarm['device_id']}_{alarm['category']}_{alarm['type']}"
-        
-        # Check if alarm already exists
-        cursor.execute('SELECT * FROM alarms WHERE alarm_id = ? AND state != ?', 
-                      (alarm_id, 'CLOSED'))
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Update existing alarm
-            cursor.execute('''
-                UPDATE alarms 
-                SET last_seen = ?, 
-                    occurrence_count = occurrence_count + 1,
-                    severity = ?,
-                    message = ?,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE alarm_id = ? AND state != ?
-            ''', (
-                alarm['timestamp'],
-                alarm['severity'],
-                alarm['message'],
-                alarm_id,
-                'CLOSED'
-            ))
-            print(f"[Storage] Updated alarm {alarm_id} (occurrence +1)")
-        else:
-            # Create new alarm
-            cursor.execute('''
-                INSERT INTO alarms (alarm_id, device_id, device_type, protocol, 
-                                  location, type, category, severity, state, 
-                                  message, first_seen, last_seen)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                alarm_id,
+        # Runs on the writer thread so drops never race with inserts
+        dropped, trimmed = self.writer.call(apply)
+        
+        if dropped or trimmed:
+            print(f"[Storage] Retention dropped {len(dropped)} partitions, trimmed {trimmed} rollup rows")
+        
+        return dropped
+    
+    def compact(self, now=None):
+        """Move raw partitions older than Config.COLD_AFTER_DAYS into compressed chunks
+        
+        Each partition is compacted in its own writer task so ingest keeps
+        flowing between them. Returns the number of partitions compacted.
+        """
+        now = now or int(time.time() * 1000)
+        cutoff = partitions.day_start(now) - Config.COLD_AFTER_DAYS * partitions.DAY_MS
+        
+        conn = self._connect()
+        cold = [name for name, _, end_ts in partitions.list_partitions(conn) if end_ts <= cutoff]
+        conn.close()
+        
+        for name in cold:
+            samples, hot_bytes, chunk_bytes = self.writer.call(lambda conn, name=name: self._compact_partition(conn, name))
+            
+            self.compaction_stats['partitions'] += 1
+            self.compaction_stats['samples'] += samples
+            self.compaction_stats['hot_bytes'] += hot_bytes
+            self.compaction_stats['chunk_bytes'] += chunk_bytes
+            
+            ratio = hot_bytes / chunk_bytes if chunk_bytes else 0
+            print(f"[Storage] Compacted {name}: {samples} samples, "
+                  f"{hot_bytes / 1024:.1f}KB -> {chunk_bytes / 1024:.1f}KB ({ratio:.1f}x)")
+        
+        return len(cold)
+    
+    def _compact_partition(self, conn, name):
+        """Rewrite one partition as chunks and drop it (runs on the writer thread)"""
+        hot_bytes = self._table_bytes(conn, name)
+        
+        samples = chunk_bytes = payload_bytes = 0
+        rows = conn.execute(f'SELECT series_id, id, ts, value, value_text FROM {name} ORDER BY series_id, ts, id')
+        for series_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+            points = [row[1:] for row in group]
+            chunk_bytes += chunks.write_chunks(conn, series_id, points, Config.CHUNK_SIZE)
+            samples += len(points)
+            # id, series_id, ts and value at 8 bytes each plus any text
+            payload_bytes += sum(32 + len(point[3] or '') for point in points)
+        
+        if hot_bytes is None:
+            # No dbstat: fall back to the row payload, ignoring page and index overhead
+            hot_bytes = payload_bytes
+        
+        conn.execute(f'DROP TABLE {name}')
+        conn.execute('DELETE FROM partitions WHERE name = ?', (name,))
+        return samples, hot_bytes, chunk_bytes
+    
+    def _table_bytes(self, conn, name):
+        """Get the on-disk bytes of a table and its indexes, or None without dbstat"""
+        try:
+            row = conn.execute(
+                'SELECT SUM(pgsize) FROM dbstat WHERE name = ? OR name IN '
+                '(SELECT name FROM sqlite_master WHERE type = \'index\' AND tbl_name = ?)',
+                (name, name)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return row[0] or 0
+    
+    def get_compaction_stats(self):
+        """Get cold-tier size and the compression ratio achieved by compaction"""
+        conn = self._connect()
+        stats = chunks.summarize(conn)
+        conn.close()
+        
+        stats.update(self.compaction_stats)
+        hot, cold = stats['hot_bytes'], stats['chunk_bytes']
+        stats['compression_ratio'] = round(hot / cold, 2) if cold else None
+        return stats
+    
+    def upsert_alarms(self, alarms):
+        """Create or update non-closed alarms in one batch
+        
+        alarms is a list of (alarm, occurrences) pairs. A new alarm_id is
+        inserted with occurrence_count = occurrences; an existing non-closed
+        alarm gets last_seen/severity/message refreshed and its count bumped.
+        Runs on the storage writer thread.
+        """
+        rows = [
+            (
+                alarm_id_for(alarm),
                 alarm['device_id'],
                 alarm.get('device_type'),
                 alarm.get('protocol'),
@@ -195,37 +702,66 @@ class Storage:
                 alarm['type'],
                 alarm.get('category'),
                 alarm['severity'],
-                alarm['state'],
+                alarm.get('state', 'OPEN'),
                 alarm['message'],
-                alarm['timestamp'],
-                alarm['timestamp']
-            ))
-            print(f"[Storage] Created new alarm {alarm_id}")
+                alarm.get('first_seen', alarm.get('timestamp')),
+                alarm.get('last_seen', alarm.get('timestamp')),
+                occurrences
+            )
+            for alarm, occurrences in alarms
+        ]
+        if not rows:
+            return
         
-        conn.commit()
+        def upsert(conn):
+            conn.executemany('''
+                INSERT INTO alarms (alarm_id, device_id, device_type, protocol,
+                                  location, type, category, severity, state,
+                                  message, first_seen, last_seen, occurrence_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (alarm_id) WHERE state != 'CLOSED' DO UPDATE SET
+                    last_seen = excluded.last_seen,
+                    severity = excluded.severity,
+                    message = excluded.message,
+                    occurrence_count = occurrence_count + excluded.occurrence_count,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', rows)
+        
+        self.writer.call(upsert)
+        print(f"[Storage] Upserted {len(rows)} alarms")
+    
+    def get_active_alarms(self):
+        """Get every non-closed alarm"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT * FROM alarms WHERE state != 'CLOSED'")
+        alarms = [dict(row) for row in cursor.fetchall()]
         conn.close()
+        
+        return alarms
     
-    def update_alarm_state(self, alarm_id, new_state):
-        """Update alarm state"""
-        conn = sqlite3.connect(self.db_path)
+    def update_alarm_state(self, alarm_id, new_state, timestamp=None):
+        """Update the state of the non-closed alarm with this alarm_id"""
+        conn = self._connect()
         cursor = conn.cursor()
         
-        timestamp_field = None
-        if new_state == 'ACK':
-            timestamp_field = 'acknowledged_at'
-        elif new_state == 'RESOLVED':
-            timestamp_field = 'resolved_at'
-        elif new_state == 'CLOSED':
-            timestamp_field = 'closed_at'
+        # Alarm updates are the other SQLite writer besides the metric writer
+        started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        telemetry.observe('nms_sqlite_lock_wait_seconds', time.perf_counter() - started, connection='alarms')
+        
+        timestamp_field = state_timestamp_field(new_state)
         
         query = 'UPDATE alarms SET state = ?, updated_at = CURRENT_TIMESTAMP'
         params = [new_state]
         
         if timestamp_field:
             query += f', {timestamp_field} = ?'
-            params.append(datetime.utcnow().isoformat() + 'Z')
+            params.append(timestamp or datetime.utcnow().isoformat() + 'Z')
         
-        query += ' WHERE alarm_id = ?'
+        query += " WHERE alarm_id = ? AND state != 'CLOSED'"
         params.append(alarm_id)
         
         cursor.execute(query, params)
@@ -236,7 +772,7 @@ class Storage:
     
     def get_alarms(self, state=None, severity=None, limit=100):
         """Retrieve alarms from database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -262,39 +798,80 @@ class Storage:
         
         return alarms
     
+    def get_alarm_statistics(self):
+        """Get alarm counts per state and active counts per severity"""
+        conn = self._connect()
+        rows = conn.execute('SELECT state, severity, count FROM alarm_stats').fetchall()
+        conn.close()
+        
+        return alarm_stats.summarize(rows)
+    
     def get_device_summary(self):
-        """Get summary of all devices"""
-        conn = sqlite3.connect(self.db_path)
+        """Get summary of all devices from the materialized device_state table"""
+        conn = self._connect()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
-        # Get latest metric timestamp per device
         cursor.execute('''
-            SELECT device_id, device_type, protocol, location,
-                   MAX(timestamp) as last_seen,
-                   COUNT(*) as metric_count
-            FROM metrics
-            GROUP BY device_id
+            SELECT * FROM device_state
+            WHERE last_seen IS NOT NULL
             ORDER BY device_id
         ''')
         
-        devices = [dict(row) for row in cursor.fetchall()]
-        
-        # Add alarm counts
-        for device in devices:
-            cursor.execute('''
-                SELECT state, COUNT(*) as count
-                FROM alarms
-                WHERE device_id = ? AND state != 'CLOSED'
-                GROUP BY state
-            ''', (device['device_id'],))
-            
-            alarm_counts = {row['state']: row['count'] for row in cursor.fetchall()}
-            device['active_alarms'] = sum(alarm_counts.values())
-            device['alarm_breakdown'] = alarm_counts
+        devices = []
+        for row in cursor.fetchall():
+            alarm_counts = {
+                state: row[column]
+                for state, column in device_state.ALARM_STATE_COLUMNS.items()
+                if row[column]
+            }
+            devices.append({
+                'device_id': row['device_id'],
+                'device_type': row['device_type'],
+                'protocol': row['protocol'],
+                'location': row['location'],
+                'last_seen': from_epoch_ms(row['last_seen']),
+                'metric_count': row['metric_count'],
+                'active_alarms': sum(alarm_counts.values()),
+                'alarm_breakdown': alarm_counts
+            })
         
         conn.close()
         return devices
+    
+    def save_state(self, name, data):
+        """Durably replace the bytes saved under name (on the writer thread)"""
+        def save(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO saved_state (name, updated_at, data) VALUES (?, ?, ?)',
+                (name, int(time.time() * 1000), sqlite3.Binary(data))
+            )
+        
+        self.writer.call(save)
+    
+    def load_state(self, name):
+        """Get the bytes last saved under name, or None"""
+        conn = self._connect()
+        row = conn.execute('SELECT data FROM saved_state WHERE name = ?', (name,)).fetchone()
+        conn.close()
+        return bytes(row[0]) if row else None
+
+def create_storage(backend=None):
+    """Create the storage backend named by Config.STORAGE_BACKEND"""
+    backend = backend or Config.STORAGE_BACKEND
+    
+    if backend == 'sqlite':
+        return Storage()
+    
+    if backend == 'memory':
+        from storage.memory_backend import MemoryStorage
+        return MemoryStorage()
+    
+    if backend == 'segment_log':
+        from storage.segment_log import SegmentLogStorage
+        return SegmentLogStorage()
+    
+    raise ValueError(f"Unknown storage backend: {backend}")
 
 # Global storage instance
-storage = Storage()
+storage = create_storage()
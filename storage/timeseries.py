@@ -0,0 +1,94 @@
+"""
+Time-Series Encoding Helpers
+Conversions between the unified metric format (ISO timestamps, mixed-type
+values) and the numeric storage format (epoch milliseconds, REAL values with
+an optional text value for status-like parameters)
+"""
+import base64
+from datetime import datetime, timezone
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def to_epoch_ms(timestamp):
+    """Convert an ISO-8601 timestamp (or epoch ms) to integer epoch milliseconds"""
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp)
+    
+    parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    
+    delta = parsed - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+def from_epoch_ms(ms):
+    """Convert epoch milliseconds back to the ISO-8601 format used by the API"""
+    seconds, millis = divmod(int(ms), 1000)
+    parsed = datetime.fromtimestamp(seconds, tz=timezone.utc).replace(microsecond=millis * 1000)
+    return parsed.replace(tzinfo=None).isoformat(timespec='milliseconds') + 'Z'
+
+def split_value(value):
+    """Split a metric value into (numeric value, text value)
+    
+    Numbers (and numeric strings) are stored as REAL; anything else, such as
+    interface_*_status values like 'up'/'down', is kept as text.
+    """
+    if value is None:
+        return None, None
+    
+    if isinstance(value, (int, float)):
+        return float(value), None
+    
+    try:
+        return float(value), None
+    except (ValueError, TypeError):
+        return None, str(value)
+
+def join_value(value, value_text):
+    """Inverse of split_value for API responses"""
+    if value_text is not None:
+        return value_text
+    
+    if value is not None and value.is_integer():
+        return int(value)
+    
+    return value
+
+def parse_time(value):
+    """Parse an API time parameter given as epoch milliseconds or ISO-8601"""
+    if value is None or value == '':
+        return None
+    
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    
+    return to_epoch_ms(value)
+
+_DURATION_UNITS = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+
+def parse_duration(value):
+    """Parse a step such as '30s', '5m', '1h', '1d' (bare numbers are seconds) into ms"""
+    if value is None or value == '':
+        return None
+    
+    value = str(value).strip().lower()
+    if value[-1] in _DURATION_UNITS:
+        return int(float(value[:-1]) * _DURATION_UNITS[value[-1]])
+    
+    return int(float(value) * 1000)
+
+def encode_cursor(ts, row_id):
+    """Encode a (ts, id) keyset position as an opaque page cursor"""
+    return base64.urlsafe_b64encode(f'{ts}:{row_id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Decode a page cursor back to (ts, id); raises ValueError when malformed"""
+    if not token:
+        return None
+    
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        ts, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        return int(ts), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {token}') from e
@@ -0,0 +1,336 @@
+"""
+Metric Writer
+Single background writer thread that owns the SQLite connection used for
+metric ingest. Collector callbacks only enqueue batches; the writer drains
+the queue and coalesces them into large executemany transactions.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import queue
+import sqlite3
+import threading
+import time
+from config.config import Config
+from storage.timeseries import to_epoch_ms, split_value
+from storage import rollups
+from storage import partitions
+from storage import device_state
+from storage import chunks
+from pipeline.telemetry import telemetry
+
+# Queue sentinels
+_STOP = object()
+
+class _Task:
+    """A function run on the writer connection, in order with queued metrics"""
+    def __init__(self, fn):
+        self.fn = fn
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+    
+    def run(self, conn):
+        try:
+            with conn:
+                self.result = self.fn(conn)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+class MetricWriter:
+    def __init__(self, db_path, batch_size=None, flush_interval=None, synchronous=None):
+        self.db_path = db_path
+        self.batch_size = batch_size or Config.WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.WRITER_FLUSH_INTERVAL
+        self.synchronous = synchronous or Config.DB_SYNCHRONOUS
+        
+        self.queue = queue.Queue(maxsize=Config.WRITER_QUEUE_SIZE)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        
+        # Caches owned by the writer thread
+        self._series = {}  # (device_id, parameter) -> series_id
+        self._partitions = set()  # day start (epoch ms) of known partitions
+        self._next_id = None
+        
+        self.stats = {
+            'transactions': 0,
+            'rows_written': 0,
+            'last_rows_per_txn': 0,
+            'max_rows_per_txn': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'errors': 0,
+        }
+    
+    def start(self):
+        """Start the writer thread (idempotent)"""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            
+            self._thread = threading.Thread(target=self._run, name='storage-writer', daemon=True)
+            self._thread.start()
+            telemetry.gauge('nms_writer_queue_depth', self.queue.qsize, 'Metric batches and tasks queued for the storage writer')
+            print(f"[Storage Writer] Started (batch={self.batch_size}, interval={self.flush_interval}s)")
+    
+    def submit(self, metrics):
+        """Queue a batch of normalized metrics for writing"""
+        if not metrics:
+            return
+        
+        self.start()
+        self.queue.put(list(metrics))
+    
+    def call(self, fn, timeout=None):
+        """Run fn(conn) in its own transaction on the writer thread and return its result"""
+        self.start()
+        task = _Task(fn)
+        self.queue.put(task)
+        
+        if not task.done.wait(timeout):
+            raise TimeoutError('Storage writer did not run task in time')
+        if task.error:
+            raise task.error
+        return task.result
+    
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been committed (False on timeout)"""
+        if not self._thread:
+            return True
+        if not self._thread.is_alive():
+            # Whatever is still queued will not be written until the writer restarts
+            return self.queue.empty()
+        
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+    
+    def close(self, timeout=10):
+        """Flush pending metrics and stop the writer thread"""
+        if not self._thread or not self._thread.is_alive():
+            return
+        
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        print(f"[Storage Writer] Stopped ({self.stats['rows_written']} rows in "
+              f"{self.stats['transactions']} transactions)")
+    
+    def failures(self):
+        """Batches that failed to commit so far; compare before submit and after flush"""
+        with self._stats_lock:
+            return self.stats['errors']
+    
+    def get_stats(self):
+        """Get writer counters (rows per transaction, flush latency)"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        
+        txns = stats['transactions']
+        stats['avg_rows_per_txn'] = round(stats['rows_written'] / txns, 1) if txns else 0
+        stats['avg_flush_ms'] = round(stats['total_flush_ms'] / txns, 2) if txns else 0
+        stats['total_flush_ms'] = round(stats['total_flush_ms'], 2)
+        stats['queue_depth'] = self.queue.qsize()
+        return stats
+    
+    def _connect(self):
+        """Open the long-lived writer connection"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        
+        self._partitions = {row[1] for row in partitions.list_partitions(conn)}
+        # Compacted samples keep their ids, so ids continue past the cold tier too
+        self._next_id = max(partitions.max_sample_id(conn), chunks.max_sample_id(conn)) + 1
+        return conn
+    
+    def _series_id(self, conn, metric):
+        """Resolve (device, parameter) to its series_id
+        
+        The first sighting in each writer session registers the series or
+        refreshes its metadata (type, protocol, location, unit).
+        """
+        key = (metric['device_id'], metric['parameter'])
+        series_id = self._series.get(key)
+        if series_id is not None:
+            return series_id
+        
+        conn.execute('''
+            INSERT INTO series (device_id, device_type, protocol, location, parameter, unit)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (device_id, parameter) DO UPDATE SET
+                device_type = excluded.device_type,
+                protocol = excluded.protocol,
+                location = excluded.location,
+                unit = excluded.unit
+        ''', (
+            metric['device_id'],
+            metric.get('device_type'),
+            metric.get('protocol'),
+            metric.get('location'),
+            metric['parameter'],
+            metric.get('unit')
+        ))
+        series_id = conn.execute(
+            'SELECT series_id FROM series WHERE device_id = ? AND parameter = ?', key
+        ).fetchone()[0]
+        
+        self._series[key] = series_id
+        return series_id
+    
+    def _run(self):
+        """Writer loop: drain the queue and flush by size or time"""
+        conn = self._connect()
+        pending = []
+        control = []
+        deadline = None
+        stopping = False
+        
+        while not stopping:
+            timeout = None
+            if pending:
+                timeout = max(0.0, deadline - time.monotonic())
+            
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            
+            # Greedily coalesce whatever else is already queued
+            while item is not None:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, (threading.Event, _Task)):
+                    control.append(item)
+                elif item:
+                    if not pending:
+                        deadline = time.monotonic() + self.flush_interval
+                    pending.extend(item)
+                
+                if stopping or len(pending) >= self.batch_size:
+                    break
+                
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            
+            due = pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline)
+            write = due or (pending and (control or stopping))
+            try:
+                if write:
+                    self._write_batch(conn, pending)
+            
+                # Flush waiters and tasks run after the metrics queued before them
+                for item in control:
+                    if isinstance(item, _Task):
+                        item.run(conn)
+                        # Tasks may create or drop partitions (e.g. retention)
+                        self._partitions = {row[1] for row in partitions.list_partitions(conn)}
+            except Exception as e:
+                # Never let the thread die: later batches and every waiter below must still run
+                with self._stats_lock:
+                    self.stats['errors'] += 1
+                print(f"[Storage Writer] Unexpected error: {e}")
+            finally:
+                if write:
+                    pending = []
+                    deadline = None
+                for item in control:
+                    if isinstance(item, _Task):
+                        if not item.done.is_set():
+                            item.error = RuntimeError('Storage writer failed before running task')
+                            item.done.set()
+                    else:
+                        item.set()
+                control = []
+        
+        conn.close()
+    
+    def _write_batch(self, conn, metrics):
+        """Write one coalesced batch in a single transaction"""
+        started = time.perf_counter()
+        try:
+            with conn:
+                # Take the write lock up front so the wait for it can be measured
+                conn.execute('BEGIN IMMEDIATE')
+                telemetry.observe('nms_sqlite_lock_wait_seconds', time.perf_counter() - started, connection='writer')
+                
+                rows = []
+                numeric = []
+                devices = {}
+                for metric in metrics:
+                    try:
+                        ts = to_epoch_ms(metric['timestamp'])
+                        value, value_text = split_value(metric['value'])
+                        series_id = self._series_id(conn, metric)
+                    except KeyError as e:
+                        print(f"[Storage Writer] Skipping metric without {e}")
+                        continue
+                    except (ValueError, TypeError, AttributeError):
+                        print(f"[Storage Writer] Skipping metric with bad timestamp: {metric.get('timestamp')}")
+                        continue
+                    
+                    rows.append((self._next_id, series_id, ts, value, value_text))
+                    self._next_id += 1
+                    if value is not None:
+                        numeric.append((series_id, ts, value))
+                    
+                    device = devices.get(metric['device_id'])
+                    devices[metric['device_id']] = (
+                        metric.get('device_type'),
+                        metric.get('protocol'),
+                        metric.get('location'),
+                        max(ts, device[3]) if device else ts,
+                        device[4] + 1 if device else 1
+                    )
+                
+                # Route rows to their daily partition
+                by_day = {}
+                for row in rows:
+                    by_day.setdefault(partitions.day_start(row[2]), []).append(row)
+                
+                for day, day_rows in by_day.items():
+                    if day not in self._partitions:
+                        partitions.create_partition(conn, day)
+                        self._partitions.add(day)
+                    
+                    conn.executemany(
+                        f'INSERT INTO {partitions.partition_name(day)} (id, series_id, ts, value, value_text) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        day_rows
+                    )
+                
+                # Keep 1m/1h/1d aggregates current in the same transaction
+                rollups.apply(conn, numeric)
+                
+                # Per-device last_seen and metric count for the device summary
+                device_state.apply(conn, devices)
+        except Exception as e:
+            # Any error rolls the whole batch back; series and partitions created in it too
+            self._series = {}
+            self._partitions = {row[1] for row in partitions.list_partitions(conn)}
+            with self._stats_lock:
+                self.stats['errors'] += 1
+            print(f"[Storage Writer] Error writing {len(metrics)} metrics: {e}")
+            return
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        telemetry.observe('nms_storage_write_seconds', elapsed_ms / 1000)
+        telemetry.observe('nms_storage_write_rows', len(rows))
+        
+        with self._stats_lock:
+            self.stats['transactions'] += 1
+            self.stats['rows_written'] += len(rows)
+            self.stats['last_rows_per_txn'] = len(rows)
+            self.stats['max_rows_per_txn'] = max(self.stats['max_rows_per_txn'], len(rows))
+            self.stats['last_flush_ms'] = round(elapsed_ms, 2)
+            self.stats['max_flush_ms'] = round(max(self.stats['max_flush_ms'], elapsed_ms), 2)
+            self.stats['total_flush_ms'] += elapsed_ms
+        
+        print(f"[Storage Writer] Stored {len(rows)} metrics in {elapsed_ms:.1f}ms")